@@ -0,0 +1,308 @@
+# artifacts.py — Content-addressed media store on disk, served by reference instead of from Python memory
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "ai-video-artifacts"))
+ARTIFACT_MAX_BYTES = int(float(os.environ.get("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024)
+ARTIFACT_TTL = float(os.environ.get("ARTIFACT_TTL_HOURS", "24")) * 3600
+CHUNK = 1024 * 1024
+_NAME = re.compile(r"([0-9a-f]{64})\.([a-z0-9]{1,8})")
+mimetypes.add_type("audio/webm", ".webm")
+mimetypes.add_type("image/webp", ".webp")
+
+
+class ArtifactStore:
+    """Every distinct blob is written once, under its SHA-256 and file extension.
+
+    Like ResultCache, last access is tracked in each file's atime and the last
+    time a job stored it in its mtime, so several processes can share the
+    directory; entries expire `ttl` seconds after a job last stored them and
+    the least recently used go first once the store is over `max_bytes`. Jobs
+    keep only digests, so identical media from a cache hit or a reused prompt
+    costs no extra disk; digests a `pin` source reports in use by an
+    unfinished job are never evicted, whatever their age or the quota.
+    """
+
+    def __init__(self, directory=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES, ttl=ARTIFACT_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.writes = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self._pins = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, extension):
+        return os.path.join(self.directory, digest[:2], f"{digest}.{extension}")
+
+    def exists(self, digest, extension):
+        return os.path.exists(self.path(digest, extension))
+
+    def touch(self, path):
+        """Refresh the entry's LRU position, keeping its creation time"""
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def pin(self, source):
+        """Register source() -> digests unfinished work still needs (held in memory, as it runs on every write)"""
+        with self._lock:
+            self._pins.append(source)
+
+    def _pinned(self):
+        with self._lock:
+            sources = list(self._pins)
+        return set().union(*(source() for source in sources))
+
+    # ── write ──────────────────────────────────────────────
+    def put(self, data, extension):
+        """Store bytes (text as UTF-8) and return their digest"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, extension)
+        if self._known(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self._commit(tmp, path)
+        return digest
+
+    def put_file(self, source, extension):
+        """Store a file produced elsewhere (e.g. a render) without loading it whole; returns its digest"""
+        sha = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        path = self.path(digest, extension)
+        if self._known(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+        self._commit(tmp, path)
+        return digest
+
+    def _known(self, path):
+        if not os.path.exists(path):
+            return False
+        # Stored again, so its TTL restarts from this job
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        with self._lock:
+            self.deduplicated += 1
+        return True
+
+    def _commit(self, tmp, path):
+        os.replace(tmp, path)
+        with self._lock:
+            self.writes += 1
+        self.evict()
+
+    # ── read ───────────────────────────────────────────────
+    def read(self, digest, extension):
+        """The blob's bytes, or None once it has been evicted"""
+        path = self.path(digest, extension)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.touch(path)
+        return data
+
+    # ── eviction ───────────────────────────────────────────
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not _NAME.fullmatch(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.evictions += 1
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used ones until under max_bytes; pinned ones stay"""
+        now = time.time()
+        pinned = self._pinned()
+        live, total = [], 0
+        for path, st in self._entries():
+            total += st.st_size
+            if os.path.basename(path).partition(".")[0] in pinned:
+                continue
+            if self.ttl and now - st.st_mtime > self.ttl:
+                self._remove(path)
+                total -= st.st_size
+                continue
+            live.append((st.st_atime, st.st_size, path))
+        live.sort()
+        for _, size, path in live:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def stats(self):
+        entries = list(self._entries())
+        with self._lock:
+            return {"entries": len(entries), "bytes": sum(st.st_size for _, st in entries),
+                    "writes": self.writes, "deduplicated": self.deduplicated, "evictions": self.evictions}
+
+
+# ═══════════════════════════════════════════════════════════
+# SERVING BY REFERENCE
+# ═══════════════════════════════════════════════════════════
+
+def _artifact_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        """GET /<digest>.<ext>[?download=<filename>], with byte ranges so video and audio can seek"""
+
+        def do_GET(self):
+            name, _, query = self.path.lstrip("/").partition("?")
+            match = _NAME.fullmatch(name)
+            path = store.path(*match.groups()) if match else None
+            try:
+                f = open(path, "rb") if path else None
+            except OSError:
+                f = None
+            if f is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                start, end = 0, size - 1
+                ranged = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+                if ranged and size and any(ranged.groups()):
+                    first, last = ranged.groups()
+                    start, end = (int(first), min(int(last or size - 1), size - 1)) if first else (max(size - int(last), 0), size - 1)
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                # The name is the content's hash, so it never changes
+                self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                download = re.fullmatch(r"download=([\w.\-]+)", query)
+                if download:
+                    self.send_header("Content-Disposition", f'attachment; filename="{download.group(1)}"')
+                self.end_headers()
+                if end >= start:
+                    # Straight from the page cache to the socket, never through Python memory
+                    self.connection.sendfile(f, start, end - start + 1)
+                    metrics.ARTIFACT_BYTES.inc(end - start + 1, type=match.group(2))
+            store.touch(path)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_artifact_server(store, port=None, host="0.0.0.0"):
+    """Serve the store over HTTP (port from ARTIFACT_PORT) so media reaches the browser without passing
+    through a session; safe to call repeatedly"""
+    global _server
+    port = port or os.environ.get("ARTIFACT_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _artifact_handler(store))
+            threading.Thread(target=_server.serve_forever, name="artifact-server", daemon=True).start()
+        return _server
+
+
+def public_url():
+    """Base URL the browser reaches the artifact server at (ARTIFACT_URL, else localhost:ARTIFACT_PORT), or None"""
+    port = os.environ.get("ARTIFACT_PORT")
+    if not port:
+        return None
+    return os.environ.get("ARTIFACT_URL", f"http://localhost:{port}").rstrip("/")
+
+
+# ═══════════════════════════════════════════════════════════
+# PER-SESSION MEMORY ACCOUNTING
+# ═══════════════════════════════════════════════════════════
+
+def rss_bytes():
+    """Current resident set size of this process (Linux; 0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MemoryLedger:
+    """Media bytes each session last put in the process's memory (inline) vs. left on disk (by reference).
+
+    Inline bytes stay in Streamlit's media file store for as long as the
+    session shows them, so their sum across sessions, plus a baseline, is what
+    a worker needs; sessions not seen for `idle` seconds are dropped.
+    """
+
+    def __init__(self, idle=1800):
+        self.idle = idle
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def record(self, session, inline, referenced):
+        with self._lock:
+            self._sessions[session] = {"inline": inline, "referenced": referenced, "seen": time.time()}
+
+    def session(self, session):
+        with self._lock:
+            return dict(self._sessions.get(session, {"inline": 0, "referenced": 0}))
+
+    def stats(self):
+        cutoff = time.time() - self.idle
+        with self._lock:
+            for key in [k for k, v in self._sessions.items() if v["seen"] < cutoff]:
+                del self._sessions[key]
+            sessions = list(self._sessions.values())
+        return {"sessions": len(sessions), "inline": sum(s["inline"] for s in sessions),
+                "referenced": sum(s["referenced"] for s in sessions),
+                "max_inline": max((s["inline"] for s in sessions), default=0), "rss": rss_bytes()}
@@ -0,0 +1,320 @@
+# batch.py — Headless batch runner: JSONL of prompts → stories, images, narration and videos
+"""
+Usage:
+    python batch.py prompts.jsonl --out runs/overnight --jobs 8 \
+        --groq 4 --anthropic 4 --leonardo 2 --elevenlabs 6
+
+Each input line is either a JSON string or an object with a "prompt" (and
+optional "id"). Results are appended to <out>/manifest.jsonl as each job
+finishes; re-running with the same --out skips jobs already marked "ok".
+Local stand-ins (template story, placeholder image, espeak or silence) are
+off unless --local-fallbacks is given; a job they served is recorded as
+"degraded" with the backends used, and runs again on resume.
+API keys are read from the environment (or a .env file) using the same names
+as the Streamlit secrets.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import metrics
+import providers
+from budget import StoryBudget
+from cache import ResultCache
+from pipeline import Pipeline, Stage, StageFailed
+from providers import image_extension
+from rate_limit import build_limiters
+from storyboard import MAX_SCENES, Storyboard
+from video import encode_slideshow, encode_video, ffmpeg_available
+
+log = logging.getLogger("batch")
+_errors = threading.local()
+_fallbacks = threading.local()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0-100) of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# ═══════════════════════════════════════════════════════════
+# INPUT / MANIFEST
+# ═══════════════════════════════════════════════════════════
+
+def read_prompts(path):
+    """Yield (job_id, prompt) from a JSONL file; ids default to a hash of the prompt"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                log.warning("line %d is not valid JSON, skipping", line_no)
+                continue
+            prompt = item if isinstance(item, str) else item.get("prompt")
+            if not prompt:
+                log.warning("line %d has no prompt, skipping", line_no)
+                continue
+            job_id = (item.get("id") if isinstance(item, dict) else None) or hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+            yield str(job_id), prompt
+
+
+class Manifest:
+    """Append-only JSONL record of finished jobs, fsynced so a crash loses at most one line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("status") == "ok":
+                        self.done.add(entry["id"])
+
+    def append(self, entry):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            if entry.get("status") == "ok":
+                self.done.add(entry["id"])
+
+
+# ═══════════════════════════════════════════════════════════
+# JOB EXECUTION
+# ═══════════════════════════════════════════════════════════
+
+def _collect_error(message):
+    getattr(_errors, "messages", []).append(message)
+    log.debug(message)
+
+
+def _collect_fallback(stage, backend):
+    used = getattr(_fallbacks, "used", None)
+    if used is not None:
+        used.append((stage, backend.name, backend.local))
+
+
+def mark_fallbacks(entry, used):
+    """Record the backends that stood in for a stage's primary; a job a local engine served is "degraded", not ok"""
+    if not used:
+        return
+    entry["fallbacks"] = {}
+    for stage, name, _ in used:
+        names = entry["fallbacks"].setdefault(stage, [])
+        if name not in names:
+            names.append(name)
+    if entry["status"] == "ok" and any(local for _, _, local in used):
+        entry["status"] = "degraded"
+
+
+def _checked(name, fn):
+    """Wrap a provider call so the last error reported while it ran becomes the stage failure message"""
+    def run(*args):
+        if getattr(_errors, "messages", None) is None:
+            _errors.messages = []
+        messages = _errors.messages
+        seen = len(messages)
+        value = fn(*args)
+        if not value or (isinstance(value, tuple) and not all(value)):
+            raise StageFailed(messages[-1] if len(messages) > seen else f"{name} returned no result")
+        return value
+    return run
+
+
+def build_job(prompt, cache, make_video, trace=None, budget=None, board=None, fallbacks=None):
+    """Story, then image + voice, then video; with a Storyboard the image stage returns one image per scene.
+
+    Fallback backends that serve any of its stages are appended to the `fallbacks` list, if given.
+    Provider errors, like fallbacks, are collected per job through the pipeline initializer, which
+    also runs on the storyboard's per-scene threads.
+    """
+    def image(story):
+        return board.images(story[1], cache) if board else providers.cached_image(cache, story[1])
+
+    def voice(story):
+        return board.narrate(story[1], cache) if board else providers.cached_voice(cache, story[1])
+
+    def video(pictures, audio):
+        return encode_slideshow(pictures, audio, board.timed(audio)) if board else encode_video(pictures, audio)
+
+    stages = [
+        Stage("story", _checked("story", lambda: providers.cached_story(cache, prompt, budget=budget))),
+        Stage("image", _checked("image", image), inputs=["story"]),
+        Stage("voice", _checked("voice", voice), inputs=["story"]),
+    ]
+    if make_video:
+        stages.append(Stage("video", video, inputs=["image", "voice"]))
+    errors = []
+
+    def bind():
+        _errors.messages = errors
+        _fallbacks.used = fallbacks
+    return Pipeline(stages, initializer=bind, trace=trace)
+
+
+def run_job(job_id, prompt, out_dir, cache, make_video, story_budget=None, scenes=1, batch_images=False):
+    """Run one prompt end to end and write its artifacts; returns the manifest entry"""
+    started = time.perf_counter()
+    entry = {"id": job_id, "prompt": prompt, "status": "ok", "artifacts": {}, "timings": {}}
+    job_dir = os.path.join(out_dir, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    trace = metrics.Trace(job_id)
+    budget = StoryBudget(story_budget) if story_budget else None
+    board = Storyboard(scenes, batch_images) if scenes > 1 else None
+    audio, fallbacks = None, []
+    for result in build_job(prompt, cache, make_video, trace, budget, board, fallbacks).run():
+        if not result.ok:
+            entry.update(status="failed", failed_stage=result.name, error=str(result.error))
+            break
+        entry["timings"][result.name] = round(result.elapsed, 3)
+        if result.name == "story":
+            raw, final_text = result.value
+            files = {"draft": ("draft.txt", raw), "story": ("story.txt", final_text)}
+            for key, (name, text) in files.items():
+                with open(os.path.join(job_dir, name), "w", encoding="utf-8") as f:
+                    f.write(text)
+                entry["artifacts"][key] = os.path.join(job_id, name)
+        elif result.name == "image" and board is not None:
+            entry["artifacts"]["scenes"] = []
+            for i, data in enumerate(result.value, 1):
+                name = f"scene{i:02d}.{image_extension(data)}"
+                with open(os.path.join(job_dir, name), "wb") as f:
+                    f.write(data)
+                entry["artifacts"]["scenes"].append(os.path.join(job_id, name))
+        elif result.name in ("image", "voice"):
+            name = f"image.{image_extension(result.value)}" if result.name == "image" else "voice.mp3"
+            if result.name == "voice":
+                audio = result.value
+            with open(os.path.join(job_dir, name), "wb") as f:
+                f.write(result.value)
+            entry["artifacts"][result.name] = os.path.join(job_id, name)
+        elif result.name == "video":
+            shutil.copyfile(result.value.path, os.path.join(job_dir, "video.mp4"))
+            entry["artifacts"]["video"] = os.path.join(job_id, "video.mp4")
+
+    entry["timings"]["total"] = round(time.perf_counter() - started, 3)
+    mark_fallbacks(entry, fallbacks)
+    if budget is not None and budget.path:
+        entry["story_path"] = budget.path
+    if board is not None and board.scenes:
+        if board.durations is None and audio:
+            board.timed(audio)
+        entry["scenes"] = board.rows()
+    entry["trace"] = trace.id
+    trace.finish()
+    return entry
+
+
+def report(entries, wall):
+    ok = [e for e in entries if e["status"] == "ok"]
+    degraded = sum(e["status"] == "degraded" for e in entries)
+    print(f"\n{len(ok)}/{len(entries)} jobs succeeded in {wall:.1f} s "
+          f"({len(ok) / wall * 60 if wall else 0:.1f} jobs/min)")
+    if degraded:
+        print(f"  {degraded} degraded — served by local fallbacks, run again on resume")
+    stages = sorted({name for e in ok for name in e["timings"]}, key=lambda n: (n == "total", n))
+    for name in stages:
+        values = [e["timings"][name] for e in ok if name in e["timings"]]
+        print(f"  {name:<6} p50 {percentile(values, 50):7.2f} s   p95 {percentile(values, 95):7.2f} s   (n={len(values)})")
+    scene_images = [row["image_s"] for e in ok for row in e.get("scenes", []) if row["image_s"] is not None]
+    if scene_images:
+        print(f"  scenes p50 {percentile(scene_images, 50):7.2f} s   p95 {percentile(scene_images, 95):7.2f} s   "
+              f"per scene image ({len(scene_images)} scenes)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the story → image/voice → video pipeline over a JSONL of prompts")
+    parser.add_argument("prompts", help="JSONL file of prompts")
+    parser.add_argument("--out", default="batch_output", help="output directory (also the resume point)")
+    parser.add_argument("--jobs", type=int, default=8, help="jobs in flight at once")
+    parser.add_argument("--groq", type=int, default=4, help="concurrent Groq calls")
+    parser.add_argument("--anthropic", type=int, default=4, help="concurrent Anthropic calls")
+    parser.add_argument("--leonardo", type=int, default=2, help="concurrent Leonardo generations")
+    parser.add_argument("--elevenlabs", type=int, default=2, help="concurrent ElevenLabs requests (each narration chunk takes its own slot)")
+    parser.add_argument("--no-video", action="store_true", help="skip MP4 encoding")
+    parser.add_argument("--no-cache", action="store_true", help="always call the providers")
+    parser.add_argument("--story-budget", type=float, help="seconds allowed for each story; Claude is skipped or time-boxed to fit")
+    parser.add_argument("--scenes", type=int, default=1, help=f"storyboard scenes per story (1-{MAX_SCENES}), each with its own image")
+    parser.add_argument("--batch-images", action="store_true", help="request all scene images from one Leonardo job (num_images)")
+    parser.add_argument("--local-fallbacks", action="store_true",
+                        help="let local engines stand in once every provider for a stage fails (jobs are marked degraded)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    load_dotenv()
+    keys = {name: os.environ.get(var) for name, var in [("groq", "GROQ_API_KEY"), ("anthropic", "ANTHROPIC_API_KEY"),
+                                                        ("leonardo", "LEONARDO_KEY"), ("elevenlabs", "ELEVENLABS_KEY")]}
+    missing = [name for name, key in keys.items() if not key]
+    if missing:
+        parser.error(f"missing API keys for: {', '.join(missing)}")
+    providers.configure(**keys)
+    metrics.start_metrics_server()
+    providers.on_error = providers.on_warning = _collect_error
+    providers.on_fallback = _collect_fallback
+    providers.use_local_fallbacks(args.local_fallbacks)
+    providers.LIMITS.update(build_limiters({name: {"concurrency": getattr(args, name)}
+                                            for name in ("groq", "anthropic", "leonardo", "elevenlabs")}))
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest = Manifest(os.path.join(args.out, "manifest.jsonl"))
+    todo = [(job_id, prompt) for job_id, prompt in read_prompts(args.prompts) if job_id not in manifest.done]
+    todo = list(dict(todo).items())
+    log.info("%d jobs to run, %d already done", len(todo), len(manifest.done))
+    make_video = not args.no_video and ffmpeg_available()
+    if not args.no_video and not make_video:
+        log.warning("ffmpeg not found, skipping video encoding")
+    cache = ResultCache(enabled=not args.no_cache)
+
+    entries = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_job, job_id, prompt, args.out, cache, make_video, args.story_budget,
+                                   min(max(args.scenes, 1), MAX_SCENES), args.batch_images): job_id
+                   for job_id, prompt in todo}
+        for future in as_completed(futures):
+            try:
+                entry = future.result()
+            except Exception as e:
+                entry = {"id": futures[future], "status": "failed", "error": str(e)}
+            manifest.append(entry)
+            entries.append(entry)
+            log.info("[%d/%d] %s %s %s", len(entries), len(todo), entry["id"], entry["status"], entry.get("error", ""))
+
+    if entries:
+        report(entries, time.perf_counter() - started)
+        for name, limiter in providers.LIMITS.items():
+            usage = limiter.stats()
+            print(f"  {name:<10} {usage['calls']} calls · {usage['wait_time']:.1f} s waiting for quota · {usage['api_time']:.1f} s in API")
+        for stage, router in providers.ROUTES.items():
+            for route in router.stats():
+                if route["calls"]:
+                    print(f"  {stage:<10} {route['backend']}: {route['calls']} calls · {route['error_rate']:.0%} errors · circuit {route['state']}")
+    return 0 if all(e["status"] == "ok" for e in entries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
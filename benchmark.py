@@ -0,0 +1,294 @@
+# benchmark.py — Repeatable load test of the real pipeline against local mock providers
+"""
+Usage:
+    python benchmark.py --jobs 40 --concurrency 8 --latency-scale 0.25 --save bench/baseline.json
+    python benchmark.py --jobs 40 --concurrency 8 --latency-scale 0.25 --baseline bench/baseline.json
+
+Starts mock_providers.py in a subprocess, points the provider base URLs at it
+and pushes prompts through the same story → image/voice stages the batch
+runner uses (create_story, generate_image and generate_voice with the result
+cache disabled). Reports end-to-end and per-stage p50/p95/p99, per-provider
+HTTP time, throughput and peak RSS; --save writes the results as JSON and
+--baseline prints the change against an earlier results file.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import mock_providers
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROMPTS = ["a lighthouse keeper who finds a message in a bottle", "a robot learning to paint at dawn",
+           "two rival chefs stranded on a snowy mountain", "a city where it rains upwards",
+           "an old map that redraws itself every night", "a fox guiding travellers through a haunted forest"]
+# Where each figure sits in the comparison: lower is better unless listed here
+HIGHER_IS_BETTER = {"throughput_per_min"}
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(values):
+    from batch import percentile
+    if not values:
+        return None
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "mean": sum(values) / len(values), "n": len(values)}
+
+
+# ═══════════════════════════════════════════════════════════
+# MOCK PROVIDERS
+# ═══════════════════════════════════════════════════════════
+
+def start_mock(args):
+    """Launch the mock servers; returns the process and their base-URL environment variables"""
+    cmd = [sys.executable, os.path.join(HERE, "mock_providers.py"), "--latency-scale", str(args.latency_scale)]
+    if args.profile:
+        cmd += ["--profile", args.profile]
+    if args.error_rate is not None:
+        cmd += ["--error-rate", str(args.error_rate)]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line:
+        proc.wait()
+        raise RuntimeError(f"mock providers exited with status {proc.returncode}")
+    return proc, json.loads(line)
+
+
+def stop_mock(proc):
+    """Stop the mock servers and return their request/error counters"""
+    proc.terminate()
+    out, _ = proc.communicate(timeout=10)
+    try:
+        return json.loads(out.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+
+
+# ═══════════════════════════════════════════════════════════
+# LOAD
+# ═══════════════════════════════════════════════════════════
+
+def run_one(prompt, cache, hosts, story_budget=None, scenes=1, batch_images=False):
+    """One job through the batch pipeline; returns its status, stage timings and span totals"""
+    import batch
+    import metrics
+    from budget import StoryBudget
+    from storyboard import Storyboard
+
+    started = time.perf_counter()
+    entry = {"status": "ok", "timings": {}, "spans": defaultdict(float)}
+    trace = metrics.Trace("benchmark")
+    budget = StoryBudget(story_budget) if story_budget else None
+    board = Storyboard(scenes, batch_images) if scenes > 1 else None
+    fallbacks = []
+    for result in batch.build_job(prompt, cache, make_video=False, trace=trace, budget=budget, board=board,
+                                  fallbacks=fallbacks).run():
+        if not result.ok:
+            entry.update(status="failed", error=str(result.error))
+            break
+        entry["timings"][result.name] = result.elapsed
+    entry["timings"]["total"] = time.perf_counter() - started
+    batch.mark_fallbacks(entry, fallbacks)
+    if budget is not None:
+        entry["story_path"] = budget.path
+        entry["hedges"] = budget.hedges
+    if board is not None and board.scenes:
+        entry["scene_images"] = [t["image"] for t in board.timings if "image" in t]
+    for row in trace.waterfall():
+        if row["kind"] == "http":
+            _, host = row["name"].split(" ", 1)
+            entry["spans"][f"http {hosts.get(host, host)}"] += row["duration"]
+        elif row["kind"] == "wait":
+            entry["spans"][row["name"]] += row["duration"]
+    return entry
+
+
+def run_load(prompts, concurrency, cache, hosts, **options):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+        entries = list(executor.map(lambda p: run_one(p, cache, hosts, **options), prompts))
+    return entries, time.perf_counter() - started
+
+
+def benchmark(args):
+    proc, env = start_mock(args)
+    try:
+        # The provider modules read their base URLs at import time
+        os.environ.update(env)
+        import batch
+        import http_client
+        import providers
+        from cache import ResultCache
+        from rate_limit import build_limiters
+
+        providers.configure(groq="mock", anthropic="mock", leonardo="mock", elevenlabs="mock")
+        providers.on_error = providers.on_warning = batch._collect_error
+        providers.on_fallback = batch._collect_fallback
+        providers.use_local_fallbacks(args.local_fallbacks)
+        if args.rate_limits:
+            providers.LIMITS.update(build_limiters())
+        hosts = {urlsplit(url).netloc: var.split("_")[0].lower() for var, url in env.items()}
+        cache = ResultCache(enabled=False)
+
+        if args.prompts:
+            pool = [prompt for _, prompt in batch.read_prompts(args.prompts)]
+        else:
+            pool = PROMPTS
+        prompts = [f"{pool[i % len(pool)]} (run {i})" for i in range(args.jobs)]
+
+        options = {"story_budget": args.story_budget, "scenes": args.scenes, "batch_images": args.batch_images}
+        if args.warmup:
+            # Primes connection pools and the Leonardo poll-schedule model
+            run_load(prompts[:args.warmup], args.concurrency, cache, hosts, **options)
+        entries, wall = run_load(prompts, args.concurrency, cache, hosts, **options)
+        connections = http_client.connection_stats()
+    finally:
+        mock_stats = stop_mock(proc)
+
+    ok = [e for e in entries if e["status"] == "ok"]
+    stages = sorted({name for e in ok for name in e["timings"]}, key=lambda n: (n == "total", n))
+    spans = sorted({name for e in ok for name in e["spans"]})
+    scene_images = [t for e in ok for t in e.get("scene_images", [])]
+    return {
+        "jobs": len(entries),
+        "ok": len(ok),
+        "degraded": sum(e["status"] == "degraded" for e in entries),
+        "failed": sum(e["status"] == "failed" for e in entries),
+        "wall": wall,
+        "throughput_per_min": len(ok) / wall * 60 if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {name: summarize([e["timings"][name] for e in ok if name in e["timings"]]) for name in stages},
+        "spans": {name: summarize([e["spans"].get(name, 0.0) for e in ok]) for name in spans},
+        "scene_images": summarize(scene_images),
+        "errors": Counter(e["error"] for e in entries if e["status"] == "failed").most_common(5),
+        "story_paths": dict(Counter(e["story_path"] for e in ok if e.get("story_path"))),
+        "hedges": sum(e.get("hedges", 0) for e in entries),
+        "connections": {hosts.get(host, host): stats for host, stats in connections.items()},
+        "mock": mock_stats,
+    }
+
+
+# ═══════════════════════════════════════════════════════════
+# REPORTING
+# ═══════════════════════════════════════════════════════════
+
+def _row(name, summary):
+    return (f"  {name:<22} p50 {summary['p50']:7.2f} s   p95 {summary['p95']:7.2f} s   "
+            f"p99 {summary['p99']:7.2f} s   (n={summary['n']})")
+
+
+def report(results):
+    print(f"\n{results['ok']}/{results['jobs']} jobs succeeded in {results['wall']:.1f} s "
+          f"({results['throughput_per_min']:.1f} jobs/min) · peak RSS {results['peak_rss_mb']:.0f} MB")
+    if results.get("degraded"):
+        print(f"  {results['degraded']} degraded — served by local fallbacks")
+    print("Stages:")
+    for name, summary in results["stages"].items():
+        print(_row(name, summary))
+    if results["scene_images"]:
+        print(_row("image per scene", results["scene_images"]))
+    print("Time per job by provider:")
+    for name, summary in results["spans"].items():
+        print(_row(name, summary))
+    if results["story_paths"]:
+        paths = ", ".join(f"{path} {count}" for path, count in sorted(results["story_paths"].items()))
+        print(f"Story paths: {paths} · {results['hedges']} hedged request(s)")
+    for message, count in results["errors"]:
+        print(f"  {count} × {message}")
+
+
+def flatten(results):
+    """The figures compared against a baseline, keyed by a readable name"""
+    figures = {"throughput_per_min": results["throughput_per_min"], "peak_rss_mb": results["peak_rss_mb"]}
+    for group in ("stages", "spans"):
+        for name, summary in results[group].items():
+            for q in ("p50", "p95", "p99"):
+                figures[f"{name} {q}"] = summary[q]
+    return figures
+
+
+def compare(current, baseline, max_regression=None):
+    """Print each figure's change against the baseline; returns the names that regressed too far"""
+    now, before = flatten(current), flatten(baseline)
+    regressions = []
+    print("\nAgainst baseline:")
+    for name in now:
+        if name not in before or not before[name]:
+            continue
+        change = (now[name] - before[name]) / before[name] * 100
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ""
+        if max_regression is not None and worse > max_regression:
+            flag = "  ← regression"
+            regressions.append(name)
+        print(f"  {name:<30} {before[name]:9.2f} → {now[name]:9.2f}   {change:+6.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against local mock providers")
+    parser.add_argument("--jobs", type=int, default=24, help="jobs to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="jobs in flight at once")
+    parser.add_argument("--warmup", type=int, default=0, help="extra jobs run first and left out of the results")
+    parser.add_argument("--prompts", help="JSONL of prompts (batch.py format) instead of the built-in set")
+    parser.add_argument("--profile", help="JSON file of mock endpoint overrides (see mock_providers.DEFAULT_PROFILE)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every mock latency by this factor")
+    parser.add_argument("--error-rate", type=float, help="error rate applied to every mock endpoint")
+    parser.add_argument("--seed", type=int, help="seed for the mock's latency and error sampling")
+    parser.add_argument("--rate-limits", action="store_true", help="queue through the default provider rate limits")
+    parser.add_argument("--local-fallbacks", action="store_true",
+                        help="let local engines stand in once every provider fails (those jobs count as degraded)")
+    parser.add_argument("--story-budget", type=float, help="per-story latency budget in seconds (hedging + Claude skip/time-box)")
+    parser.add_argument("--scenes", type=int, default=1, help="storyboard scenes per story, each with its own image")
+    parser.add_argument("--batch-images", action="store_true", help="one Leonardo job with num_images per storyboard")
+    parser.add_argument("--name", help="label stored with the results")
+    parser.add_argument("--save", help="write the results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="exit non-zero if any figure is this many percent worse than the baseline")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args)
+    report(results)
+    record = {
+        "name": args.name or datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "created": time.time(),
+        "python": platform.python_version(),
+        "config": {"jobs": args.jobs, "concurrency": args.concurrency, "warmup": args.warmup,
+                   "rate_limits": args.rate_limits, "story_budget": args.story_budget, "scenes": args.scenes,
+                   "batch_images": args.batch_images, "seed": args.seed,
+                   "profile": mock_providers.load_profile(args.profile, args.latency_scale, args.error_rate)},
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != record["config"]:
+            print("Note: the baseline was recorded with a different configuration")
+        if compare(results, baseline["results"], args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
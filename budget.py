@@ -0,0 +1,261 @@
+# budget.py — Live provider latency tracking, per-request latency budgets and hedged requests
+import contextlib
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import pipeline
+
+_local = threading.local()
+
+# Seconds; stand in for live samples until a provider has answered a few times
+PRIORS = {
+    "groq": (0.6, 0.9, 1.2, 1.8, 3.0),
+    "groq:ttft": (0.2, 0.3, 0.4, 0.6, 1.0),
+    "anthropic": (2.5, 3.5, 4.5, 6.0, 9.0),
+    "anthropic:ttft": (0.5, 0.7, 0.9, 1.3, 2.0),
+}
+# A duplicate request is sent once the first has been outstanding this long (as a quantile)
+HEDGE_QUANTILE = 0.9
+PATHS = {
+    "full": "✨ Enhanced with Claude",
+    "timeboxed": "✨ Enhanced with Claude inside a time box",
+    "skipped": "📄 Draft only — not enough budget left for Claude",
+    "timed-out": "📄 Draft only — Claude ran past the time box",
+}
+
+
+class AttemptLost(Exception):
+    """Raised inside a hedged attempt once another attempt has won the race"""
+
+
+class BudgetExceeded(Exception):
+    """A time-boxed call did not finish within the time it was given"""
+
+
+# ═══════════════════════════════════════════════════════════
+# LIVE LATENCY
+# ═══════════════════════════════════════════════════════════
+
+class LatencyTracker:
+    """Rolling window of call durations per provider ("groq") and time-to-first-token ("groq:ttft")"""
+
+    def __init__(self, window=100, min_samples=5):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def warmed_up(self, key):
+        with self._lock:
+            return len(self.samples.get(key, ())) >= self.min_samples
+
+    def quantile(self, key, q):
+        with self._lock:
+            samples = self.samples.get(key, ())
+            data = sorted(samples) if len(samples) >= self.min_samples else sorted(PRIORS.get(key, (1.0,)))
+        return data[min(int(q * len(data)), len(data) - 1)]
+
+    def stats(self):
+        with self._lock:
+            keys = sorted(self.samples)
+        return {key: {"samples": len(self.samples[key]), "p50": self.quantile(key, 0.5),
+                      "p90": self.quantile(key, 0.9)} for key in keys}
+
+
+TRACKER = LatencyTracker()
+
+
+@contextlib.contextmanager
+def on_dispatch(callback):
+    """Call `callback()` whenever a provider call inside this block, on this thread, goes out (see dispatched)"""
+    hooks = getattr(_local, "dispatch", ())
+    _local.dispatch = hooks + (callback,)
+    try:
+        yield
+    finally:
+        _local.dispatch = hooks
+
+
+def dispatcher():
+    """This thread's dispatch callbacks as one function, for provider calls made on other threads"""
+    hooks = getattr(_local, "dispatch", ())
+
+    def notify():
+        for callback in hooks:
+            callback()
+    return notify
+
+
+def dispatched():
+    """A provider call holds its quota slot and is going out now: latency is measured, and hedges timed, from here"""
+    dispatcher()()
+
+
+class StoryBudget:
+    """Seconds allowed for the story stage, and how they were spent"""
+
+    def __init__(self, seconds, tracker=None):
+        self.seconds = seconds
+        self.tracker = tracker or TRACKER
+        self.started = None
+        self.decision = None
+        self.expected = None
+        self.path = None
+        self.used = None
+        self.hedges = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def remaining(self):
+        return self.seconds - (time.perf_counter() - self.started)
+
+    @property
+    def enhanced(self):
+        return self.path in ("full", "timeboxed")
+
+    def plan(self):
+        """Run Claude if its p90 fits in the time left, time-box it if only its p50 does, else skip it"""
+        left = self.remaining()
+        p50, p90 = self.tracker.quantile("anthropic", 0.5), self.tracker.quantile("anthropic", 0.9)
+        self.expected = (p50, p90)
+        if p90 <= left:
+            self.decision = "run"
+        elif p50 <= left or (left > 0 and not self.tracker.warmed_up("anthropic")):
+            # Without live samples the priors are only a guess, so try rather than skip forever
+            self.decision = "timebox"
+        else:
+            self.decision = "skip"
+        return self.decision
+
+    def finish(self, path):
+        self.path = path
+        self.used = time.perf_counter() - self.started
+        metrics.STORY_PATHS.inc(path=path)
+
+    def summary(self):
+        if self.path is None:
+            return "⏱️ Budget not used"
+        parts = [PATHS[self.path], f"{self.used:.1f} s of {self.seconds:.1f} s budget ({self.used / self.seconds:.0%})"]
+        if self.expected:
+            parts.append(f"Claude p50 {self.expected[0]:.1f} s / p90 {self.expected[1]:.1f} s")
+        if self.hedges:
+            parts.append(f"{self.hedges} hedged request(s)")
+        return " · ".join(parts)
+
+
+# ═══════════════════════════════════════════════════════════
+# HEDGED REQUESTS
+# ═══════════════════════════════════════════════════════════
+
+def hedged(attempt, delay=None, max_attempts=2, on_text=None, timeout=None, name="request"):
+    """Run attempt(emit), racing a duplicate if nothing has come back `delay` seconds after it went out.
+
+    The clock starts when the attempt is dispatched (has its quota slot), so a
+    request still queued for quota is never duplicated, which would only spend
+    more of the quota that is short.
+
+    The first attempt to emit partial text (or to finish) wins. Its text reaches
+    `on_text` on the calling thread, so UI callbacks keep the script context, and
+    the other attempts' next emit raises AttemptLost so their streams are dropped.
+    A failed attempt starts its replacement straight away. Raises BudgetExceeded
+    if `timeout` passes without a finished winner; returns (value, attempts_started).
+    """
+    events = queue.Queue()
+    lock = threading.Lock()
+    race = {"winner": None, "closed": False}
+    trace, parent = metrics.current_trace(), metrics.current_parent()
+
+    def claim(i):
+        with lock:
+            if race["winner"] is None and not race["closed"]:
+                race["winner"] = i
+            return race["winner"] == i and not race["closed"]
+
+    def run(i):
+        def emit(text):
+            if not claim(i):
+                raise AttemptLost(f"{name} attempt {i + 1} lost the race")
+            events.put(("text", i, text))
+
+        try:
+            with metrics.use_trace(trace, parent), metrics.span(f"{name} #{i + 1}", kind="hedge") as span, \
+                    on_dispatch(lambda: events.put(("sent", i, None))):
+                try:
+                    value = attempt(emit)
+                except AttemptLost:
+                    span.attrs["lost"] = True
+                    events.put(("lost", i, None))
+                    return
+            events.put(("done", i, value))
+        except Exception as e:
+            events.put(("error", i, e))
+
+    executor = ThreadPoolExecutor(max_workers=max_attempts, thread_name_prefix="hedge")
+    started = time.monotonic()
+    launched = running = 0
+    next_hedge = None
+
+    def launch():
+        nonlocal launched, running, next_hedge
+        executor.submit(run, launched)
+        launched += 1
+        running += 1
+        # Armed once this attempt is dispatched
+        next_hedge = None
+
+    try:
+        launch()
+        while True:
+            if pipeline.cancelled():
+                raise RuntimeError(f"{name} cancelled")
+            waits = [0.25]
+            if next_hedge is not None and launched < max_attempts:
+                waits.append(next_hedge - time.monotonic())
+            if timeout is not None:
+                waits.append(started + timeout - time.monotonic())
+            try:
+                kind, i, payload = events.get(timeout=max(min(waits), 0))
+            except queue.Empty:
+                now = time.monotonic()
+                if timeout is not None and now - started >= timeout:
+                    raise BudgetExceeded(f"{name} did not finish within {timeout:.1f} s")
+                if next_hedge is not None and now >= next_hedge and launched < max_attempts and race["winner"] is None:
+                    launch()
+                continue
+
+            if kind == "sent":
+                if i == launched - 1 and delay is not None:
+                    next_hedge = time.monotonic() + delay
+                continue
+            if kind == "text":
+                if on_text and race["winner"] == i:
+                    on_text(payload)
+                continue
+            running -= 1
+            if kind == "done" and claim(i):
+                flush = getattr(on_text, "flush", None)
+                if flush:
+                    flush()
+                for hedge in range(1, launched):
+                    metrics.HEDGES.inc(name=name, outcome="won" if hedge == i else "lost")
+                return payload, launched
+            if kind == "error":
+                if race["winner"] == i:
+                    raise payload
+                if launched < max_attempts and race["winner"] is None:
+                    launch()
+                elif running == 0:
+                    raise payload
+    finally:
+        with lock:
+            race["closed"] = True
+        executor.shutdown(wait=False, cancel_futures=True)
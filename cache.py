@@ -0,0 +1,159 @@
+# cache.py — Content-addressed, disk-backed cache for generated stories, images and audio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "ai-video-cache")
+
+
+def make_key(stage, model, params, text):
+    """Stable hash of everything that determines a provider's output"""
+    material = json.dumps([stage, model, params, text], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU + TTL cache storing text as JSON and media as raw bytes.
+
+    Last access is tracked in each file's atime and creation in its mtime, so the
+    cache survives restarts and can be shared by several worker processes.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=500 * 1024 * 1024, ttl=7 * 24 * 3600, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # ── paths ──────────────────────────────────────────────
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key[:2], f"{key}.{ext}")
+
+    def _find(self, key):
+        for ext in ("bin", "json"):
+            path = self._path(key, ext)
+            if os.path.exists(path):
+                return path, ext
+        return None, None
+
+    # ── read / write ───────────────────────────────────────
+    def get(self, key):
+        """Return the cached value or None; refreshes the entry's LRU position"""
+        path, ext = self._find(key)
+        value = None
+        if path:
+            try:
+                st = os.stat(path)
+                if self.ttl and time.time() - st.st_mtime > self.ttl:
+                    self._remove(path)
+                else:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    value = data if ext == "bin" else json.loads(data.decode("utf-8"))
+                    os.utime(path, (time.time(), st.st_mtime))
+            except (OSError, ValueError):
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store bytes as-is and anything else as JSON, then enforce the size bound"""
+        if isinstance(value, (bytes, bytearray)):
+            ext, data = "bin", bytes(value)
+        else:
+            ext, data = "json", json.dumps(value, ensure_ascii=False).encode("utf-8")
+        path = self._path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            self.writes += 1
+        self.evict()
+
+    def get_or_compute(self, stage, model, params, text, compute, bypass=False, keep=None):
+        """Serve from cache when possible; failed (None / falsy) results, or ones `keep` rejects, are never stored"""
+        if bypass or not self.enabled:
+            return compute()
+        key = make_key(stage, model, params, text)
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = compute()
+        if value and (keep is None or keep(value)):
+            self.put(key, value)
+        return value
+
+    # ── eviction ───────────────────────────────────────────
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.evictions += 1
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used ones until under max_bytes"""
+        now = time.time()
+        live, total = [], 0
+        for path, st in self._entries():
+            if self.ttl and now - st.st_mtime > self.ttl:
+                self._remove(path)
+                continue
+            live.append((st.st_atime, st.st_size, path))
+            total += st.st_size
+        live.sort()
+        for _, size, path in live:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for path, _ in list(self._entries()):
+            self._remove(path)
+
+    def stats(self):
+        entries = list(self._entries())
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": sum(st.st_size for _, st in entries),
+            }
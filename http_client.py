@@ -0,0 +1,144 @@
+# http_client.py — Pooled keep-alive sessions with timeouts and retry/backoff for every provider
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import pipeline
+
+# (connect, read) timeouts in seconds per pipeline stage
+TIMEOUTS = {
+    "story": (5, 60),
+    "image": (5, 30),
+    "image_poll": (5, 15),
+    "download": (5, 60),
+    "voice": (5, 120),
+}
+DEFAULT_TIMEOUT = (5, 30)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+
+
+class ProviderClient:
+    """One pooled requests.Session per provider host, reused across reruns and sessions"""
+
+    def __init__(self, host, pool_size=32, retries=3, backoff=0.5, max_backoff=8.0):
+        self.host = host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, attempt, response=None):
+        """Full-jitter exponential backoff, honouring a numeric Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, stage=None, timeout=None, **kwargs):
+        """Send a request inside a tracing span; see _send for the retry policy"""
+        method = method.upper()
+        parts = urlsplit(url)
+        with metrics.span(f"{method} {self.host}", kind="http", path=parts.path, stage=stage) as span:
+            response = self._send(method, url, timeout or TIMEOUTS.get(stage, DEFAULT_TIMEOUT), span, **kwargs)
+            body = response.request.body if response.request is not None else None
+            sent = len(body) if isinstance(body, (bytes, str)) else 0
+            # Streamed bodies are not read here, so fall back to Content-Length
+            received = len(response.content) if not kwargs.get("stream") else int(response.headers.get("Content-Length") or 0)
+            span.attrs.update(status=response.status_code, bytes_out=sent, bytes_in=received)
+            metrics.HTTP_BYTES_SENT.inc(sent, host=self.host)
+            metrics.HTTP_BYTES_RECEIVED.inc(received, host=self.host)
+            metrics.HTTP_RESPONSES.inc(host=self.host, status=response.status_code)
+            if response.status_code >= 400:
+                span.attrs["error"] = f"HTTP {response.status_code}"
+            return response
+
+    def _send(self, method, url, timeout, span, **kwargs):
+        """Retry connection errors and 429/5xx responses with jittered backoff"""
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A read timeout on a POST may already have been billed upstream
+                retryable = not isinstance(e, requests.ReadTimeout) or method in IDEMPOTENT
+                if not retryable or attempt >= self.retries or pipeline.sleep(self._delay(attempt)):
+                    with self._lock:
+                        self.failures += 1
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                if pipeline.sleep(self._delay(attempt, response)):
+                    return response
+                response.close()
+            attempt += 1
+            span.attrs["retries"] = attempt
+            metrics.HTTP_RETRIES.inc(host=self.host)
+            with self._lock:
+                self.retried += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Request counts plus how many of them reused a pooled keep-alive connection"""
+        # The pools requests actually sent through; looking one up by URL would key it differently and make a new one
+        pools = self.adapter.poolmanager.pools
+        opened = sum(pool.num_connections for pool in filter(None, map(pools.get, pools.keys())))
+        with self._lock:
+            sent = self.requests
+            return {
+                "requests": sent,
+                "retries": self.retried,
+                "failures": self.failures,
+                "connections_opened": opened,
+                "connections_reused": max(sent - opened, 0),
+                "reuse_rate": max(sent - opened, 0) / sent if sent else 0.0,
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    """Process-wide client for the host of `url`"""
+    host = urlsplit(url).netloc
+    with _clients_lock:
+        client = _clients.get(host)
+        if client is None:
+            client = _clients[host] = ProviderClient(host)
+        return client
+
+
+def get(url, **kwargs):
+    return get_client(url).get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_client(url).post(url, **kwargs)
+
+
+def connection_stats():
+    """Per-host request, retry and connection-reuse counters"""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {host: client.stats() for host, client in sorted(clients.items())}
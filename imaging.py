@@ -0,0 +1,134 @@
+# imaging.py — Decode generated images once and derive web-optimized display and thumbnail renditions
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+import metrics
+import pipeline
+
+DISPLAY_SIZE = (1024, 1024)
+THUMBNAIL_SIZE = (320, 320)
+QUALITY = 80
+# PIL format name → (file extension, MIME type)
+FORMATS = {
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+    "GIF": ("gif", "image/gif"),
+}
+WEBP = features.check("webp")
+
+
+class Rendition:
+    """Encoded bytes of one version of an image"""
+
+    def __init__(self, data, fmt, size):
+        self.data = data
+        self.format = fmt
+        self.size = size
+
+    @property
+    def extension(self):
+        return FORMATS.get(self.format, ("bin",))[0]
+
+    @property
+    def mime(self):
+        return FORMATS.get(self.format, ("", "application/octet-stream"))[1]
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ProcessedImage:
+    """A generated image as downloaded, plus the smaller renditions the UI shows"""
+
+    def __init__(self, original, display, thumbnail, elapsed):
+        self.original = original
+        self.display = display
+        self.thumbnail = thumbnail
+        self.elapsed = elapsed
+
+    @property
+    def saved(self):
+        """Bytes kept off the page by showing the display rendition instead of the original"""
+        return len(self.original) - len(self.display)
+
+    def summary(self):
+        if self.original.format is None:
+            return f"🗜️ Unrecognized image format · {len(self.original) / 1024:.0f} KB shown as-is"
+        width, height = self.original.size
+        parts = [f"🗜️ {width}×{height} {self.original.format} {len(self.original) / 1024:.0f} KB"]
+        if self.display is self.original:
+            parts.append("shown as-is")
+        else:
+            parts.append(f"shown as {self.display.format} {len(self.display) / 1024:.0f} KB "
+                         f"(−{self.saved / len(self.original):.0%})")
+        parts.append(f"thumbnail {len(self.thumbnail) / 1024:.0f} KB")
+        parts.append(f"processed in {self.elapsed * 1000:.0f} ms")
+        return " · ".join(parts)
+
+
+def _encode(im, quality):
+    """WebP where Pillow supports it, otherwise a progressive JPEG"""
+    buffer = io.BytesIO()
+    if WEBP:
+        im.save(buffer, "WEBP", quality=quality, method=4)
+        return Rendition(buffer.getvalue(), "WEBP", im.size)
+    if im.mode != "RGB":
+        flat = Image.new("RGB", im.size, (255, 255, 255))
+        flat.paste(im, mask=im.getchannel("A") if "A" in im.getbands() else None)
+        im = flat
+    im.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    return Rendition(buffer.getvalue(), "JPEG", im.size)
+
+
+def process_image(data, display_size=DISPLAY_SIZE, thumbnail_size=THUMBNAIL_SIZE, quality=QUALITY):
+    """Decode once, then encode a display rendition and a thumbnail from the decoded pixels.
+
+    The display rendition is only used when it is actually smaller than the
+    original; bytes PIL cannot decode are passed through untouched.
+    """
+    started = time.perf_counter()
+    with metrics.span("image post-processing", kind="cpu", bytes_in=len(data)) as span:
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                original = Rendition(data, im.format, im.size)
+                # JPEG can decode straight at a reduced scale when the display size is smaller
+                im.draft("RGB", display_size)
+                alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+                pixels = im.convert("RGBA" if alpha else "RGB")
+        except OSError:
+            passthrough = Rendition(data, None, (0, 0))
+            return ProcessedImage(passthrough, passthrough, passthrough, time.perf_counter() - started)
+
+        pixels.thumbnail(display_size, Image.LANCZOS, reducing_gap=3.0)
+        display = _encode(pixels, quality)
+        if len(display) >= len(original) and display.size == original.size and original.format in FORMATS:
+            display = original
+        pixels.thumbnail(thumbnail_size, Image.LANCZOS, reducing_gap=2.0)
+        thumbnail = _encode(pixels, quality)
+        span.attrs["bytes_out"] = len(display)
+
+    metrics.IMAGE_BYTES.inc(len(original), rendition="original")
+    metrics.IMAGE_BYTES.inc(len(display), rendition="display")
+    metrics.IMAGE_BYTES.inc(len(thumbnail), rendition="thumbnail")
+    return ProcessedImage(original, display, thumbnail, time.perf_counter() - started)
+
+
+def process_images(images, **kwargs):
+    """process_image over several images in parallel (Pillow releases the GIL while coding)"""
+    if len(images) == 1:
+        return [process_image(images[0], **kwargs)]
+    with ThreadPoolExecutor(max_workers=min(len(images), 4), thread_name_prefix="imaging") as executor:
+        return list(executor.map(pipeline.propagate(lambda data: process_image(data, **kwargs)), images))
+
+
+def savings_summary(images, rendition="display"):
+    """One line for a set of processed images: original bytes against the rendition put on the page"""
+    original = sum(len(image.original) for image in images) or 1
+    shown = sum(len(getattr(image, rendition)) for image in images)
+    return (f"🗜️ {len(images)} images · {original / 1024:.0f} KB of originals shown as {shown / 1024:.0f} KB "
+            f"of {rendition}s (−{(original - shown) / original:.0%}) · processed in "
+            f"{max(image.elapsed for image in images) * 1000:.0f} ms")
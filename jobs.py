@@ -0,0 +1,341 @@
+# jobs.py — Background generation jobs that outlive Streamlit reruns and reconnects
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+log = logging.getLogger("jobs")
+_local = threading.local()
+
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "ai-video-jobs"))
+# Generations running at once in this process; further submissions wait in the queue
+MAX_JOBS = int(os.environ.get("MAX_JOBS", "2"))
+ACTIVE = ("queued", "running")
+_JOB_ID = re.compile(r"[0-9a-f]{12}")
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while it was running"""
+
+
+def job_key(prompt, settings):
+    """Identity of a request: identical prompt + settings while one is in flight share a job"""
+    return hashlib.sha256(json.dumps({"prompt": prompt, "settings": settings}, sort_keys=True).encode()).hexdigest()
+
+
+def _extension(filename):
+    return os.path.splitext(filename)[1].lstrip(".").lower() or "bin"
+
+
+def bind(job):
+    """Attach `job` to this thread so provider messages reach it (used as a pipeline initializer)"""
+    _local.job = job
+
+
+def current():
+    return getattr(_local, "job", None)
+
+
+def notify(kind):
+    """Callback posting `kind` messages ("error", "warning") to the job running on this thread"""
+    def post(message):
+        job = current()
+        if job is None:
+            log.warning(message)
+        else:
+            job.message(kind, message)
+    return post
+
+
+# ═══════════════════════════════════════════════════════════
+# JOB
+# ═══════════════════════════════════════════════════════════
+
+class Job:
+    """One generation: state and streamed text in memory, mirrored to a directory.
+
+    With a `store` (an ArtifactStore) the media lives there, written once per
+    distinct content and recorded here by digest; without one it goes in the
+    job directory.
+    """
+
+    # Persisted to job.json; everything else is live state of the process running the job
+    FIELDS = ("id", "key", "prompt", "settings", "status", "created", "started", "finished", "error",
+              "progress", "running", "draft", "story", "messages", "artifacts", "info")
+
+    def __init__(self, job_id, key, prompt, settings, directory, store=None):
+        self.id = job_id
+        self.key = key
+        self.prompt = prompt
+        self.settings = settings
+        self.directory = directory
+        self.store = store
+        self.status = "queued"
+        self.created = time.time()
+        self.started = self.finished = None
+        self.error = None
+        self.progress = 0.0
+        self.running = []
+        self.draft = self.story = None
+        self.messages = []
+        self.artifacts = {}
+        self.info = {}
+        self.waiting = {}
+        self.preview = None
+        self.version = 0
+        self.cancel_event = threading.Event()
+        self._lock = threading.RLock()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+
+    def message(self, kind, text):
+        with self._lock:
+            self.messages.append([kind, text])
+            self.version += 1
+
+    def set_info(self, **values):
+        with self._lock:
+            self.info.update(values)
+            self.version += 1
+
+    def snapshot(self):
+        """A consistent copy of the state for rendering"""
+        with self._lock:
+            state = {name: getattr(self, name) for name in self.FIELDS}
+            state.update(messages=list(self.messages), artifacts=dict(self.artifacts), info=dict(self.info),
+                         running=list(self.running), waiting=dict(self.waiting), preview=self.preview,
+                         version=self.version)
+            return state
+
+    # ── artifacts ──────────────────────────────────────────
+
+    def save(self, name, data, filename, mime=None):
+        """Write an artifact (text is stored as UTF-8)"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.store is not None:
+            return self._record(name, filename, mime, len(data), self.store.put(data, _extension(filename)))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self._record(name, filename, mime, len(data))
+
+    def attach(self, name, source, filename, mime=None):
+        """Take in a file produced elsewhere, e.g. a render, by hard link where possible"""
+        if self.store is not None:
+            size = os.path.getsize(source)
+            return self._record(name, filename, mime, size, self.store.put_file(source, _extension(filename)))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        self._record(name, filename, mime, os.path.getsize(path))
+
+    def _record(self, name, filename, mime, size, digest=None):
+        with self._lock:
+            self.artifacts[name] = {"file": filename, "mime": mime, "bytes": size}
+            if digest:
+                self.artifacts[name]["digest"] = digest
+            self.version += 1
+
+    def path(self, name):
+        artifact = self.artifacts.get(name)
+        if not artifact:
+            return None
+        stored = self.stored(name)
+        return self.store.path(*stored) if stored else os.path.join(self.directory, artifact["file"])
+
+    def stored(self, name):
+        """(digest, extension) of an artifact kept in the store, else None"""
+        artifact = self.artifacts.get(name)
+        if not artifact or not artifact.get("digest") or self.store is None:
+            return None
+        return artifact["digest"], _extension(artifact["file"])
+
+    def read(self, name):
+        path = self.path(name)
+        if path is None or not os.path.exists(path):
+            return None
+        if self.stored(name):
+            self.store.touch(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    # ── persistence ────────────────────────────────────────
+
+    def persist(self):
+        with self._lock:
+            state = {name: getattr(self, name) for name in self.FIELDS}
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "job.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, default=str)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory, store=None):
+        with open(os.path.join(directory, "job.json"), encoding="utf-8") as f:
+            state = json.load(f)
+        job = cls(state["id"], state["key"], state["prompt"], state["settings"], directory, store)
+        for name in cls.FIELDS:
+            setattr(job, name, state.get(name, getattr(job, name)))
+        return job
+
+
+# ═══════════════════════════════════════════════════════════
+# MANAGER
+# ═══════════════════════════════════════════════════════════
+
+class JobManager:
+    """Worker pool running at most `max_jobs` jobs at once, outside any script run.
+
+    Jobs are looked up by id, so a rerun or a reconnecting session picks up
+    the same job; finished jobs from an earlier process are read back from
+    disk, and ones that process left unfinished are reported as interrupted.
+    Artifacts go to `store` when one is given; the store's own TTL and size
+    quota decide how long they outlive their job, and it never evicts those
+    of a job still queued or running here.
+    """
+
+    def __init__(self, directory=JOB_DIR, max_jobs=MAX_JOBS, max_age=24 * 3600, store=None):
+        self.directory = directory
+        self.store = store
+        self.max_jobs = max_jobs
+        self.max_age = max_age
+        self._jobs = {}
+        self._queue = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="job")
+        if store is not None:
+            store.pin(self.referenced)
+        self.cleanup()
+
+    def submit(self, prompt, settings, work):
+        """Queue work(job) for this request, or return the identical job already in flight"""
+        key = job_key(prompt, settings)
+        self.cleanup()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and job.active:
+                    metrics.JOBS.inc(event="deduplicated")
+                    return job
+            job_id = uuid.uuid4().hex[:12]
+            job = self._jobs[job_id] = Job(job_id, key, prompt, settings,
+                                             os.path.join(self.directory, job_id), self.store)
+            self._queue.append(job_id)
+        job.persist()
+        metrics.JOBS.inc(event="submitted")
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        with self._lock:
+            self._queue.remove(job.id)
+        if job.cancel_event.is_set():
+            return self._finish(job, "cancelled")
+        job.update(status="running", started=time.time())
+        job.persist()
+        bind(job)
+        try:
+            work(job)
+            self._finish(job, "cancelled" if job.cancel_event.is_set() else "done")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            if job.cancel_event.is_set():
+                return self._finish(job, "cancelled")
+            log.exception("job %s failed", job.id)
+            self._finish(job, "failed", error=str(e))
+        finally:
+            bind(None)
+
+    def _finish(self, job, status, error=None):
+        job.update(status=status, error=error, finished=time.time(), running=[], waiting={}, preview=None,
+                   progress=1.0 if status == "done" else job.progress)
+        job.persist()
+        metrics.JOBS.inc(event=status)
+
+    def get(self, job_id):
+        """The job with this id from memory or disk, or None"""
+        if not job_id or not _JOB_ID.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        directory = os.path.join(self.directory, job_id)
+        try:
+            job = Job.load(directory, self.store)
+        except (OSError, ValueError, KeyError):
+            return None
+        if job.active:
+            # The process that was running it has gone
+            job.update(status="interrupted", error="The app restarted before this job finished")
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and job.active:
+            job.cancel_event.set()
+            if job.status == "queued":
+                job.message("warning", "Cancelled before it started")
+
+    def position(self, job):
+        """1-based place in the queue of a job waiting for a worker, else 0"""
+        with self._lock:
+            return self._queue.index(job.id) + 1 if job.id in self._queue else 0
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            queued = len(self._queue)
+        return {"running": sum(job.status == "running" for job in jobs), "queued": queued,
+                "finished": sum(not job.active for job in jobs), "max_jobs": self.max_jobs}
+
+    def referenced(self):
+        """Digests of the artifacts of the jobs still queued or running, which a later stage may yet read"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.active]
+        digests = set()
+        for job in jobs:
+            with job._lock:
+                digests.update(a["digest"] for a in job.artifacts.values() if a.get("digest"))
+        return digests
+
+    def cleanup(self):
+        """Forget and delete finished jobs older than `max_age` seconds"""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if not job.active and (job.finished or job.created) < cutoff:
+                    del self._jobs[job_id]
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            path = os.path.join(self.directory, name)
+            try:
+                if name not in self._jobs and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path)
+            except OSError:
+                continue
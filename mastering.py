@@ -0,0 +1,266 @@
+# mastering.py — Narration post-processing: chunked PCM decode, loudness normalization, silence trimming, re-encoding
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import metrics
+import pipeline
+from tts import mp3_duration
+from video import ffmpeg_available
+
+SAMPLE_RATE = 48000
+# PCM is decoded and processed a second at a time, so memory stays flat however long the narration is
+CHUNK_SECONDS = 1.0
+FRAME_SECONDS = 0.01
+TARGET_RMS_DB = -20.0
+PEAK_CEILING_DB = -1.0
+MAX_GAIN_DB = 20.0
+SILENCE_DB = -45.0
+# Silence kept either side of the speech so the first and last words are not clipped
+PAD_SECONDS = 0.15
+# codec → (ffmpeg encoder, container, MIME type, file extension)
+CODECS = {
+    "opus": ("libopus", "webm", "audio/webm", "webm"),
+    "mp3": ("libmp3lame", "mp3", "audio/mpeg", "mp3"),
+    "aac": ("aac", "adts", "audio/aac", "aac"),
+}
+PLAYBACK = ("opus", "48k")
+DOWNLOAD = ("mp3", "128k")
+
+
+class AudioProcessingFailed(Exception):
+    """ffmpeg could not decode or encode the narration, or the run was cancelled"""
+
+
+class EncodedAudio:
+    """Narration bytes in one codec"""
+
+    def __init__(self, data, codec, bitrate=None):
+        self.data = data
+        self.codec = codec
+        self.bitrate = bitrate
+
+    @property
+    def mime(self):
+        return CODECS[self.codec][2]
+
+    @property
+    def extension(self):
+        return CODECS[self.codec][3]
+
+    def __len__(self):
+        return len(self.data)
+
+
+class MasteredAudio:
+    """The narration as received, its playback and download encodings, and the levels measured on the way"""
+
+    def __init__(self, original, playback, download, duration, source_duration, trimmed=(0.0, 0.0),
+                 rms_db=None, peak_db=None, gain_db=0.0, elapsed=0.0, note=None):
+        self.original = original
+        self.playback = playback
+        self.download = download
+        self.duration = duration
+        self.source_duration = source_duration
+        self.trimmed = trimmed
+        self.rms_db = rms_db
+        self.peak_db = peak_db
+        self.gain_db = gain_db
+        self.elapsed = elapsed
+        self.note = note
+
+    @property
+    def saved(self):
+        """Bytes kept off the page by playing the playback encoding instead of the original"""
+        return len(self.original) - len(self.playback)
+
+    def summary(self):
+        if self.note:
+            return f"🎚️ {self.note} · {self.duration:.1f} s · {len(self.original) / 1024:.0f} KB"
+        parts = [f"🎚️ {self.duration:.1f} s (trimmed {sum(self.trimmed):.2f} s of silence)",
+                 f"RMS {self.rms_db:.1f} dBFS · peak {self.peak_db:.1f} dBFS ({self.gain_db:+.1f} dB gain)",
+                 f"{self.playback.codec} {self.playback.bitrate} {len(self.playback) / 1024:.0f} KB vs "
+                 f"{len(self.original) / 1024:.0f} KB received (−{self.saved / len(self.original):.0%})",
+                 f"processed in {self.elapsed * 1000:.0f} ms"]
+        return " · ".join(parts)
+
+
+def passthrough(data, note):
+    """Leave the MP3 as received, e.g. without ffmpeg or when processing is switched off"""
+    original = EncodedAudio(data, "mp3")
+    duration = mp3_duration(data)
+    return MasteredAudio(original, original, original, duration, duration, note=note)
+
+
+def _db(value):
+    return 20 * np.log10(max(value, 1e-9))
+
+
+# ═══════════════════════════════════════════════════════════
+# FFMPEG PROCESSES
+# ═══════════════════════════════════════════════════════════
+
+def _spawn(args, **kwargs):
+    """Start ffmpeg logging to a temporary file: a corrupt stream can log enough to fill a stderr pipe and stall it"""
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(["ffmpeg", "-hide_banner", "-loglevel", "error", *args], stderr=log, **kwargs)
+    proc.log = log
+    return proc
+
+
+def _error(proc):
+    proc.log.seek(0)
+    lines = proc.log.read().decode("utf-8", "replace").strip().splitlines()
+    return AudioProcessingFailed(lines[-1] if lines else f"ffmpeg exited with code {proc.returncode}")
+
+
+def _pcm_chunks(path):
+    """Decode to mono 16-bit PCM and yield it a chunk at a time as int16 arrays"""
+    proc = _spawn(["-i", path, "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+                  stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    chunk_bytes = int(SAMPLE_RATE * CHUNK_SECONDS) * 2
+    try:
+        while True:
+            if pipeline.cancelled():
+                raise AudioProcessingFailed("cancelled")
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 2], dtype="<i2")
+        if proc.wait() != 0:
+            raise _error(proc)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        proc.log.close()
+
+
+def _encoder(codec, bitrate, path):
+    """ffmpeg reading PCM on stdin and writing `codec` to `path`"""
+    encoder, container, _, _ = CODECS[codec]
+    return _spawn(["-y", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+                   "-c:a", encoder, "-b:a", bitrate, "-f", container, path],
+                  stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+
+def _finish(proc, timeout=60):
+    try:
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        raise AudioProcessingFailed("ffmpeg encoder timed out")
+    if proc.returncode != 0:
+        raise _error(proc)
+
+
+# ═══════════════════════════════════════════════════════════
+# ANALYSIS & MASTERING
+# ═══════════════════════════════════════════════════════════
+
+def analyze(path, silence_db=SILENCE_DB):
+    """First pass: sample count, peak, speech RMS and the first/last frames above the silence threshold"""
+    frame = int(SAMPLE_RATE * FRAME_SECONDS)
+    threshold = 10 ** (silence_db / 10)
+    samples, peak, energy, voiced = 0, 0.0, 0.0, 0
+    first = last = None
+    for pcm in _pcm_chunks(path):
+        x = pcm.astype(np.float32) / 32768
+        padded = -(-len(x) // frame) * frame
+        power = np.mean(np.pad(x, (0, padded - len(x))).reshape(-1, frame) ** 2, axis=1)
+        loud = np.flatnonzero(power > threshold)
+        if loud.size:
+            # Chunks are a whole number of frames, so frame indices carry across chunks
+            base = samples // frame
+            first = base + loud[0] if first is None else first
+            last = base + loud[-1]
+            energy += float(power[loud].sum())
+            voiced += loud.size
+        if len(x):
+            peak = max(peak, float(np.abs(x).max()))
+        samples += len(x)
+    return {"samples": samples, "frame": frame, "peak": peak, "first": first, "last": last,
+            "rms": (energy / voiced) ** 0.5 if voiced else 0.0}
+
+
+def master(data, playback=PLAYBACK, download=DOWNLOAD, target_db=TARGET_RMS_DB, silence_db=SILENCE_DB):
+    """Normalize the narration's loudness, trim leading/trailing silence and re-encode it twice.
+
+    Two streaming passes over the decoded PCM: the first measures the speech
+    RMS, the peak and where the speech starts and ends; the second applies one
+    gain (the RMS target, capped so the peak stays under the ceiling) to the
+    trimmed span and feeds it to the playback and download encoders together.
+    `playback` and `download` are (codec, bitrate) pairs from CODECS.
+    """
+    if not ffmpeg_available():
+        return passthrough(data, "ffmpeg not found — narration left as received")
+    started = time.perf_counter()
+    with metrics.span("audio mastering", kind="cpu", bytes_in=len(data)) as span, \
+            tempfile.TemporaryDirectory(prefix="ai-video-audio-") as work:
+        source = os.path.join(work, "narration.mp3")
+        with open(source, "wb") as f:
+            f.write(data)
+
+        levels = analyze(source, silence_db)
+        if levels["samples"] == 0:
+            raise AudioProcessingFailed("no audio could be decoded")
+        frame, pad = levels["frame"], int(SAMPLE_RATE * PAD_SECONDS)
+        if levels["first"] is None:
+            start, end, rms = 0, levels["samples"], levels["peak"]
+        else:
+            start = max(int(levels["first"]) * frame - pad, 0)
+            end = min((int(levels["last"]) + 1) * frame + pad, levels["samples"])
+            rms = levels["rms"]
+        gain_db = 0.0
+        if rms > 0:
+            gain_db = min(target_db - _db(rms), PEAK_CEILING_DB - _db(levels["peak"]), MAX_GAIN_DB)
+        gain = 10 ** (gain_db / 20)
+
+        outputs = {"playback": (playback, os.path.join(work, f"playback.{CODECS[playback[0]][3]}")),
+                   "download": (download, os.path.join(work, f"download.{CODECS[download[0]][3]}"))}
+        encoders = {name: _encoder(codec, bitrate, path) for name, ((codec, bitrate), path) in outputs.items()}
+        chunks = _pcm_chunks(source)
+        try:
+            position = 0
+            for pcm in chunks:
+                lo, hi = max(start - position, 0), min(end - position, len(pcm))
+                position += len(pcm)
+                if hi > lo:
+                    block = np.clip(pcm[lo:hi].astype(np.float32) * gain, -32768, 32767).astype("<i2").tobytes()
+                    for proc in encoders.values():
+                        proc.stdin.write(block)
+                if position >= end:
+                    break
+            for proc in encoders.values():
+                _finish(proc)
+        except BrokenPipeError:
+            raise AudioProcessingFailed("ffmpeg encoder exited early")
+        finally:
+            chunks.close()
+            for proc in encoders.values():
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                proc.log.close()
+
+        encoded = {}
+        for name, ((codec, bitrate), path) in outputs.items():
+            with open(path, "rb") as f:
+                encoded[name] = EncodedAudio(f.read(), codec, bitrate)
+        span.attrs["bytes_out"] = len(encoded["playback"])
+
+    return MasteredAudio(
+        EncodedAudio(data, "mp3"), encoded["playback"], encoded["download"],
+        duration=(end - start) / SAMPLE_RATE,
+        source_duration=levels["samples"] / SAMPLE_RATE,
+        trimmed=(start / SAMPLE_RATE, (levels["samples"] - end) / SAMPLE_RATE),
+        rms_db=float(_db(rms * gain)), peak_db=float(_db(levels["peak"] * gain)), gain_db=float(gain_db),
+        elapsed=time.perf_counter() - started)
@@ -0,0 +1,256 @@
+# metrics.py — Spans, latency histograms, Prometheus text endpoint and JSONL trace log
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+# ═══════════════════════════════════════════════════════════
+# PROMETHEUS PRIMITIVES
+# ═══════════════════════════════════════════════════════════
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+SPAN_SECONDS = REGISTRY.histogram("video_span_seconds", "Duration of pipeline stages, HTTP calls and waits",
+                                  ["kind", "name", "outcome"])
+HTTP_BYTES_SENT = REGISTRY.counter("video_http_bytes_sent_total", "Request body bytes sent", ["host"])
+HTTP_BYTES_RECEIVED = REGISTRY.counter("video_http_bytes_received_total", "Response body bytes received", ["host"])
+HTTP_RESPONSES = REGISTRY.counter("video_http_responses_total", "HTTP responses by status", ["host", "status"])
+HTTP_RETRIES = REGISTRY.counter("video_http_retries_total", "Retried HTTP attempts", ["host"])
+HEDGES = REGISTRY.counter("video_hedged_requests_total", "Duplicate requests sent to cut tail latency", ["name", "outcome"])
+STORY_PATHS = REGISTRY.counter("video_story_budget_paths_total", "Story enhancement decisions under a latency budget", ["path"])
+JOBS = REGISTRY.counter("video_jobs_total", "Background generation jobs by event (submitted, deduplicated, done, failed, cancelled)", ["event"])
+IMAGE_BYTES = REGISTRY.counter("video_image_bytes_total", "Generated image bytes by rendition (original, display, thumbnail)", ["rendition"])
+PROMPT_REUSE = REGISTRY.counter("video_prompt_reuse_total", "Close past prompts reused instead of a new generation, by how (job, cache)", ["source"])
+ROUTE_CALLS = REGISTRY.counter("video_route_calls_total", "Routed provider calls by stage, backend and outcome (ok, error, skipped while the circuit is open)", ["stage", "backend", "outcome"])
+BREAKER_CHANGES = REGISTRY.counter("video_circuit_breaker_changes_total", "Circuit breaker transitions by backend and new state (open, closed)", ["backend", "state"])
+ARTIFACT_BYTES = REGISTRY.counter("video_artifact_bytes_served_total", "Media bytes sent to browsers by the artifact server, by file type", ["type"])
+
+
+# ═══════════════════════════════════════════════════════════
+# SPANS & TRACES
+# ═══════════════════════════════════════════════════════════
+
+_local = threading.local()
+_span_ids = itertools.count(1)
+
+
+class Span:
+    def __init__(self, name, kind, parent=None, **attrs):
+        self.id = next(_span_ids)
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    """All spans recorded for one pipeline run"""
+
+    def __init__(self, name="run"):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def waterfall(self):
+        """Finished spans as dicts with offsets relative to the trace start, in start order"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return [{
+            "trace": self.id, "span": s.id, "parent": s.parent, "name": s.name, "kind": s.kind,
+            "offset": round(s.start - self.start, 4), "duration": round(s.duration, 4),
+            "thread": s.thread, **s.attrs,
+        } for s in spans]
+
+    def finish(self, path=None):
+        """Append the trace to the JSONL log named by `path` or TRACE_LOG, if any"""
+        path = path or os.environ.get("TRACE_LOG")
+        if not path:
+            return
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            for row in self.waterfall():
+                f.write(json.dumps({"ts": self.wall_start + row["offset"], **row}, default=str) + "\n")
+
+
+_log_lock = threading.Lock()
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextlib.contextmanager
+def use_trace(trace, parent=None):
+    """Attach `trace` (and a parent span id) to the current thread"""
+    previous = getattr(_local, "trace", None), getattr(_local, "parent", None)
+    _local.trace, _local.parent = trace, parent
+    try:
+        yield trace
+    finally:
+        _local.trace, _local.parent = previous
+
+
+def current_parent():
+    return getattr(_local, "parent", None)
+
+
+@contextlib.contextmanager
+def span(name, kind="span", **attrs):
+    """Time a block; recorded in the current trace (if any) and the latency histogram"""
+    current = Span(name, kind, parent=getattr(_local, "parent", None), **attrs)
+    previous_parent = getattr(_local, "parent", None)
+    _local.parent = current.id
+    outcome = "ok"
+    try:
+        yield current
+    except BaseException as e:
+        outcome = "error"
+        current.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _local.parent = previous_parent
+        current.end = time.perf_counter()
+        if current.attrs.get("error") and outcome == "ok":
+            outcome = "error"
+        SPAN_SECONDS.observe(current.duration, kind=kind, name=name, outcome=outcome)
+        trace = current_trace()
+        if trace is not None:
+            trace.add(current)
+
+
+# ═══════════════════════════════════════════════════════════
+# /metrics ENDPOINT
+# ═══════════════════════════════════════════════════════════
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """Serve Prometheus text on /metrics (port from METRICS_PORT); safe to call repeatedly"""
+    global _server
+    port = port or os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
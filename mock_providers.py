@@ -0,0 +1,344 @@
+# mock_providers.py — Local stand-ins for the Groq, Anthropic, Leonardo and ElevenLabs HTTP APIs
+"""
+Usage:
+    python mock_providers.py --profile profile.json --latency-scale 0.25
+
+Starts one HTTP server per provider and prints a JSON line mapping each
+provider to its base URL. Point the app or batch runner at them with the
+GROQ_BASE_URL, ANTHROPIC_BASE_URL, LEONARDO_BASE_URL and ELEVENLABS_BASE_URL
+environment variables. Latencies are lognormal, described by their p50 and
+p95 in seconds; every endpoint can also fail with a configurable error rate.
+"""
+import argparse
+import copy
+import json
+import math
+import random
+import re
+import signal
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Roughly what the real services do for this app's payloads
+DEFAULT_PROFILE = {
+    "groq": {"p50": 0.25, "p95": 0.8, "error_rate": 0.0, "tokens": 180, "token_interval": 0.004},
+    "anthropic": {"p50": 0.6, "p95": 1.6, "error_rate": 0.0, "tokens": 220, "token_interval": 0.012},
+    "leonardo_submit": {"p50": 0.3, "p95": 0.9, "error_rate": 0.0},
+    "leonardo_job": {"p50": 12.0, "p95": 22.0, "error_rate": 0.0},
+    "leonardo_poll": {"p50": 0.08, "p95": 0.25, "error_rate": 0.0},
+    "leonardo_cdn": {"p50": 0.15, "p95": 0.5, "error_rate": 0.0, "bytes": 600_000},
+    "elevenlabs": {"p50": 0.45, "p95": 1.2, "error_rate": 0.0, "bytes_per_char": 1000},
+}
+ERROR_STATUSES = (429, 500, 503)
+_WORDS = ("the lantern flickered across wet cobblestones while distant thunder rolled over "
+          "silent rooftops and a lone figure stepped from the shadows").split()
+
+
+def load_profile(path=None, latency_scale=1.0, error_rate=None):
+    """DEFAULT_PROFILE merged with a JSON file of per-endpoint overrides"""
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for name, overrides in json.load(f).items():
+                if name not in profile:
+                    raise ValueError(f"Unknown endpoint '{name}' in {path}")
+                profile[name].update(overrides)
+    for settings in profile.values():
+        settings["p50"] *= latency_scale
+        settings["p95"] *= latency_scale
+        settings["token_interval"] = settings.get("token_interval", 0) * latency_scale
+        if error_rate is not None:
+            settings["error_rate"] = error_rate
+    return profile
+
+
+class Latency:
+    """Lognormal sampler parameterised by its median and 95th percentile"""
+
+    def __init__(self, p50, p95, rng):
+        self.mu = math.log(max(p50, 1e-6))
+        self.sigma = math.log(max(p95, p50, 1e-6) / max(p50, 1e-6)) / 1.645
+        self.rng = rng
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            return self.rng.lognormvariate(self.mu, self.sigma) if self.sigma else math.exp(self.mu)
+
+
+class MockState:
+    """Shared samplers, Leonardo job table and request counters for every mock server"""
+
+    def __init__(self, profile, seed=None):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.latency = {name: Latency(s["p50"], s["p95"], random.Random(self.rng.random())) for name, s in profile.items()}
+        self.jobs = {}
+        self.counts = {name: 0 for name in profile}
+        self.errors = {name: 0 for name in profile}
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def begin(self, endpoint):
+        """Wait out the endpoint's latency; returns an error status to send, or None"""
+        time.sleep(self.latency[endpoint].sample())
+        with self._lock:
+            self.counts[endpoint] += 1
+            if self.rng.random() < self.profile[endpoint]["error_rate"]:
+                self.errors[endpoint] += 1
+                return self.rng.choice(ERROR_STATUSES)
+        return None
+
+    def _noise(self, size):
+        with self._lock:
+            return self.rng.randbytes(size)
+
+    def image(self, size, width=768, height=512):
+        """A decodable PNG of roughly `size` bytes: noisy rows don't compress, the rest is flat"""
+        key = ("png", size)
+        if key not in self._blobs:
+            noisy = min(height, size // (width * 3))
+            rows = b"".join(b"\x00" + (self._noise(width * 3) if y < noisy else b"\x80" * width * 3) for y in range(height))
+
+            def chunk(kind, data):
+                return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+            self._blobs[key] = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+                                + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b""))
+        return self._blobs[key]
+
+    def audio(self, size):
+        """About `size` bytes of 128 kbit/s 44.1 kHz MP3 frames (valid headers, noise payload) behind an ID3 tag"""
+        if "mp3" not in self._blobs:
+            self._blobs["mp3"] = b"".join(b"\xff\xfb\x90\x00" + self._noise(413) for _ in range(2400))
+        frames = max(1, size // 417)
+        stream = self._blobs["mp3"] * (frames // 2400 + 1)
+        return b"ID3\x04\x00\x00\x00\x00\x00\x00" + stream[:frames * 417]
+
+    def words(self, count):
+        with self._lock:
+            return [self.rng.choice(_WORDS) for _ in range(count)]
+
+    def submit_job(self, num_images=1):
+        job_id = str(uuid.uuid4())
+        failed = self.rng.random() < self.profile["leonardo_job"]["error_rate"]
+        with self._lock:
+            self.jobs[job_id] = (time.monotonic() + self.latency["leonardo_job"].sample(), failed, num_images)
+        return job_id
+
+    def job_status(self, job_id):
+        """(status, number of images) for a job, or (None, 0) if it is unknown"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None, 0
+        ready_at, failed, num_images = job
+        if time.monotonic() < ready_at:
+            return "PENDING", num_images
+        return "FAILED" if failed else "COMPLETE", num_images
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.counts), "errors": dict(self.errors), "jobs": len(self.jobs)}
+
+
+# ═══════════════════════════════════════════════════════════
+# HANDLERS
+# ═══════════════════════════════════════════════════════════
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+    base_url = ""
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(data or b"{}")
+        except ValueError:
+            return {}
+
+    def _send(self, status, body=b"", content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status):
+        self._send(status, {"error": {"message": f"mock error {status}"}})
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _event(self, payload):
+        self._chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+
+class _GroqHandler(_Handler):
+    def do_POST(self):
+        body = self._body()
+        status = self.state.begin("groq")
+        if status:
+            return self._error(status)
+        settings = self.state.profile["groq"]
+        words = self.state.words(min(settings["tokens"], body.get("max_tokens") or settings["tokens"]))
+        if not body.get("stream"):
+            return self._send(200, {"choices": [{"message": {"role": "assistant", "content": " ".join(words)},
+                                                  "finish_reason": "stop"}],
+                                    "usage": {"completion_tokens": len(words)}})
+        self._start_stream("text/event-stream")
+        for i, word in enumerate(words):
+            self._event({"choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}}]})
+            time.sleep(settings["token_interval"])
+        self._event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                     "x_groq": {"usage": {"completion_tokens": len(words)}}})
+        self._chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+
+class _AnthropicHandler(_Handler):
+    def do_POST(self):
+        body = self._body()
+        status = self.state.begin("anthropic")
+        if status:
+            return self._error(status)
+        settings = self.state.profile["anthropic"]
+        words = self.state.words(min(settings["tokens"], body.get("max_tokens") or settings["tokens"]))
+        if not body.get("stream"):
+            return self._send(200, {"type": "message", "content": [{"type": "text", "text": " ".join(words)}],
+                                    "usage": {"output_tokens": len(words)}})
+        self._start_stream("text/event-stream")
+        self._event({"type": "message_start", "message": {"usage": {"output_tokens": 1}}})
+        self._event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for i, word in enumerate(words):
+            self._event({"type": "content_block_delta", "index": 0,
+                         "delta": {"type": "text_delta", "text": word if i == 0 else f" {word}"}})
+            time.sleep(settings["token_interval"])
+        self._event({"type": "content_block_stop", "index": 0})
+        self._event({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(words)}})
+        self._event({"type": "message_stop"})
+        self._end_stream()
+
+
+class _LeonardoHandler(_Handler):
+    def do_POST(self):
+        body = self._body()
+        status = self.state.begin("leonardo_submit")
+        if status:
+            return self._error(status)
+        self._send(200, {"sdGenerationJob": {"generationId": self.state.submit_job(body.get("num_images") or 1)}})
+
+    def do_GET(self):
+        image = re.fullmatch(r"/images/([\w-]+)\.png", self.path)
+        if image:
+            status = self.state.begin("leonardo_cdn")
+            if status:
+                return self._error(status)
+            return self._send(200, self.state.image(self.state.profile["leonardo_cdn"]["bytes"]), "image/png")
+        job = re.fullmatch(r"/generations/([\w-]+)", self.path)
+        if not job:
+            return self._send(404, {"error": "not found"})
+        status = self.state.begin("leonardo_poll")
+        if status:
+            return self._error(status)
+        job_id = job.group(1)
+        state, num_images = self.state.job_status(job_id)
+        if state is None:
+            return self._send(404, {"error": "unknown generation"})
+        images = [{"url": f"{self.base_url}/images/{job_id}-{k}.png"} for k in range(num_images)] if state == "COMPLETE" else []
+        self._send(200, {"generations_by_pk": {"id": job_id, "status": state, "generated_images": images}})
+
+
+class _ElevenLabsHandler(_Handler):
+    def do_POST(self):
+        body = self._body()
+        status = self.state.begin("elevenlabs")
+        if status:
+            return self._error(status)
+        size = max(1, len(body.get("text", "")) * self.state.profile["elevenlabs"]["bytes_per_char"])
+        audio = self.state.audio(size)
+        if not self.path.split("?")[0].endswith("/stream"):
+            return self._send(200, audio, "audio/mpeg")
+        self._start_stream("audio/mpeg")
+        for offset in range(0, len(audio), 16384):
+            self._chunk(audio[offset:offset + 16384])
+        self._end_stream()
+
+
+HANDLERS = {
+    "groq": (_GroqHandler, "/openai/v1"),
+    "anthropic": (_AnthropicHandler, "/v1"),
+    "leonardo": (_LeonardoHandler, ""),
+    "elevenlabs": (_ElevenLabsHandler, "/v1"),
+}
+ENV_VARS = {
+    "groq": "GROQ_BASE_URL",
+    "anthropic": "ANTHROPIC_BASE_URL",
+    "leonardo": "LEONARDO_BASE_URL",
+    "elevenlabs": "ELEVENLABS_BASE_URL",
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_servers(state, host="127.0.0.1"):
+    """Serve every provider on its own port; returns ({provider: base_url}, [servers])"""
+    urls, servers = {}, []
+    for name, (handler, prefix) in HANDLERS.items():
+        cls = type(handler.__name__, (handler,), {"state": state})
+        server = _Server((host, 0), cls)
+        root = f"http://{host}:{server.server_address[1]}"
+        cls.base_url = root
+        urls[name] = root + prefix
+        servers.append(server)
+        threading.Thread(target=server.serve_forever, name=f"mock-{name}", daemon=True).start()
+    return urls, servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the four provider APIs")
+    parser.add_argument("--profile", help="JSON file of per-endpoint overrides (p50, p95, error_rate, sizes)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every latency by this factor")
+    parser.add_argument("--error-rate", type=float, help="override the error rate of every endpoint")
+    parser.add_argument("--seed", type=int, help="seed for latency, error and payload sampling")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    state = MockState(load_profile(args.profile, args.latency_scale, args.error_rate), args.seed)
+    urls, _ = start_servers(state, args.host)
+    print(json.dumps({ENV_VARS[name]: url for name, url in urls.items()}), flush=True)
+    # Runs until Ctrl-C or SIGTERM, then reports what was served
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(state.stats()), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# offline.py — Local engines that stand in for the story, image and voice providers when none is reachable
+import hashlib
+import io
+import re
+import shutil
+import subprocess
+import textwrap
+
+from PIL import Image, ImageDraw, ImageFont
+
+from video import ffmpeg_available
+
+# Words per second of narration, to size silence in place of speech
+SPEAKING_RATE = 2.5
+# One MPEG-1 Layer III frame of digital silence: 32 kbit/s, 44.1 kHz, mono, all-zero side info and data
+_SILENT_FRAME = b"\xff\xfb\x10\xc0" + bytes(100)
+_FRAME_SECONDS = 1152 / 44100
+
+
+class EngineUnavailable(Exception):
+    """The local engine's tools are not installed on this host"""
+
+
+def template_story(prompt):
+    """The prompt itself as the scene, so the image and voice stages still have text to work from"""
+    text = re.sub(r"\s+", " ", prompt).strip()
+    return text if text.endswith((".", "!", "?")) else f"{text}."
+
+
+def placeholder_image(prompt, width=768, height=512):
+    """PNG of a gradient keyed to the prompt, with its opening words, standing in for a generated image"""
+    seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+    top, bottom = seed[:3], seed[3:6]
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    for y in range(height):
+        t = y / max(height - 1, 1)
+        draw.line([(0, y), (width, y)], fill=tuple(int(a * (1 - t) + b * t) // 2 + 40 for a, b in zip(top, bottom)))
+    try:
+        font = ImageFont.load_default(size=max(height // 16, 12))
+    except TypeError:
+        # Pillow < 10.1 has only the fixed-size bitmap font
+        font = ImageFont.load_default()
+    lines = textwrap.wrap(prompt, width=40)[:4]
+    draw.multiline_text((width // 12, height // 2 - len(lines) * height // 30), "\n".join(lines),
+                        fill=(255, 255, 255), font=font, spacing=height // 60)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _espeak():
+    return shutil.which("espeak-ng") or shutil.which("espeak")
+
+
+def local_tts_available():
+    return _espeak() is not None and ffmpeg_available()
+
+
+def local_tts(text, timeout=60):
+    """MP3 narration from espeak(-ng), encoded by ffmpeg"""
+    if not local_tts_available():
+        raise EngineUnavailable("espeak-ng/espeak and ffmpeg are needed for local speech")
+    speech = subprocess.run([_espeak(), "--stdout", text], capture_output=True, timeout=timeout, check=True).stdout
+    return subprocess.run(["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "mp3", "-codec:a", "libmp3lame",
+                           "-b:a", "64k", "pipe:1"], input=speech, capture_output=True, timeout=timeout,
+                          check=True).stdout
+
+
+def silent_narration(text):
+    """MP3 silence as long as `text` would take to read, so the video keeps its timing without a voice"""
+    seconds = max(len(text.split()) / SPEAKING_RATE, 1.0)
+    return _SILENT_FRAME * int(seconds / _FRAME_SECONDS + 1)
@@ -0,0 +1,171 @@
+# pipeline.py — Dependency-driven stage executor for the video pipeline
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import metrics
+
+_local = threading.local()
+
+
+class StageFailed(Exception):
+    """Raised when a stage produces no usable result"""
+
+
+class Stage:
+    """One step of the pipeline and the stages it depends on"""
+
+    def __init__(self, name, fn, inputs=(), label=None, weight=1, allow_none=False):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.label = label or name
+        self.weight = weight
+        self.allow_none = allow_none
+
+
+class StageResult:
+    """Outcome of a finished stage, streamed back to the caller"""
+
+    def __init__(self, stage, value=None, error=None, elapsed=0.0):
+        self.stage = stage
+        self.name = stage.name
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# ═══════════════════════════════════════════════════════════
+# CANCELLATION HELPERS (usable from inside a stage)
+# ═══════════════════════════════════════════════════════════
+
+def cancelled():
+    """True once a sibling stage has failed and this run is being torn down"""
+    event = getattr(_local, "cancel", None)
+    return event is not None and event.is_set()
+
+
+def sleep(seconds):
+    """Sleep that wakes early on cancellation; returns True if cancelled"""
+    event = getattr(_local, "cancel", None)
+    if event is None:
+        time.sleep(seconds)
+        return False
+    return event.wait(seconds)
+
+
+def propagate(fn):
+    """Wrap `fn` to run on a helper thread with this stage's cancellation, trace and worker initializer"""
+    event = getattr(_local, "cancel", None)
+    initializer = getattr(_local, "initializer", None)
+    trace, parent = metrics.current_trace(), metrics.current_parent()
+
+    def run(*args, **kwargs):
+        if initializer:
+            initializer()
+        _local.cancel = event
+        try:
+            with metrics.use_trace(trace, parent):
+                return fn(*args, **kwargs)
+        finally:
+            _local.cancel = None
+    return run
+
+
+# ═══════════════════════════════════════════════════════════
+# EXECUTOR
+# ═══════════════════════════════════════════════════════════
+
+class Pipeline:
+    """Runs stages as a DAG, starting each one as soon as its inputs are ready"""
+
+    def __init__(self, stages, max_workers=None, initializer=None, trace=None):
+        self.stages = {s.name: s for s in stages}
+        self.max_workers = max_workers or len(self.stages)
+        self.initializer = initializer
+        self.trace = trace
+        self.running = set()
+        self.cancel_event = threading.Event()
+        self._check()
+
+    def _check(self):
+        seen, visiting = set(), set()
+
+        def visit(name):
+            if name in seen:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].inputs:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+                visit(dep)
+            visiting.discard(name)
+            seen.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    @property
+    def total_weight(self):
+        return sum(s.weight for s in self.stages.values())
+
+    def running_labels(self):
+        return [self.stages[n].label for n in self.stages if n in self.running]
+
+    def _call(self, stage, args):
+        _local.cancel = self.cancel_event
+        _local.initializer = self.initializer
+        start = time.perf_counter()
+        try:
+            with metrics.use_trace(self.trace), metrics.span(stage.name, kind="stage"):
+                value = stage.fn(*args)
+                if value is None and not stage.allow_none:
+                    raise StageFailed(f"{stage.name} returned no result")
+            return value, time.perf_counter() - start
+        finally:
+            _local.cancel = _local.initializer = None
+
+    def run(self):
+        """Yield a StageResult for every stage as it finishes; stops on first failure"""
+        results = {}
+        futures = {}
+        pending = dict(self.stages)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+
+        def launch_ready():
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.inputs):
+                    args = [results[dep] for dep in stage.inputs]
+                    futures[executor.submit(self._call, stage, args)] = stage
+                    self.running.add(name)
+                    del pending[name]
+
+        try:
+            launch_ready()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = futures.pop(future)
+                    self.running.discard(stage.name)
+                    try:
+                        value, elapsed = future.result()
+                    except Exception as e:
+                        self.cancel_event.set()
+                        for other in futures:
+                            other.cancel()
+                        yield StageResult(stage, error=e)
+                        return
+                    results[stage.name] = value
+                    launch_ready()
+                    yield StageResult(stage, value=value, elapsed=elapsed)
+        finally:
+            if pending or futures:
+                self.cancel_event.set()
+            self.running.clear()
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,228 @@
+# polling.py — Adaptive, multiplexed poller for Leonardo generation jobs (with optional webhook mode)
+import heapq
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_client
+import pipeline
+
+LEONARDO_GENERATIONS = os.environ.get("LEONARDO_BASE_URL", "https://cloud.leonardo.ai/api/rest/v1") + "/generations"
+
+
+class GenerationFailed(Exception):
+    """Leonardo reported the job as failed"""
+
+
+# ═══════════════════════════════════════════════════════════
+# COMPLETION-TIME MODEL
+# ═══════════════════════════════════════════════════════════
+
+class CompletionModel:
+    """Rolling window of observed job durations used to schedule polls.
+
+    Polls are sparse before the 10th percentile, dense between the 10th and 90th
+    (where most jobs finish) and back off again for stragglers.
+    """
+
+    PRIOR = (8.0, 11.0, 14.0, 18.0, 25.0)
+
+    def __init__(self, window=200, min_interval=0.75, max_interval=5.0, min_samples=5):
+        self.samples = deque(maxlen=window)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, duration):
+        with self._lock:
+            self.samples.append(duration)
+
+    def quantile(self, q):
+        with self._lock:
+            data = sorted(self.samples) if len(self.samples) >= self.min_samples else sorted(self.PRIOR)
+        idx = min(int(q * len(data)), len(data) - 1)
+        return data[idx]
+
+    def next_delay(self, elapsed):
+        """Seconds until the next poll for a job that has been running `elapsed` seconds"""
+        lo, hi = self.quantile(0.1), self.quantile(0.9)
+        dense = max(self.min_interval, (hi - lo) / 8)
+        if elapsed < lo:
+            delay = lo - elapsed
+        elif elapsed < hi:
+            delay = dense
+        else:
+            delay = dense + (elapsed - hi) / 2
+        return min(self.max_interval, max(self.min_interval, delay))
+
+
+# ═══════════════════════════════════════════════════════════
+# SHARED POLLER
+# ═══════════════════════════════════════════════════════════
+
+class _Job:
+    def __init__(self, job_id, headers):
+        self.job_id = job_id
+        self.headers = headers
+        self.submitted = time.monotonic()
+        self.future = Future()
+        self.polls = 0
+
+
+class LeonardoPoller:
+    """One scheduler thread multiplexing every outstanding job id in the process"""
+
+    def __init__(self, model=None, workers=4, webhook=False):
+        self.model = model or CompletionModel()
+        self.webhook = webhook
+        self._jobs = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="leonardo-poll")
+        self._thread = threading.Thread(target=self._loop, name="leonardo-poller", daemon=True)
+        self._thread.start()
+
+    def _schedule(self, job, delay):
+        if self.webhook:
+            # Webhook mode only polls as a safety net once a job is clearly overdue
+            delay = max(delay, self.model.quantile(0.9) * 2 - (time.monotonic() - job.submitted))
+        heapq.heappush(self._heap, (time.monotonic() + delay, job.job_id))
+        self._cond.notify()
+
+    def submit(self, job_id, headers):
+        """Start tracking a job; returns a Future resolving to the list of image URLs"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = _Job(job_id, headers)
+                self._schedule(job, self.model.next_delay(0))
+            return job.future
+
+    def forget(self, job_id):
+        with self._cond:
+            self._jobs.pop(job_id, None)
+
+    def wait(self, job_id, headers, timeout=75):
+        """Block until the job completes, times out (None) or the pipeline is cancelled"""
+        future = self.submit(job_id, headers)
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                if pipeline.cancelled():
+                    return None
+                try:
+                    return future.result(timeout=min(0.25, max(deadline - time.monotonic(), 0)))
+                except FutureTimeout:
+                    continue
+            return None
+        finally:
+            if not future.done():
+                self.forget(job_id)
+
+    def complete(self, job_id, urls=None, error=None):
+        """Resolve a job from a poll result or webhook delivery"""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+        if job is None or job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+            return
+        self.model.record(time.monotonic() - job.submitted)
+        job.future.set_result(urls)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+            if job is not None:
+                self._executor.submit(self._poll, job)
+
+    def _poll(self, job):
+        job.polls += 1
+        try:
+            resp = http_client.get(f"{LEONARDO_GENERATIONS}/{job.job_id}", stage="image_poll", headers=job.headers)
+            generation = resp.json()["generations_by_pk"]
+            state = generation["status"]
+        except Exception:
+            state = None
+        if state == "COMPLETE":
+            self.complete(job.job_id, urls=[image["url"] for image in generation["generated_images"]])
+        elif state == "FAILED":
+            self.complete(job.job_id, error=GenerationFailed(f"Leonardo job {job.job_id} failed"))
+        else:
+            with self._cond:
+                if job.job_id in self._jobs:
+                    self._schedule(job, self.model.next_delay(time.monotonic() - job.submitted))
+
+    def stats(self):
+        with self._cond:
+            outstanding = len(self._jobs)
+        return {
+            "outstanding": outstanding,
+            "samples": len(self.model.samples),
+            "p50": self.model.quantile(0.5),
+            "p90": self.model.quantile(0.9),
+        }
+
+
+# ═══════════════════════════════════════════════════════════
+# WEBHOOK RECEIVER
+# ═══════════════════════════════════════════════════════════
+
+def _webhook_handler(poller, token):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if token and self.headers.get("Authorization") != f"Bearer {token}":
+                self.send_response(401)
+                self.end_headers()
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                generation = body["data"]["object"]
+                images = generation.get("images") or generation.get("generated_images") or []
+                if images:
+                    poller.complete(generation["id"], urls=[image["url"] for image in images])
+                elif generation.get("status") == "FAILED":
+                    poller.complete(generation["id"], error=GenerationFailed(f"Leonardo job {generation['id']} failed"))
+                self.send_response(200)
+            except (ValueError, KeyError, TypeError):
+                self.send_response(400)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_webhook_receiver(poller, port, token=None, host="0.0.0.0"):
+    """Serve Leonardo's generation-complete callbacks on a local port"""
+    server = ThreadingHTTPServer((host, port), _webhook_handler(poller, token))
+    threading.Thread(target=server.serve_forever, name="leonardo-webhook", daemon=True).start()
+    return server
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller():
+    """Process-wide poller; set LEONARDO_WEBHOOK_PORT to receive callbacks instead of polling"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            port = os.environ.get("LEONARDO_WEBHOOK_PORT")
+            _poller = LeonardoPoller(webhook=bool(port))
+            if port:
+                start_webhook_receiver(_poller, int(port), token=os.environ.get("LEONARDO_WEBHOOK_TOKEN"))
+        return _poller
@@ -0,0 +1,310 @@
+# prompt_index.py — Near-duplicate search over past prompts (hashed n-gram vectors, LSH buckets, cosine rerank)
+"""
+Usage:
+    python prompt_index.py --bench 100000
+
+Each prompt becomes a signed, hashed bag of character trigrams and words
+(DIM floats, L2-normalized), so cosine similarity is a dot product. Small
+indexes are searched exactly; larger ones take as candidates the entries that
+share a bucket with the query in at least MIN_BAND_HITS of BANDS random-
+hyperplane LSH tables (BITS sign bits each), and rerank only those with the
+exact cosine. Vectors are float32 in memory (1 KB per entry) and float16 on
+disk; entries are appended to flat files, so adding one is O(1) on disk and a
+restart reloads without re-vectorizing.
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+INDEX_DIR = os.environ.get("PROMPT_INDEX_DIR", os.path.join(tempfile.gettempdir(), "ai-video-prompt-index"))
+DIM = 256
+BITS = 12
+BANDS = 48
+# Requiring two bucket collisions rather than one drops most unrelated candidates
+MIN_BAND_HITS = 2
+# Below this many entries a full scan is cheaper than the band tables, and exact
+EXACT_SEARCH = 4096
+# New entries are scanned linearly until this many have piled up, then the band tables are rebuilt
+REBUILD_EVERY = 1024
+DEFAULT_THRESHOLD = 0.85
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def normalize(text):
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def features(text):
+    """Character trigrams of each word (with boundary markers) plus the words themselves"""
+    words = normalize(text).split()
+    grams = []
+    for word in words:
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams + [f"w:{word}" for word in words]
+
+
+def vectorize(text, dim=DIM):
+    """Unit-length hashed feature vector; a random ±1 sign per feature keeps collisions unbiased"""
+    hashes = np.array([zlib.crc32(f.encode("utf-8")) for f in features(text)], dtype=np.uint32)
+    if not hashes.size:
+        return np.zeros(dim, dtype=np.float32)
+    signs = np.where(hashes & (1 << 31), -1.0, 1.0)
+    vector = np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class PromptIndex:
+    """Incrementally updated, disk-persisted similarity index from prompt to metadata (e.g. a job id)"""
+
+    def __init__(self, directory=INDEX_DIR, dim=DIM, bits=BITS, bands=BANDS, seed=0):
+        self.directory = directory
+        self.dim, self.bits, self.bands = dim, bits, bands
+        self.planes = np.random.default_rng(seed).standard_normal((dim, bits * bands)).astype(np.float32)
+        self._weights = (1 << np.arange(bits, dtype=np.uint16)).astype(np.uint16)
+        self._vectors = np.empty((1024, dim), dtype=np.float32)
+        self._keys = np.empty((1024, bands), dtype=np.uint16)
+        self.size = 0
+        self.entries = []
+        self._by_text = {}
+        self._order = self._starts = None
+        self._indexed = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.lookup_time = 0.0
+        if directory:
+            self._load()
+
+    # ── LSH ────────────────────────────────────────────────
+
+    def band_keys(self, vectors):
+        """One BITS-bit bucket key per band for each row of `vectors`"""
+        signs = (np.asarray(vectors, dtype=np.float32) @ self.planes > 0).reshape(len(vectors), self.bands, self.bits)
+        return (signs * self._weights).sum(axis=2, dtype=np.uint16)
+
+    def _rebuild(self):
+        """Sort every band's keys so a bucket is one slice of the order array"""
+        keys = self._keys[:self.size]
+        self._order = np.argsort(keys, axis=0, kind="stable").T.astype(np.int32)
+        bounds = np.arange((1 << self.bits) + 1)
+        self._starts = np.stack([np.searchsorted(keys[order, b], bounds) for b, order in enumerate(self._order)])
+        self._indexed = self.size
+
+    def _candidates(self, keys):
+        parts = [order[starts[key]:starts[key + 1]]
+                 for order, starts, key in zip(self._order, self._starts, keys.tolist())]
+        ids, hits = np.unique(np.concatenate(parts), return_counts=True)
+        # Entries added since the last rebuild are matched against the query's keys directly
+        tail = np.flatnonzero((self._keys[self._indexed:self.size] == keys).sum(axis=1) >= MIN_BAND_HITS)
+        return np.concatenate([ids[hits >= MIN_BAND_HITS], (tail + self._indexed).astype(np.int32)])
+
+    # ── updates ────────────────────────────────────────────
+
+    def add(self, prompt, meta=None):
+        """Index a prompt; an identical (normalized) prompt already indexed just gets the new metadata"""
+        text = normalize(prompt)
+        if not text:
+            return None
+        record = {"prompt": prompt, "meta": meta or {}, "added": time.time()}
+        with self._lock:
+            i = self._by_text.get(text)
+            if i is not None:
+                record["i"] = i
+                self.entries[i] = record
+                self._append({"entries.jsonl": json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"})
+                return i
+            vector = vectorize(prompt, self.dim)
+            keys = self.band_keys(vector[None])
+            i = self._insert(vector[None], keys, [record])
+            record["i"] = i
+            self._append({"vectors.f16": vector.astype(np.float16).tobytes(), "keys.u16": keys.tobytes(),
+                          "entries.jsonl": json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"})
+            return i
+
+    def _insert(self, vectors, keys, records):
+        start, end = self.size, self.size + len(vectors)
+        if end > len(self._vectors):
+            capacity = max(end, 2 * len(self._vectors))
+            self._vectors = np.resize(self._vectors, (capacity, self.dim))
+            self._keys = np.resize(self._keys, (capacity, self.bands))
+        self._vectors[start:end] = vectors
+        self._keys[start:end] = keys
+        for offset, record in enumerate(records):
+            self.entries.append(record)
+            self._by_text[normalize(record["prompt"])] = start + offset
+        self.size = end
+        if self.size > EXACT_SEARCH and (self._order is None or self.size - self._indexed >= REBUILD_EVERY):
+            self._rebuild()
+        return start
+
+    # ── search ─────────────────────────────────────────────
+
+    def search(self, prompt, threshold=DEFAULT_THRESHOLD, k=3):
+        """Up to `k` (similarity, entry) pairs at or above `threshold`, most similar first"""
+        started = time.perf_counter()
+        query = vectorize(prompt, self.dim)
+        with self._lock:
+            if not self.size or not query.any():
+                return []
+            if self._order is None:
+                ids = np.arange(self.size)
+            else:
+                ids = self._candidates(self.band_keys(query[None])[0])
+            scores = self._vectors[ids] @ query
+            keep = np.flatnonzero(scores >= threshold)
+            # Most similar first; the newest entry wins a tie
+            best = keep[np.lexsort((-ids[keep], -scores[keep]))][:k]
+            results = [(float(scores[j]), self.entries[ids[j]]) for j in best]
+            self.lookups += 1
+            self.lookup_time += time.perf_counter() - started
+        return results
+
+    def best(self, prompt, threshold=DEFAULT_THRESHOLD):
+        """The closest (similarity, entry) at or above `threshold`, or None"""
+        results = self.search(prompt, threshold, k=1)
+        return results[0] if results else None
+
+    def stats(self):
+        with self._lock:
+            return {"entries": self.size, "banded": self._indexed if self._order is not None else 0,
+                    "lookups": self.lookups,
+                    "mean_lookup_ms": self.lookup_time / self.lookups * 1000 if self.lookups else 0.0}
+
+    # ── persistence ────────────────────────────────────────
+
+    def _params(self):
+        return {"dim": self.dim, "bits": self.bits, "bands": self.bands, "planes": zlib.crc32(self.planes.tobytes())}
+
+    def _append(self, chunks):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name, data in chunks.items():
+            with open(os.path.join(self.directory, name), "ab") as f:
+                f.write(data)
+
+    def _load(self):
+        """Read the flat files back; band keys are recomputed if the LSH parameters changed"""
+        params_path = os.path.join(self.directory, "params.json")
+        try:
+            with open(params_path, encoding="utf-8") as f:
+                params = json.load(f)
+            vectors = np.fromfile(os.path.join(self.directory, "vectors.f16"), dtype=np.float16).astype(np.float32)
+            keys = np.fromfile(os.path.join(self.directory, "keys.u16"), dtype=np.uint16)
+            with open(os.path.join(self.directory, "entries.jsonl"), encoding="utf-8") as f:
+                lines = f.readlines()
+        except (OSError, ValueError):
+            self._reset()
+            return
+        if params.get("dim") != self.dim:
+            self._reset()
+            return
+
+        records, torn = {}, False
+        for line in lines:
+            try:
+                record = json.loads(line)
+                records[record["i"]] = record
+            except (ValueError, KeyError, TypeError):
+                torn = True  # e.g. a crash mid-append
+        # Only rows complete in every file count
+        count = min(len(vectors) // self.dim, len(records))
+        count = next((i for i in range(count) if i not in records), count)
+        consistent = (not torn and params == self._params() and len(records) == count
+                      and len(vectors) == count * self.dim and len(keys) == count * self.bands)
+        vectors = vectors[:count * self.dim].reshape(count, self.dim)
+        if params != self._params() or len(keys) < count * self.bands:
+            keys = self.band_keys(vectors)
+        else:
+            keys = keys[:count * self.bands].reshape(count, self.bands)
+        if not consistent:
+            # Rewrite so later appends line up again
+            self._write_fresh(vectors, keys, [records[i] for i in range(count)])
+        if count:
+            self._insert(vectors, keys, [records[i] for i in range(count)])
+
+    def _reset(self):
+        self._write_fresh(np.empty((0, self.dim), np.float16), np.empty((0, self.bands), np.uint16), [])
+
+    def _write_fresh(self, vectors, keys, records):
+        os.makedirs(self.directory, exist_ok=True)
+        files = {"vectors.f16": vectors.astype(np.float16).tobytes(), "keys.u16": keys.astype(np.uint16).tobytes(),
+                 "entries.jsonl": b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in records),
+                 "params.json": json.dumps(self._params()).encode("utf-8")}
+        for name, data in files.items():
+            path = os.path.join(self.directory, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
+
+# ═══════════════════════════════════════════════════════════
+# BENCHMARK
+# ═══════════════════════════════════════════════════════════
+
+_SYLLABLES = "ka ri to mo na shi ve lo ra tu pe sa di go ne ba li mu fe zo".split()
+_VOCAB = ("cyberpunk samurai walking neon tokyo rain midnight astronaut discovering ancient alien ruins mars "
+          "sunset magical forest glowing mushrooms fairy lights dusk steampunk airship soaring victorian london "
+          "fog dragon perched mountain peak lightning storm lighthouse keeper message bottle robot painting dawn "
+          "rival chefs stranded snowy city raining upwards old map redrawing itself fox guiding travellers "
+          "haunted mysterious cliff waves crashing dark sky castle ocean desert caravan underwater kingdom "
+          "library lost books clockwork garden frozen waterfall volcano island train canyon floating market "
+          "lanterns whale violin orchard comet harbor glacier festival monastery jungle temple crystal cave").split()
+
+
+def bench(entries, queries=2000, threshold=DEFAULT_THRESHOLD, seed=0):
+    """Lookup latency and recall (against an exact scan) at `entries` synthetic prompts"""
+    rng = np.random.default_rng(seed)
+    # The English words plus a few thousand made-up ones, so unrelated prompts overlap about as much as real ones
+    vocab = _VOCAB + sorted({"".join(rng.choice(_SYLLABLES, size=rng.integers(2, 4))) for _ in range(4000)})
+
+    def prompt():
+        return " ".join(rng.choice(vocab, size=rng.integers(8, 16)))
+
+    def edit(text):
+        words = text.split()
+        words[rng.integers(len(words))] = str(rng.choice(vocab))
+        return " ".join(words)
+
+    index = PromptIndex(directory=None)
+    prompts = [prompt() for _ in range(entries)]
+    started = time.perf_counter()
+    for i, text in enumerate(prompts):
+        index.add(text, {"n": i})
+    build = time.perf_counter() - started
+
+    samples, found, expected = [], 0, 0
+    matrix = index._vectors[:index.size]
+    for _ in range(queries):
+        query = edit(prompts[rng.integers(entries)])
+        started = time.perf_counter()
+        match = index.best(query, threshold)
+        samples.append(time.perf_counter() - started)
+        exact = matrix @ vectorize(query)
+        if exact.max() >= threshold:
+            expected += 1
+            found += match is not None and match[0] >= exact.max() - 1e-3
+    samples.sort()
+    return {"entries": entries, "build_s": build, "p50_ms": samples[len(samples) // 2] * 1000,
+            "p99_ms": samples[int(len(samples) * 0.99)] * 1000, "recall": found / expected if expected else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate prompt lookups")
+    parser.add_argument("--bench", type=int, default=100000, help="synthetic prompts to index")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+    print(json.dumps(bench(args.bench, args.queries, args.threshold), indent=2))
+
+
+if __name__ == "__main__":
+    main()
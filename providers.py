@@ -0,0 +1,415 @@
+# providers.py — Story, image and voice generation shared by the Streamlit app and batch runner
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import http_client
+import metrics
+import offline
+import pipeline
+from budget import HEDGE_QUANTILE, TRACKER, BudgetExceeded, dispatched, dispatcher, hedged
+from polling import LEONARDO_GENERATIONS, get_poller
+from routing import Backend, Router
+from streaming import GROQ_CHAT, ANTHROPIC_MESSAGES, stream_claude, stream_groq
+from tts import ELEVENLABS_TTS, ElevenLabsTTS, TTSReport
+
+log = logging.getLogger("providers")
+_local = threading.local()
+
+GROQ_MODEL = "llama-3.2-90b-text-preview"
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+IMAGE_PARAMS = {"width": 768, "height": 512, "num_images": 1}
+VOICE_ID = "21m00Tcm4TlvDq8ikWAM"
+VOICE_MODEL = "eleven_monolingual_v1"
+VOICE_SETTINGS = {"stability": 0.75, "similarity_boost": 0.8}
+DRAFT_PROMPT = "Write a short vivid cinematic scene (max 150 words): {prompt}"
+ENHANCE_PROMPT = "Make this vivid, cinematic, and descriptive (max 150 words):\n\n{draft}"
+IMAGE_PROMPT = "cinematic, detailed, high quality: {prompt}"
+DRAFT_MAX_TOKENS = 200
+ENHANCE_MAX_TOKENS = 250
+# Tried when the models above fail, have their circuit open or are lagging
+GROQ_FALLBACK_MODEL = "llama-3.1-8b-instant"
+CLAUDE_FALLBACK_MODEL = "claude-3-5-haiku-20241022"
+VOICE_FALLBACK_MODEL = "eleven_turbo_v2"
+# Last resort once every provider for a stage is down: a template story, placeholder image, local or silent voice
+LOCAL_FALLBACKS = os.environ.get("LOCAL_FALLBACKS", "1") != "0"
+# Seconds of live p90 past which a backend is tried after its alternates
+SLOW = {"draft": 3.0, "enhance": 10.0, "voice": 20.0}
+
+GROQ_KEY = ANTHROPIC_KEY = LEONARDO_KEY = ELEVENLABS_KEY = None
+
+# Front ends swap these for st.error / st.warning, or to collect per-job errors
+on_error = log.error
+on_warning = log.warning
+# Called as on_fallback(stage, backend) when a backend other than the stage's primary serves it
+on_fallback = None
+
+# Optional per-provider rate_limit.ProviderLimiter ("groq", "anthropic", "leonardo", "elevenlabs")
+LIMITS = {}
+
+
+class ProviderError(Exception):
+    """A provider answered with an error status instead of a result"""
+
+
+def configure(groq=None, anthropic=None, leonardo=None, elevenlabs=None):
+    """Set the provider API keys"""
+    global GROQ_KEY, ANTHROPIC_KEY, LEONARDO_KEY, ELEVENLABS_KEY
+    GROQ_KEY, ANTHROPIC_KEY, LEONARDO_KEY, ELEVENLABS_KEY = groq, anthropic, leonardo, elevenlabs
+
+
+def use_local_fallbacks(enabled):
+    """Turn the local last-resort engines on or off (overriding LOCAL_FALLBACKS); rebuilds the routes, so their stats start over"""
+    global LOCAL_FALLBACKS
+    LOCAL_FALLBACKS = enabled
+    ROUTES.update(_routes())
+
+
+def set_queue_listener(listener):
+    """Report quota waits on this thread as listener(provider, position, eta_seconds)"""
+    _local.on_queue = listener
+
+
+@contextlib.contextmanager
+def slot(provider, listener=None, notify=None):
+    """Queue fairly for one of the provider's slots, if a limiter is configured, then signal the call is going out.
+
+    Waits are reported to `listener`, else to this thread's queue listener; the
+    dispatch signal goes to `notify`, else to this thread's budget.dispatched.
+    """
+    limiter = LIMITS.get(provider)
+    listener = listener or getattr(_local, "on_queue", None)
+    on_wait = (lambda position, eta: listener(provider, position, eta)) if listener else None
+    with limiter.slot(on_wait) if limiter is not None else contextlib.nullcontext():
+        (notify or dispatched)()
+        yield
+
+
+def image_extension(data):
+    """File extension for generated image bytes, from their signature"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "jpg"
+
+
+def _checked(response, provider):
+    """Raise a readable ProviderError for non-2xx responses instead of a KeyError later"""
+    if response.status_code == 429:
+        raise ProviderError(f"{provider} is rate limiting requests right now — please try again shortly")
+    if response.status_code >= 400:
+        raise ProviderError(f"{provider} returned HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def _draft(prompt, stream=False, on_text=None):
+    """One routed draft, token-streamed to on_text if `stream`; returns (text, StreamStats or None, Backend)"""
+    (raw, stats), backend = ROUTES["draft"].call(prompt, stream, on_text)
+    return raw, stats, backend
+
+
+def _enhance(draft, stream=False, on_text=None):
+    """One routed enhancement pass over the draft; returns (text, StreamStats or None, Backend)"""
+    (enhanced, stats), backend = ROUTES["enhance"].call(draft, stream, on_text)
+    return enhanced, stats, backend
+
+
+def _groq_draft(model, prompt, stream, on_text):
+    with slot("groq"):
+        # Upstream latency only: time queued for quota is not the provider's
+        started = time.perf_counter()
+        if stream:
+            raw, stats = stream_groq(GROQ_KEY, model, DRAFT_PROMPT.format(prompt=prompt), DRAFT_MAX_TOKENS, on_text)
+        else:
+            r = http_client.post(GROQ_CHAT, stage="story",
+                headers={"Authorization": f"Bearer {GROQ_KEY}"},
+                json={"model": model,
+                      "messages": [{"role": "user", "content": DRAFT_PROMPT.format(prompt=prompt)}],
+                      "max_tokens": DRAFT_MAX_TOKENS})
+            raw, stats = _checked(r, "Groq").json()["choices"][0]["message"]["content"], None
+    _track("groq", started, stats)
+    return raw, stats
+
+
+def _claude_enhance(model, draft, stream, on_text):
+    with slot("anthropic"):
+        started = time.perf_counter()
+        if stream:
+            enhanced, stats = stream_claude(ANTHROPIC_KEY, model, ENHANCE_PROMPT.format(draft=draft), ENHANCE_MAX_TOKENS, on_text)
+        else:
+            r = http_client.post(ANTHROPIC_MESSAGES, stage="story",
+                headers={"x-api-key": ANTHROPIC_KEY, "anthropic-version": "2023-06-01"},
+                json={"model": model,
+                      "max_tokens": ENHANCE_MAX_TOKENS,
+                      "messages": [{"role": "user", "content": ENHANCE_PROMPT.format(draft=draft)}]})
+            enhanced, stats = _checked(r, "Anthropic").json()["content"][0]["text"], None
+    _track("anthropic", started, stats)
+    return enhanced, stats
+
+
+def _offline_text(text, on_text):
+    if on_text:
+        on_text(text)
+        flush = getattr(on_text, "flush", None)
+        if flush:
+            flush()
+    return text, None
+
+
+def _track(provider, started, stats):
+    """Feed the live latency tracker that latency budgets and hedging delays are based on"""
+    if stats is not None:
+        TRACKER.record(provider, stats.duration)
+        TRACKER.record(f"{provider}:ttft", stats.ttft)
+    else:
+        TRACKER.record(provider, time.perf_counter() - started)
+
+
+def create_story(prompt, on_draft=None, on_enhanced=None, stats=None, budget=None):
+    """Generate and enhance story with Groq + Claude (token-streamed when callbacks are given).
+
+    With a budget.StoryBudget the Claude pass is run, time-boxed or skipped depending
+    on its live latency and the time left, and both calls are hedged.
+    """
+    try:
+        if budget is not None:
+            return _budgeted_story(prompt, on_draft, on_enhanced, stats, budget)
+        streaming = bool(on_draft or on_enhanced)
+        # Claude starts as soon as the draft (stream) finishes
+        raw, draft_stats, drafted_by = _draft(prompt, streaming, on_draft)
+        _served("draft", drafted_by)
+        enhanced, enhance_stats, enhanced_by = _enhance(raw, streaming, on_enhanced)
+        _served("enhance", enhanced_by)
+        if stats is not None and streaming:
+            stats.extend(s for s in (draft_stats, enhance_stats) if s is not None)
+        return raw, enhanced
+    except Exception as e:
+        on_error(f"❌ Story generation failed: {str(e)}")
+        return None, None
+
+
+def _budgeted_story(prompt, on_draft, on_enhanced, stats, budget):
+    """Hedged draft, then a Claude pass that is run, time-boxed or skipped to fit the budget"""
+    budget.start()
+    streaming = bool(on_draft or on_enhanced)
+
+    def hedge_delay(provider):
+        # Streams race on time to first token, plain calls on the whole response
+        return budget.tracker.quantile(f"{provider}:ttft" if streaming else provider, HEDGE_QUANTILE)
+
+    (raw, draft_stats, drafted_by), attempts = hedged(lambda emit: _draft(prompt, streaming, emit),
+                                                      delay=hedge_delay("groq"), on_text=on_draft, name="groq draft")
+    _served("draft", drafted_by)
+    budget.hedges += attempts - 1
+    if budget.plan() == "skip":
+        budget.finish("skipped")
+        return raw, raw
+    try:
+        (enhanced, enhance_stats, enhanced_by), attempts = hedged(
+            lambda emit: _enhance(raw, streaming, emit), delay=hedge_delay("anthropic"),
+            on_text=on_enhanced, timeout=budget.remaining() if budget.decision == "timebox" else None,
+            name="claude enhance")
+    except BudgetExceeded:
+        budget.finish("timed-out")
+        return raw, raw
+    _served("enhance", enhanced_by)
+    budget.hedges += attempts - 1
+    budget.finish("timeboxed" if budget.decision == "timebox" else "full")
+    if stats is not None:
+        stats.extend(s for s in (draft_stats, enhance_stats) if s is not None)
+    return raw, enhanced
+
+
+def generate_image(prompt):
+    """Generate image with Leonardo AI"""
+    images = generate_images(prompt)
+    return images[0] if images else None
+
+
+def generate_images(prompt, count=1):
+    """Generate `count` images from one routed job (Leonardo num_images batching); returns a list or None"""
+    try:
+        images, backend = ROUTES["image"].call(prompt, count)
+        _served("image", backend)
+        return images
+    except Exception as e:
+        if not pipeline.cancelled():
+            on_error(f"❌ Image generation failed: {str(e)}")
+        return None
+
+
+def _leonardo_images(prompt, count):
+    headers = {"Authorization": f"Bearer {LEONARDO_KEY}"}
+    with slot("leonardo"):
+        r = http_client.post(LEONARDO_GENERATIONS, stage="image", headers=headers,
+            json={"prompt": IMAGE_PROMPT.format(prompt=prompt), **IMAGE_PARAMS, "num_images": count})
+        job_id = _checked(r, "Leonardo").json()["sdGenerationJob"]["generationId"]
+
+        # Shared background poller: adaptive intervals, or webhook delivery when enabled
+        with metrics.span("leonardo queue", kind="wait", job_id=job_id):
+            urls = get_poller().wait(job_id, headers, timeout=75)
+    if not urls:
+        raise ProviderError("Leonardo timed out after 75 s")
+    return [_checked(http_client.get(url, stage="download"), "Leonardo CDN").content for url in urls[:count]]
+
+
+def _placeholder_images(prompt, count):
+    size = (IMAGE_PARAMS["width"], IMAGE_PARAMS["height"])
+    return [offline.placeholder_image(prompt if count == 1 else f"{i}/{count} · {prompt}", *size)
+            for i in range(1, count + 1)]
+
+
+def generate_voice(text, chunked=True, on_first_audio=None, report=None, segments=None):
+    """Generate routed voice: ElevenLabs (sentence- or segment-chunked and parallel unless chunked=False)
+
+    Each backend tried starts from a reset `report`; if one fails after its
+    opening went to on_first_audio, on_first_audio(None) withdraws it.
+    """
+    sent = []
+
+    def first_audio(audio):
+        sent.append(True)
+        on_first_audio(audio)
+
+    def attempt(backend):
+        if report is not None:
+            report.reset()
+        if sent:
+            sent.clear()
+            on_first_audio(None)
+
+    try:
+        audio, backend = ROUTES["voice"].call(text, chunked, on_first_audio and first_audio, report, segments,
+                                              attempt=attempt)
+        _served("voice", backend)
+        return audio
+    except Exception as e:
+        if not pipeline.cancelled():
+            on_error(f"❌ Voice generation failed: {str(e)}")
+        return None
+
+
+def _elevenlabs_voice(model, text, chunked, on_first_audio, report, segments):
+    if chunked:
+        # Each chunk request takes its own slot, so the limiter caps requests in flight, not narrations
+        listener, notify = getattr(_local, "on_queue", None), dispatcher()
+        engine = ElevenLabsTTS(ELEVENLABS_KEY, VOICE_ID, model, VOICE_SETTINGS,
+                               slot=lambda: slot("elevenlabs", listener, notify))
+        return engine.synthesize(text, on_first_audio, report, segments)
+
+    report = report or TTSReport("single-shot")
+    url = f"{ELEVENLABS_TTS}/{VOICE_ID}"
+    with slot("elevenlabs"):
+        r = http_client.post(url, stage="voice",
+            headers={"xi-api-key": ELEVENLABS_KEY},
+            json={"text": text,
+                  "voice_settings": VOICE_SETTINGS,
+                  "model_id": model})
+    _checked(r, "ElevenLabs")
+    report.first_audio = report.total = time.perf_counter() - report.started
+    report.chunks, report.bytes = 1, len(r.content)
+    return r.content
+
+
+def _offline_voice(engine):
+    def speak(text, chunked, on_first_audio, report, segments):
+        audio = engine(text)
+        if report is not None:
+            # No segments, so scene timings share out the whole length
+            report.first_audio = report.total = time.perf_counter() - report.started
+            report.chunks, report.bytes = 1, len(audio)
+        return audio
+    return speak
+
+
+# ═══════════════════════════════════════════════════════════
+# ROUTES
+# ═══════════════════════════════════════════════════════════
+
+def _routes():
+    local = LOCAL_FALLBACKS
+    routes = {
+        "draft": [Backend(f"groq/{GROQ_MODEL}", lambda *a: _groq_draft(GROQ_MODEL, *a)),
+                  Backend(f"groq/{GROQ_FALLBACK_MODEL}", lambda *a: _groq_draft(GROQ_FALLBACK_MODEL, *a)),
+                  local and Backend("local/template", lambda prompt, stream, on_text:
+                                    _offline_text(offline.template_story(prompt), on_text), local=True)],
+        "enhance": [Backend(f"anthropic/{CLAUDE_MODEL}", lambda *a: _claude_enhance(CLAUDE_MODEL, *a)),
+                    Backend(f"anthropic/{CLAUDE_FALLBACK_MODEL}", lambda *a: _claude_enhance(CLAUDE_FALLBACK_MODEL, *a)),
+                    local and Backend("local/draft", lambda draft, stream, on_text: _offline_text(draft, on_text), local=True)],
+        "image": [Backend("leonardo", _leonardo_images),
+                  local and Backend("local/placeholder", _placeholder_images, local=True)],
+        "voice": [Backend(f"elevenlabs/{VOICE_MODEL}", lambda *a: _elevenlabs_voice(VOICE_MODEL, *a)),
+                  Backend(f"elevenlabs/{VOICE_FALLBACK_MODEL}", lambda *a: _elevenlabs_voice(VOICE_FALLBACK_MODEL, *a)),
+                  local and Backend("local/espeak", _offline_voice(offline.local_tts), local=True,
+                                    available=offline.local_tts_available),
+                  local and Backend("local/silence", _offline_voice(offline.silent_narration), local=True)],
+    }
+    return {stage: Router(stage, [b for b in backends if b], slow=SLOW.get(stage)) for stage, backends in routes.items()}
+
+
+# One router per stage, shared by every run in the process; add backends with ROUTES[stage].add(Backend(...))
+ROUTES = _routes()
+FALLBACK_NOTES = {
+    "draft": "📝 Draft written by {backend} — {primary} is unavailable",
+    "enhance": "✨ Story polished by {backend} — {primary} is unavailable",
+    "image": "🎨 Image made by {backend} — {primary} is unavailable",
+    "voice": "🎙️ Narration made by {backend} — {primary} is unavailable",
+}
+
+
+def _served(stage, backend):
+    """Note the backend a stage was served by; a fallback's result is flagged and kept out of the cache"""
+    router = ROUTES[stage]
+    if backend is router.primary:
+        return
+    _local.fallbacks = getattr(_local, "fallbacks", []) + [backend.name]
+    on_warning(FALLBACK_NOTES[stage].format(backend=backend.name, primary=router.primary.name))
+    if on_fallback is not None:
+        on_fallback(stage, backend)
+
+
+def _fresh(compute):
+    """compute() with this thread's fallback record cleared, so _from_primary judges only its result"""
+    def run():
+        _local.fallbacks = []
+        return compute()
+    return run
+
+
+def _from_primary(value):
+    return not getattr(_local, "fallbacks", None)
+
+
+# ═══════════════════════════════════════════════════════════
+# CACHED STAGE WRAPPERS
+# ═══════════════════════════════════════════════════════════
+
+def cached_story(cache, prompt, bypass=False, **kwargs):
+    """create_story through the result cache; returns (raw, enhanced) or None"""
+    def compute():
+        raw, enhanced = create_story(prompt, **kwargs)
+        return [raw, enhanced] if raw and enhanced else None
+    # Draft-only stories produced under a latency budget must not be served as enhanced ones later
+    budget = kwargs.get("budget")
+    keep = (lambda value: budget.enhanced and _from_primary(value)) if budget is not None else _from_primary
+    # The prompt templates and token limits shape the output as much as the models, so a change to them is a new key
+    params = {"draft_prompt": DRAFT_PROMPT, "draft_max_tokens": DRAFT_MAX_TOKENS,
+              "enhance_prompt": ENHANCE_PROMPT, "enhance_max_tokens": ENHANCE_MAX_TOKENS}
+    value = cache.get_or_compute("story", [GROQ_MODEL, CLAUDE_MODEL], params, prompt, _fresh(compute), bypass=bypass, keep=keep)
+    return tuple(value) if value else None
+
+
+def cached_image(cache, text, bypass=False):
+    return cache.get_or_compute("image", "leonardo", {**IMAGE_PARAMS, "prompt": IMAGE_PROMPT}, text,
+                                _fresh(lambda: generate_image(text)), bypass=bypass, keep=_from_primary)
+
+
+def cached_voice(cache, text, bypass=False, **kwargs):
+    params = {"voice_id": VOICE_ID, **VOICE_SETTINGS}
+    if kwargs.get("segments"):
+        params["segments"] = len(kwargs["segments"])
+    return cache.get_or_compute("voice", VOICE_MODEL, params, text,
+                                _fresh(lambda: generate_voice(text, **kwargs)), bypass=bypass, keep=_from_primary)
@@ -0,0 +1,200 @@
+# rate_limit.py — Fair, process-wide token-bucket + concurrency limiter per provider
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+import pipeline
+
+# Requests/second refill, burst size and simultaneous calls per provider
+DEFAULT_LIMITS = {
+    "groq": {"rate": 0.5, "burst": 5, "concurrency": 8},
+    "anthropic": {"rate": 0.8, "burst": 5, "concurrency": 8},
+    "leonardo": {"rate": 0.5, "burst": 3, "concurrency": 5},
+    "elevenlabs": {"rate": None, "burst": None, "concurrency": 3},
+}
+
+
+class QueueCancelled(Exception):
+    """The caller's pipeline was cancelled while it waited for quota"""
+
+
+# ═══════════════════════════════════════════════════════════
+# TOKEN BUCKETS
+# ═══════════════════════════════════════════════════════════
+
+class TokenBucket:
+    """In-process token bucket"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class FileTokenBucket:
+    """Token bucket whose state lives in a locked file, shared by every worker process on the host"""
+
+    def __init__(self, path, rate, burst):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def take(self):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens = min(self.burst, state.get("tokens", self.burst) + (now - state.get("updated", now)) * self.rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": now}))
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ═══════════════════════════════════════════════════════════
+# FAIR LIMITER
+# ═══════════════════════════════════════════════════════════
+
+class ProviderLimiter:
+    """FIFO queue in front of a provider: callers wait their turn instead of failing on 429s"""
+
+    def __init__(self, name, rate=None, burst=None, concurrency=None, shared_dir=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        if rate and shared_dir:
+            self.bucket = FileTokenBucket(os.path.join(shared_dir, f"{name}.bucket"), rate, burst or 1)
+        elif rate:
+            self.bucket = TokenBucket(rate, burst or 1)
+        else:
+            self.bucket = None
+        self.active = 0
+        self.calls = 0
+        self.wait_time = 0.0
+        self.api_time = 0.0
+        self.max_queue = 0
+        self._avg_hold = 5.0
+        self._queue = deque()
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def _eta(self, position):
+        estimates = [0.0]
+        if self.concurrency:
+            estimates.append(position * self._avg_hold / self.concurrency)
+        if self.rate:
+            estimates.append(position / self.rate)
+        return max(estimates)
+
+    def acquire(self, on_wait=None):
+        """Block until it is this caller's turn; returns seconds spent queueing"""
+        started = time.monotonic()
+        last_reported = None
+        with self._cond:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            self.max_queue = max(self.max_queue, len(self._queue))
+        try:
+            while True:
+                with self._cond:
+                    delay = 0.25
+                    if self._queue[0] == ticket and (not self.concurrency or self.active < self.concurrency):
+                        delay = self.bucket.take() if self.bucket else 0.0
+                        if delay == 0:
+                            self._queue.popleft()
+                            self.active += 1
+                            self._cond.notify_all()
+                            break
+                    position = self._queue.index(ticket) + 1
+                    eta = self._eta(position) + delay
+                if pipeline.cancelled():
+                    raise QueueCancelled(f"Cancelled while waiting for {self.name}")
+                # Report outside the lock, and only when the picture changes
+                if on_wait and (position, round(eta)) != last_reported:
+                    last_reported = (position, round(eta))
+                    on_wait(position, eta)
+                with self._cond:
+                    self._cond.wait(min(delay, 0.5))
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+        if last_reported and on_wait:
+            on_wait(0, 0.0)
+        wait = time.monotonic() - started
+        with self._cond:
+            self.wait_time += wait
+        return wait
+
+    def release(self, held):
+        with self._cond:
+            self.active -= 1
+            self.calls += 1
+            self.api_time += held
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, on_wait=None):
+        with metrics.span(f"quota {self.name}", kind="wait"):
+            self.acquire(on_wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "calls": self.calls,
+                "active": self.active,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "wait_time": self.wait_time,
+                "api_time": self.api_time,
+            }
+
+
+def build_limiters(overrides=None, shared_dir=None):
+    """One limiter per provider; set RATE_LIMIT_DIR to share token buckets across processes"""
+    shared_dir = shared_dir or os.environ.get("RATE_LIMIT_DIR")
+    limiters = {}
+    for name, config in DEFAULT_LIMITS.items():
+        config = {**config, **(overrides or {}).get(name, {})}
+        limiters[name] = ProviderLimiter(name, shared_dir=shared_dir, **config)
+    return limiters
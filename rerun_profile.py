@@ -0,0 +1,101 @@
+# rerun_profile.py — What each Streamlit rerun of a session costs: script time and websocket bytes
+import functools
+import threading
+import time
+from collections import deque
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+PAGE = "full page"
+
+
+class RerunProfiler:
+    """Per-session record of recent reruns: scope (the full page or one fragment), ms and bytes sent.
+
+    Bytes are counted at the session's ForwardMsg queue, i.e. the protobuf
+    messages the websocket will carry after Streamlit has swapped anything the
+    browser already caches for a reference. That queue is Streamlit internals
+    (ScriptRunContext._enqueue); on a version without it only time is
+    recorded and the byte columns stay empty.
+    """
+
+    def __init__(self, history=60):
+        self.runs = deque(maxlen=history)
+        self._ctx = None
+        self._sent = [0, 0]  # bytes, messages
+        self._lock = threading.Lock()
+        self._page = None
+        self.counting = None  # whether bytes are counted, known once installed
+
+    def _install(self):
+        ctx = get_script_run_ctx()
+        if ctx is None or ctx is self._ctx:
+            return
+        self._ctx = ctx
+        send = getattr(ctx, "_enqueue", None)
+        self.counting = callable(send)
+        if not self.counting:
+            return
+
+        def counting(msg):
+            with self._lock:
+                self._sent[0] += msg.ByteSize()
+                self._sent[1] += 1
+            send(msg)
+
+        ctx._enqueue = counting
+
+    def _mark(self):
+        with self._lock:
+            return time.perf_counter(), self._sent[0], self._sent[1]
+
+    def _record(self, scope, mark):
+        now, sent, messages = self._mark()
+        counted = self.counting
+        self.runs.append({"scope": scope, "at": time.time(), "ms": (now - mark[0]) * 1000,
+                          "bytes": sent - mark[1] if counted else None,
+                          "messages": messages - mark[2] if counted else None})
+
+    def start_page(self):
+        """Call first thing in the script; a page run that never reached finish_page was cut short"""
+        self._install()
+        if self._page is not None:
+            self._record(f"{PAGE} (interrupted)", self._page)
+        self._page = self._mark()
+
+    def finish_page(self):
+        if self._page is not None:
+            self._record(PAGE, self._page)
+            self._page = None
+
+    def fragment(self, scope):
+        """Decorator recording a fragment's own reruns (runs as part of a page run are counted in the page)"""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def run(*args, **kwargs):
+                ctx = get_script_run_ctx()
+                if ctx is None or not ctx.fragment_ids_this_run:
+                    return fn(*args, **kwargs)
+                self._install()
+                mark = self._mark()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._record(scope, mark)
+            return run
+        return wrap
+
+    def summary(self):
+        """Per scope: reruns seen, mean and last ms, mean KB sent (None when bytes are not counted)"""
+        scopes = {}
+        for run in self.runs:
+            scopes.setdefault(run["scope"], []).append(run)
+        rows = []
+        for scope, runs in scopes.items():
+            counted = [r for r in runs if r["bytes"] is not None]
+            rows.append({"scope": scope, "reruns": len(runs),
+                         "mean ms": round(sum(r["ms"] for r in runs) / len(runs), 1),
+                         "last ms": round(runs[-1]["ms"], 1),
+                         "mean KB sent": round(sum(r["bytes"] for r in counted) / len(counted) / 1024, 1) if counted else None,
+                         "mean messages": round(sum(r["messages"] for r in counted) / len(counted), 1) if counted else None})
+        return rows
@@ -0,0 +1,185 @@
+# routing.py — Per-stage provider routing: rolling latency/error stats, circuit breakers and failover
+import threading
+import time
+from collections import deque
+
+import metrics
+import pipeline
+from budget import AttemptLost, LatencyTracker, on_dispatch
+
+
+class RoutingError(Exception):
+    """Every backend of a route failed or was shut off by its circuit breaker"""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` failures within `window` seconds, shutting a backend off for `cooldown` seconds.
+
+    After the cooldown one trial call is let through (half-open): success
+    closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, name, threshold=3, window=60, cooldown=30):
+        self.name = name
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.failures = deque()
+        self.opened = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.cooldown and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened is not None:
+                metrics.BREAKER_CHANGES.inc(backend=self.name, state="closed")
+            self.failures.clear()
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        now = time.monotonic()
+        with self._lock:
+            self.failures.append(now)
+            while self.failures and now - self.failures[0] > self.window:
+                self.failures.popleft()
+            if self.trial or (self.opened is None and len(self.failures) >= self.threshold):
+                self.opened = now
+                metrics.BREAKER_CHANGES.inc(backend=self.name, state="open")
+            self.trial = False
+
+    def release(self):
+        """A call that neither succeeded nor failed (lost a hedge race, cancelled) frees the trial slot"""
+        with self._lock:
+            self.trial = False
+
+
+class Backend:
+    """One way to serve a route: call(*args, **kwargs) returns the result, or raises / returns None on failure.
+
+    `local` engines run on this host; they are never demoted for latency and
+    serve only once every remote backend has failed or been shut off.
+    """
+
+    def __init__(self, name, call, local=False, available=None, breaker=None):
+        self.name = name
+        self.call = call
+        self.local = local
+        self.available = available
+        self.breaker = breaker or CircuitBreaker(name)
+
+
+class Router:
+    """Tries a stage's backends in order of preference, demoting remote ones that are running slow.
+
+    A remote backend whose live p90 (once it has `min_samples` calls) is over
+    `slow` seconds moves behind the remote backends that are not, so a lagging
+    upstream is skipped instead of stalling every run. Every `probe_every`th
+    call keeps the preferred order, so a demoted backend gets fresh samples and
+    moves back once it recovers. Calls returning None count as failures, as in
+    the provider functions' own convention. call() returns (value, backend);
+    its `attempt(backend)`, if given, runs before each backend is tried, so
+    state a failed one left in shared arguments can be reset.
+    Latency runs from the backend's first request going out (see
+    budget.dispatched), so time queued for a rate-limit slot is not held
+    against it; local engines, which never queue, are timed from the call.
+    """
+
+    def __init__(self, stage, backends, slow=None, window=100, min_samples=5, probe_every=20):
+        self.stage = stage
+        self.backends = list(backends)
+        self.slow = slow
+        self.probe_every = probe_every
+        self.calls = 0
+        self.latency = LatencyTracker(window, min_samples)
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.backends[0]
+
+    def add(self, backend, before=None):
+        """Plug in another backend, last or ahead of the one named `before`"""
+        names = [b.name for b in self.backends]
+        self.backends.insert(names.index(before) if before in names else len(self.backends), backend)
+
+    def _lagging(self, backend):
+        return (self.slow is not None and not backend.local and self.latency.warmed_up(backend.name)
+                and self.latency.quantile(backend.name, 0.9) > self.slow)
+
+    def order(self):
+        with self._lock:
+            self.calls += 1
+            probe = self.calls % self.probe_every == 0
+        usable = [b for b in self.backends if b.available is None or b.available()]
+        return sorted(usable, key=lambda b: (b.local, not probe and self._lagging(b)))
+
+    def _outcome(self, backend, ok):
+        with self._lock:
+            self.outcomes.setdefault(backend.name, deque(maxlen=self.latency.window)).append(ok)
+        metrics.ROUTE_CALLS.inc(stage=self.stage, backend=backend.name, outcome="ok" if ok else "error")
+
+    def call(self, *args, attempt=None, **kwargs):
+        errors = []
+        for backend in self.order():
+            if not backend.breaker.allow():
+                metrics.ROUTE_CALLS.inc(stage=self.stage, backend=backend.name, outcome="skipped")
+                errors.append(f"{backend.name}: circuit open")
+                continue
+            if attempt is not None:
+                attempt(backend)
+            called, sent = time.perf_counter(), []
+            try:
+                with metrics.span(f"{self.stage} via {backend.name}", kind="route"), \
+                        on_dispatch(lambda: sent or sent.append(time.perf_counter())):
+                    value = backend.call(*args, **kwargs)
+                if value is None:
+                    raise RoutingError("no result")
+            except AttemptLost:
+                backend.breaker.release()
+                raise
+            except Exception as e:
+                if pipeline.cancelled():
+                    backend.breaker.release()
+                    raise
+                backend.breaker.failure()
+                self._outcome(backend, False)
+                errors.append(f"{backend.name}: {e}")
+                continue
+            self.latency.record(backend.name, time.perf_counter() - (sent[0] if sent else called))
+            backend.breaker.success()
+            self._outcome(backend, True)
+            return value, backend
+        raise RoutingError(f"no {self.stage} backend succeeded — " + "; ".join(errors))
+
+    def stats(self):
+        """Per backend: breaker state, rolling calls and error rate, and live p50/p90 once warmed up"""
+        rows = []
+        for backend in self.backends:
+            with self._lock:
+                outcomes = list(self.outcomes.get(backend.name, ()))
+            warm = self.latency.warmed_up(backend.name)
+            rows.append({"backend": backend.name, "state": backend.breaker.state, "calls": len(outcomes),
+                         "errors": outcomes.count(False),
+                         "error_rate": outcomes.count(False) / len(outcomes) if outcomes else 0.0,
+                         "p50": self.latency.quantile(backend.name, 0.5) if warm else None,
+                         "p90": self.latency.quantile(backend.name, 0.9) if warm else None,
+                         "lagging": self._lagging(backend)})
+        return rows
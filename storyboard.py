@@ -0,0 +1,128 @@
+# storyboard.py — Multi-scene mode: split the story, illustrate scenes concurrently and time the slideshow
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import pipeline
+import providers
+from tts import TTSReport, mp3_duration, split_sentences
+
+MAX_SCENES = 6
+# Leonardo caps prompt length; a batched job describes the whole story in one prompt
+MAX_PROMPT_CHARS = 900
+
+
+def split_scenes(text, count):
+    """Group the story's sentences into at most `count` consecutive scenes of similar length"""
+    sentences = split_sentences(text, min_chars=1)
+    if not sentences:
+        return []
+    count = max(1, min(count, len(sentences)))
+    total = sum(len(s) for s in sentences)
+    scenes, current, done = [], [], 0
+    for i, sentence in enumerate(sentences):
+        scenes_left = count - len(scenes) - 1
+        target = total * (len(scenes) + 1) / count
+        # Cut at the sentence boundary nearest this scene's share of the text, or early
+        # enough that every remaining scene still gets a sentence
+        if current and scenes_left and (abs(done - target) <= abs(done + len(sentence) - target)
+                                        or len(sentences) - i == scenes_left):
+            scenes.append(" ".join(current))
+            current = []
+        current.append(sentence)
+        done += len(sentence)
+    scenes.append(" ".join(current))
+    return scenes
+
+
+def illustrate(scenes, cache, bypass=False, batched=False, timings=None):
+    """One image per scene; returns a list of image bytes or None if any scene failed.
+
+    By default every scene is its own Leonardo job and they run concurrently (the
+    shared poller multiplexes them). `batched` asks a single job for num_images
+    variations of the whole story instead: one job's latency and quota, but the
+    images are not scene-specific and bypass the cache.
+    """
+    timings = timings if timings is not None else [{} for _ in scenes]
+    if batched:
+        started = time.perf_counter()
+        with metrics.span(f"storyboard batch of {len(scenes)}", kind="stage"):
+            images = providers.generate_images(" ".join(scenes)[:MAX_PROMPT_CHARS], len(scenes))
+        for timing in timings:
+            timing["image"] = time.perf_counter() - started
+        return images if images and len(images) == len(scenes) else None
+
+    def work(i):
+        started = time.perf_counter()
+        with metrics.span(f"scene {i + 1}/{len(scenes)} image", kind="stage"):
+            image = providers.cached_image(cache, scenes[i], bypass=bypass)
+        timings[i]["image"] = time.perf_counter() - started
+        return image
+
+    with ThreadPoolExecutor(max_workers=len(scenes), thread_name_prefix="scene") as executor:
+        images = list(executor.map(pipeline.propagate(work), range(len(scenes))))
+    return images if all(images) else None
+
+
+def scene_durations(scenes, audio, report=None):
+    """Seconds each scene stays on screen.
+
+    Uses the narration segment lengths when the TTS report has one per scene,
+    otherwise shares the audio's length out by scene text length (e.g. for
+    narration served from the cache).
+    """
+    segments = report.segments if report is not None else []
+    if len(segments) == len(scenes) and all(s["duration"] > 0 for s in segments):
+        return [s["duration"] for s in segments]
+    total = mp3_duration(audio) or len(audio) * 8 / 128000
+    chars = sum(len(s) for s in scenes) or 1
+    return [total * len(s) / chars for s in scenes]
+
+
+def scene_report(scenes, timings, durations, report=None):
+    """Per-scene rows: text length, image time, narration synthesis time and time on screen"""
+    segments = report.segments if report is not None and len(report.segments) == len(scenes) else []
+    return [{
+        "scene": i + 1,
+        "chars": len(scene),
+        "image_s": round(timings[i].get("image", 0.0), 2) if i < len(timings) else None,
+        "narration_s": round(segments[i]["synthesis"], 2) if segments else None,
+        "on_screen_s": round(durations[i], 2),
+    } for i, scene in enumerate(scenes)]
+
+
+class Storyboard:
+    """Scenes of one run, shared by its image, voice and video stages, with their timings"""
+
+    def __init__(self, count, batched=False):
+        self.count = count
+        self.batched = batched
+        self.scenes = None
+        self.timings = []
+        self.report = None
+        self.durations = None
+        self._lock = threading.Lock()
+
+    def split(self, text):
+        with self._lock:
+            if self.scenes is None:
+                self.scenes = split_scenes(text, self.count)
+                self.timings = [{} for _ in self.scenes]
+            return self.scenes
+
+    def images(self, text, cache, bypass=False):
+        return illustrate(self.split(text), cache, bypass, self.batched, self.timings)
+
+    def narrate(self, text, cache, bypass=False, report=None, **kwargs):
+        """Narration chunked at scene boundaries, so each scene's segment length is known"""
+        self.report = report or TTSReport("storyboard")
+        return providers.cached_voice(cache, text, bypass, segments=self.split(text), report=self.report, **kwargs)
+
+    def timed(self, audio):
+        """Scene durations for the slideshow, matched to the narration"""
+        self.durations = scene_durations(self.scenes, audio, self.report)
+        return self.durations
+
+    def rows(self):
+        return scene_report(self.scenes or [], self.timings, self.durations or [0.0] * len(self.scenes or []), self.report)
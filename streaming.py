@@ -0,0 +1,152 @@
+# streaming.py — SSE token streaming for the Groq and Anthropic chat APIs
+import json
+import os
+import time
+
+import http_client
+
+# Base URLs can be pointed at a proxy or the local mock providers used by benchmark.py
+GROQ_CHAT = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1") + "/chat/completions"
+ANTHROPIC_MESSAGES = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1") + "/messages"
+
+
+class StreamStats:
+    """Time-to-first-token and throughput for one streamed completion"""
+
+    def __init__(self, model):
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.tokens = None
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self, tokens=None):
+        self.finished_at = time.perf_counter()
+        self.tokens = tokens or self.chunks
+
+    @property
+    def ttft(self):
+        return (self.first_token_at or self.finished_at or time.perf_counter()) - self.started
+
+    @property
+    def duration(self):
+        return (self.finished_at or time.perf_counter()) - self.started
+
+    @property
+    def tokens_per_sec(self):
+        generating = (self.finished_at or time.perf_counter()) - (self.first_token_at or self.started)
+        return (self.tokens or self.chunks) / generating if generating > 0 else 0.0
+
+    def summary(self):
+        return f"{self.model}: first token {self.ttft * 1000:.0f} ms · {self.tokens_per_sec:.0f} tok/s · {self.duration:.1f} s total"
+
+
+class Throttle:
+    """Call `fn` at most every `interval` seconds; flush() forces the last value out"""
+
+    def __init__(self, fn, interval=0.05):
+        self.fn = fn
+        self.interval = interval
+        self._last = 0.0
+        self._pending = None
+
+    def __call__(self, value):
+        self._pending = value
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.fn(value)
+            self._pending = None
+
+    def flush(self):
+        if self._pending is not None:
+            self.fn(self._pending)
+            self._pending = None
+
+
+def _flush(on_text):
+    flush = getattr(on_text, "flush", None)
+    if flush:
+        flush()
+
+
+def iter_sse(response):
+    """Yield the JSON payload of each `data:` line until the stream ends"""
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+
+def _open(url, headers, payload, model):
+    response = http_client.post(url, stage="story", headers=headers, json=payload, stream=True)
+    if response.status_code != 200:
+        body = response.text[:300]
+        response.close()
+        raise RuntimeError(f"{model} returned HTTP {response.status_code}: {body}")
+    return response
+
+
+def stream_groq(key, model, prompt, max_tokens, on_text=None):
+    """Stream an OpenAI-compatible Groq chat completion; returns (text, StreamStats).
+
+    `on_text` receives the accumulated text after each delta and may be a Throttle.
+    """
+    stats = StreamStats(model)
+    response = _open(GROQ_CHAT, {"Authorization": f"Bearer {key}"},
+                     {"model": model, "messages": [{"role": "user", "content": prompt}],
+                      "max_tokens": max_tokens, "stream": True}, model)
+    text, usage = "", None
+    with response:
+        for event in iter_sse(response):
+            usage = (event.get("x_groq") or {}).get("usage", {}).get("completion_tokens", usage)
+            choice = (event.get("choices") or [{}])[0]
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                stats.token()
+                text += delta
+                if on_text:
+                    on_text(text)
+            if choice.get("finish_reason") and usage is not None:
+                break
+    stats.finish(usage)
+    _flush(on_text)
+    return text, stats
+
+
+def stream_claude(key, model, prompt, max_tokens, on_text=None):
+    """Stream an Anthropic Messages completion; returns (text, StreamStats)"""
+    stats = StreamStats(model)
+    response = _open(ANTHROPIC_MESSAGES, {"x-api-key": key, "anthropic-version": "2023-06-01"},
+                     {"model": model, "max_tokens": max_tokens, "stream": True,
+                      "messages": [{"role": "user", "content": prompt}]}, model)
+    text, usage = "", None
+    with response:
+        for event in iter_sse(response):
+            kind = event.get("type")
+            if kind == "content_block_delta":
+                delta = event.get("delta", {}).get("text")
+                if delta:
+                    stats.token()
+                    text += delta
+                    if on_text:
+                        on_text(text)
+            elif kind == "message_delta":
+                usage = event.get("usage", {}).get("output_tokens", usage)
+            elif kind == "message_stop":
+                break
+            elif kind == "error":
+                raise RuntimeError(f"{model} stream error: {event.get('error', {}).get('message', event)}")
+    stats.finish(usage)
+    _flush(on_text)
+    return text, stats
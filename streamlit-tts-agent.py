@@ -1,10 +1,32 @@
 # app.py — Beautiful AI Video Agent with Modern UI
 import streamlit as st
-import requests
 import base64
-from PIL import Image
 import io
+import os
+import re
 import time
+import zipfile
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import http_client
+import imaging
+import jobs
+import mastering
+import metrics
+import providers
+from artifacts import ArtifactStore, MemoryLedger, public_url, start_artifact_server
+from budget import TRACKER, StoryBudget
+from cache import ResultCache
+from jobs import ACTIVE, JobCancelled, JobManager
+from pipeline import Pipeline, Stage
+from prompt_index import DEFAULT_THRESHOLD, PromptIndex
+from rate_limit import build_limiters
+from rerun_profile import RerunProfiler
+from storyboard import MAX_SCENES, Storyboard
+from streaming import Throttle
+from tts import TTSReport
+from video import EncodeResult, encode_slideshow, encode_video, ffmpeg_available
 
 # ═══════════════════════════════════════════════════════════
 # PAGE CONFIG & CUSTOM STYLING
@@ -16,8 +38,12 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Every rerun of this session is timed and its websocket bytes counted (see "⏱️ Rerun profiler" at the bottom)
+profiler = st.session_state.setdefault("rerun_profiler", RerunProfiler())
+profiler.start_page()
+
 # Custom CSS for beautiful UI
-st.markdown("""
+STYLE = """
 <style>
     /* Main container */
     .main {
@@ -147,8 +173,8 @@ st.markdown("""
         gap: 0.5rem;
     }
     
-    /* Download buttons */
-    .stDownloadButton > button {
+    /* Download buttons (links to the artifact server when it is on) */
+    .stDownloadButton > button, .stLinkButton > a {
         background: linear-gradient(135deg, #11998e 0%, #38ef7d 100%);
         color: white;
         border: none;
@@ -158,7 +184,7 @@ st.markdown("""
         transition: all 0.3s ease;
     }
     
-    .stDownloadButton > button:hover {
+    .stDownloadButton > button:hover, .stLinkButton > a:hover {
         transform: scale(1.05);
         box-shadow: 0 5px 15px rgba(17, 153, 142, 0.4);
     }
@@ -196,28 +222,70 @@ st.markdown("""
         font-weight: 600;
         margin: 0.2rem;
     }
+    
+    /* Feature showcase */
+    .feature-grid {
+        display: grid;
+        grid-template-columns: repeat(4, 1fr);
+        gap: 1rem;
+    }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # ═══════════════════════════════════════════════════════════
 # HEADER
 # ═══════════════════════════════════════════════════════════
-st.markdown("""
+HEADER = """
 <div class="main-header">
     <div class="main-title">🎬 AI Video Creator Studio</div>
     <div class="main-subtitle">Transform Your Words into Cinematic Experiences</div>
 </div>
-""", unsafe_allow_html=True)
+"""
+
+FEATURES = [
+    ("✍️", "AI Writing", "Powered by Groq & Claude"),
+    ("🎨", "Image Gen", "Leonardo AI"),
+    ("🎙️", "Voice AI", "ElevenLabs TTS"),
+    ("🎬", "Video Mix", "Instant Creation"),
+]
+
+@st.cache_data
+def static_chrome():
+    """The page's fixed HTML, built and minified once per process: (CSS + header, feature showcase)"""
+    css = re.sub(r"/\*.*?\*/", "", STYLE, flags=re.S)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", re.sub(r"\s+", " ", css)).strip()
+    cards = "".join(f"""
+        <div class="feature-card">
+            <div class="feature-icon">{icon}</div>
+            <div class="feature-title">{title}</div>
+            <div style="font-size: 0.9rem; opacity: 0.9;">{subtitle}</div>
+        </div>""" for icon, title, subtitle in FEATURES)
+    return css + HEADER.strip(), f'<div class="content-card"><div class="feature-grid">{cards}</div></div>'
+
+chrome, showcase = static_chrome()
+st.markdown(chrome, unsafe_allow_html=True)
 
 # ═══════════════════════════════════════════════════════════
 # API KEYS CHECK
 # ═══════════════════════════════════════════════════════════
-GROQ_KEY = st.secrets.get("GROQ_API_KEY")
-ANTHROPIC_KEY = st.secrets.get("ANTHROPIC_API_KEY")
-LEONARDO_KEY = st.secrets.get("LEONARDO_KEY")
-ELEVENLABS_KEY = st.secrets.get("ELEVENLABS_KEY")
+SECRETS = ("GROQ_API_KEY", "ANTHROPIC_API_KEY", "LEONARDO_KEY", "ELEVENLABS_KEY")
 
-if not all([GROQ_KEY, ANTHROPIC_KEY, LEONARDO_KEY, ELEVENLABS_KEY]):
+@st.cache_resource
+def configure_providers(groq, anthropic, leonardo, elevenlabs):
+    """Hand the keys to the providers once per process (again only if they change)"""
+    providers.configure(groq=groq, anthropic=anthropic, leonardo=leonardo, elevenlabs=elevenlabs)
+    # Generation runs on background workers, so provider messages are posted to the job and shown when it is drawn
+    providers.on_error = jobs.notify("error")
+    providers.on_warning = jobs.notify("warning")
+
+# Read once per session; until all four are set they are checked again on every rerun
+if "api_keys" not in st.session_state:
+    keys = [st.secrets.get(name) for name in SECRETS]
+    if all(keys):
+        st.session_state.api_keys = keys
+API_KEYS = st.session_state.get("api_keys")
+
+if not API_KEYS:
     st.markdown("""
     <div class="content-card">
         <div style="text-align: center; padding: 2rem;">
@@ -244,252 +312,681 @@ ANTHROPIC_API_KEY = "sk-ant-api03..."
 LEONARDO_KEY = "your-leonardo-key"
 ELEVENLABS_KEY = "your-elevenlabs-key"
 """, language="toml")
+    profiler.finish_page()
     st.stop()
 
+configure_providers(*API_KEYS)
+
 # ═══════════════════════════════════════════════════════════
 # FEATURE SHOWCASE
 # ═══════════════════════════════════════════════════════════
-st.markdown('<div class="content-card">', unsafe_allow_html=True)
+st.markdown(showcase, unsafe_allow_html=True)
 
-col1, col2, col3, col4 = st.columns(4)
+# ═══════════════════════════════════════════════════════════
+# AI FUNCTIONS
+# ═══════════════════════════════════════════════════════════
+@st.cache_resource
+def get_result_cache():
+    """One disk cache shared by every session in this process"""
+    return ResultCache()
 
-with col1:
-    st.markdown("""
-    <div class="feature-card">
-        <div class="feature-icon">✍️</div>
-        <div class="feature-title">AI Writing</div>
-        <div style="font-size: 0.9rem; opacity: 0.9;">Powered by Groq & Claude</div>
-    </div>
-    """, unsafe_allow_html=True)
+@st.cache_resource
+def get_artifact_store():
+    """Generated media on disk, each distinct file written once; served to browsers on ARTIFACT_PORT if set"""
+    store = ArtifactStore()
+    start_artifact_server(store)
+    return store
 
-with col2:
-    st.markdown("""
-    <div class="feature-card">
-        <div class="feature-icon">🎨</div>
-        <div class="feature-title">Image Gen</div>
-        <div style="font-size: 0.9rem; opacity: 0.9;">Leonardo AI</div>
-    </div>
-    """, unsafe_allow_html=True)
+@st.cache_resource
+def get_memory_ledger():
+    """Media bytes each session holds in this process, for sizing workers"""
+    return MemoryLedger()
 
-with col3:
-    st.markdown("""
-    <div class="feature-card">
-        <div class="feature-icon">🎙️</div>
-        <div class="feature-title">Voice AI</div>
-        <div style="font-size: 0.9rem; opacity: 0.9;">ElevenLabs TTS</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Browser-facing base URL of the artifact server; None serves media through the session instead
+MEDIA_URL = public_url()
 
-with col4:
-    st.markdown("""
-    <div class="feature-card">
-        <div class="feature-icon">🎬</div>
-        <div class="feature-title">Video Mix</div>
-        <div style="font-size: 0.9rem; opacity: 0.9;">Instant Creation</div>
+@st.cache_resource
+def get_prompt_index():
+    """Prompts of finished videos, searched for close matches as the user types"""
+    return PromptIndex()
+
+@st.cache_resource
+def get_limiters():
+    """Provider quota queues shared by every session in this process"""
+    return build_limiters()
+
+providers.LIMITS.update(get_limiters())
+
+@st.cache_resource
+def get_metrics_server():
+    """Prometheus /metrics endpoint on METRICS_PORT, started once per process"""
+    return metrics.start_metrics_server()
+
+get_metrics_server()
+
+def compose_video(img_data, audio, durations=None):
+    """Encode processed image(s) + mastered narration to an MP4 with ffmpeg, falling back to an HTML card"""
+    scenes = img_data if isinstance(img_data, list) else [img_data]
+    if ffmpeg_available():
+        originals, narration = [scene.original.data for scene in scenes], audio.download.data
+        try:
+            return encode_slideshow(originals, narration, durations) if len(scenes) > 1 else encode_video(originals[0], narration)
+        except Exception as e:
+            providers.on_warning(f"⚠️ Video encoding failed, showing a preview card instead: {str(e)}")
+    return compose_video_card(scenes[0].display, audio.playback)
+
+def compose_video_card(rendition, audio):
+    """Inline an image rendition + narration into a playable HTML video card"""
+    img_b64 = base64.b64encode(rendition.data).decode()
+    audio_b64 = base64.b64encode(audio.data).decode()
+    return video_card(f"data:{rendition.mime};base64,{img_b64}", f"data:{audio.mime};base64,{audio_b64}", audio.mime)
+
+def video_card(image_src, audio_src, audio_mime):
+    return f"""
+    <div style="position: relative; width: 100%; border-radius: 20px; overflow: hidden; box-shadow: 0 20px 60px rgba(0,0,0,0.3);">
+        <img src="{image_src}" style="width: 100%; display: block;">
+        <audio controls autoplay style="width: 100%; position: absolute; bottom: 0; background: rgba(0,0,0,0.7);">
+            <source src="{audio_src}" type="{audio_mime}">
+        </audio>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
-st.markdown('</div>', unsafe_allow_html=True)
+def scenes_zip(job, count):
+    """A job's original storyboard images as one zip download"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(1, count + 1):
+            name = f"scene{i:02d}"
+            data = job.read(name)
+            if data is not None:
+                archive.writestr(job.artifacts[name]["file"], data)
+    return buffer.getvalue()
 
-# ═══════════════════════════════════════════════════════════
-# AI FUNCTIONS
-# ═══════════════════════════════════════════════════════════
+def build_pipeline(prompt, settings, cache, hooks=None, trace=None):
+    """Story first, then image + voice in parallel, then the audio master and the video mix"""
+    hooks = hooks or {}
 
-def create_story(prompt):
-    """Generate and enhance story with Groq + Claude"""
-    try:
-        # Groq (fast generation)
-        r = requests.post("https://api.groq.com/openai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {GROQ_KEY}"},
-            json={"model": "llama-3.2-90b-text-preview", 
-                  "messages": [{"role": "user", "content": f"Write a short vivid cinematic scene (max 150 words): {prompt}"}], 
-                  "max_tokens": 200})
-        raw = r.json()["choices"][0]["message"]["content"]
-
-        # Claude (enhance)
-        r2 = requests.post("https://api.anthropic.com/v1/messages",
-            headers={"x-api-key": ANTHROPIC_KEY, "anthropic-version": "2023-06-01"},
-            json={"model": "claude-3-5-sonnet-20241022", 
-                  "max_tokens": 250, 
-                  "messages": [{"role": "user", "content": f"Make this vivid, cinematic, and descriptive (max 150 words):\n\n{raw}"}]})
-        enhanced = r2.json()["content"][0]["text"]
-        return raw, enhanced
-    except Exception as e:
-        st.error(f"❌ Story generation failed: {str(e)}")
-        return None, None
-
-def generate_image(prompt):
-    """Generate image with Leonardo AI"""
-    try:
-        r = requests.post("https://cloud.leonardo.ai/api/rest/v1/generations",
-            headers={"Authorization": f"Bearer {LEONARDO_KEY}"},
-            json={"prompt": f"cinematic, detailed, high quality: {prompt}", 
-                  "width": 768, 
-                  "height": 512, 
-                  "num_images": 1})
-        job_id = r.json()["sdGenerationJob"]["generationId"]
-
-        for i in range(25):
-            time.sleep(3)
-            resp = requests.get(f"https://cloud.leonardo.ai/api/rest/v1/generations/{job_id}",
-                headers={"Authorization": f"Bearer {LEONARDO_KEY}"})
-            data = resp.json()
-            
-            if data["generations_by_pk"]["status"] == "COMPLETE":
-                url = data["generations_by_pk"]["generated_images"][0]["url"]
-                return requests.get(url, stream=True).content
-        
-        st.warning("⏱️ Image generation timed out")
-        return None
-    except Exception as e:
-        st.error(f"❌ Image generation failed: {str(e)}")
-        return None
+    def init_worker():
+        jobs.bind(hooks.get("job"))
+        providers.set_queue_listener(hooks.get("on_queue"))
+    use_cache = settings.get("use_cache", True)
+    board = hooks.get("storyboard")
+
+    def story():
+        return providers.cached_story(cache, prompt, bypass=not use_cache, on_draft=hooks.get("on_draft"),
+                                      on_enhanced=hooks.get("on_enhanced"), stats=hooks.get("story_stats"),
+                                      budget=hooks.get("story_budget"))
+
+    def image(story):
+        # Decoding and re-encoding happen here on the worker, not on the script thread
+        if board:
+            images = board.images(story[1], cache, bypass=not use_cache)
+            return imaging.process_images(images) if images else None
+        data = providers.cached_image(cache, story[1], bypass=not use_cache)
+        return imaging.process_image(data) if data else None
+
+    def voice(story):
+        options = {"chunked": settings.get("chunked_tts", True), "on_first_audio": hooks.get("on_first_audio"),
+                   "report": hooks.get("tts_report")}
+        if board:
+            return board.narrate(story[1], cache, bypass=not use_cache, **options)
+        return providers.cached_voice(cache, story[1], bypass=not use_cache, **options)
+
+    def audio(voice_data):
+        if not settings.get("master_audio", True):
+            return mastering.passthrough(voice_data, "Narration left as received")
+        try:
+            return mastering.master(voice_data)
+        except mastering.AudioProcessingFailed as e:
+            providers.on_warning(f"⚠️ Narration post-processing failed, playing it as received: {str(e)}")
+            return mastering.passthrough(voice_data, "Post-processing failed — narration left as received")
+
+    def video(img_data, mastered):
+        durations = None
+        if board:
+            durations = board.timed(mastered.original.data)
+            # The first scene loses whatever leading silence was trimmed off the narration
+            durations[0] = max(durations[0] - mastered.trimmed[0], 0.1)
+        return compose_video(img_data, mastered, durations)
+
+    return Pipeline([
+        Stage("story", story, label="📝 Writing your story...", weight=20),
+        Stage("image", image, inputs=["story"],
+              label="🎨 Creating your image...", weight=30),
+        Stage("voice", voice, inputs=["story"],
+              label="🎙️ Generating voice narration...", weight=25),
+        Stage("audio", audio, inputs=["voice"],
+              label="🎚️ Mastering the narration...", weight=5),
+        Stage("video", video, inputs=["image", "audio"],
+              label="🎬 Composing final video...", weight=20),
+    ], initializer=init_worker, trace=trace)
 
-def generate_voice(text):
-    """Generate voice with ElevenLabs"""
+def save_image(job, name, image):
+    """Persist a processed image's original and its display/thumbnail renditions as job artifacts"""
+    job.save(name, image.original.data, f"{name}.{image.original.extension}", image.original.mime)
+    for rendition in ("display", "thumbnail"):
+        data = getattr(image, rendition)
+        job.save(f"{name}.{rendition}", data.data, f"{name}_{rendition}.{data.extension}", data.mime)
+
+def run_generation(job, cache, index=None):
+    """Job body, run on the worker pool: the pipeline's progress, text and artifacts are recorded on the job.
+
+    A finished video's prompt is added to `index`, so later prompts close to it can reuse it.
+    """
+    prompt, settings = job.prompt, job.settings
+    story_stats = []
+    story_budget = StoryBudget(settings["story_budget"]) if settings["story_budget"] else None
+    board = Storyboard(settings["scenes"], settings["batch_images"]) if settings["scenes"] > 1 else None
+    tts_report = TTSReport("chunked" if settings["chunked_tts"] else "single-shot")
+    trace = metrics.Trace(prompt[:60])
+    
+    def show_queue(provider, position, eta):
+        waiting = dict(job.waiting)
+        if position:
+            waiting[provider] = f"⏳ Waiting for {provider.title()} quota — #{position} in line, ~{eta:.0f}s"
+        else:
+            waiting.pop(provider, None)
+        job.update(waiting=waiting)
+    
+    run = build_pipeline(prompt, settings, cache, trace=trace, hooks={
+        "job": job,
+        # Throttled, so a fast stream doesn't bump the job's version (and redraw it) on every token
+        "on_draft": Throttle(lambda text: job.update(draft=text)) if settings["stream_story"] else None,
+        "on_enhanced": Throttle(lambda text: job.update(story=text)) if settings["stream_story"] else None,
+        "story_stats": story_stats,
+        "story_budget": story_budget,
+        "storyboard": board,
+        "on_first_audio": lambda audio: job.update(preview=audio),
+        "tts_report": tts_report,
+        "on_queue": show_queue,
+    })
+    # Cancelling the job cancels the pipeline's stages directly
+    run.cancel_event = job.cancel_event
+    job.update(running=[run.stages["story"].label])
+    done_weight = 0
     try:
-        url = "https://api.elevenlabs.io/v1/text-to-speech/21m00Tcm4TlvDq8ikWAM"
-        r = requests.post(url, 
-            headers={"xi-api-key": ELEVENLABS_KEY},
-            json={"text": text, 
-                  "voice_settings": {"stability": 0.75, "similarity_boost": 0.8},
-                  "model_id": "eleven_monolingual_v1"})
-        return r.content
-    except Exception as e:
-        st.error(f"❌ Voice generation failed: {str(e)}")
-        return None
+        for result in run.run():
+            if not result.ok:
+                raise result.error
+            if job.cancel_event.is_set():
+                raise JobCancelled(f"{job.id} cancelled")
+            done_weight += result.stage.weight
+            job.update(progress=done_weight / run.total_weight, running=run.running_labels())
+            
+            if result.name == "story":
+                raw, final_text = result.value
+                job.update(draft=raw, story=final_text)
+                job.save("draft", raw, "draft.txt", "text/plain")
+                job.save("story", final_text, "story.txt", "text/plain")
+                job.set_info(story_stats=" | ".join(s.summary() for s in story_stats))
+                if story_budget and story_budget.path:
+                    job.set_info(budget={"fraction": min(story_budget.used / story_budget.seconds, 1.0),
+                                         "text": story_budget.summary()})
+                elif story_budget:
+                    job.set_info(budget={"text": "⏱️ ♻️ Served from cache — no budget used"})
+            
+            elif result.name == "image":
+                if board:
+                    for i, image in enumerate(result.value, 1):
+                        save_image(job, f"scene{i:02d}", image)
+                    job.save("scenes.zip", scenes_zip(job, len(result.value)), "scenes.zip", "application/zip")
+                    job.set_info(scenes=board.scenes, image_caption=imaging.savings_summary(result.value, "thumbnail"))
+                else:
+                    save_image(job, "image", result.value)
+                    job.set_info(image_caption=result.value.summary())
+            
+            elif result.name == "voice":
+                job.save("voice", result.value, "voice.mp3", "audio/mpeg")
+                job.set_info(voice_note=tts_report.summary() if tts_report.total is not None else "♻️ Served from cache")
+            
+            elif result.name == "audio":
+                for rendition in ("playback", "download"):
+                    data = getattr(result.value, rendition)
+                    job.save(f"audio.{rendition}", data.data, f"narration_{rendition}.{data.extension}", data.mime)
+                job.set_info(audio_caption=result.value.summary())
+            
+            elif result.name == "video":
+                if isinstance(result.value, EncodeResult):
+                    job.attach("video", result.value.path, "video.mp4", "video/mp4")
+                    job.set_info(video_caption=result.value.summary())
+                else:
+                    job.save("video.card", result.value, "video_card.html", "text/html")
+                if board:
+                    job.set_info(scene_rows=board.rows())
+            job.persist()
+        if index is not None and not job.cancel_event.is_set():
+            index.add(prompt, {"job": job.id})
+    finally:
+        trace.finish()
+        job.set_info(waterfall=trace.waterfall())
 
 # ═══════════════════════════════════════════════════════════
 # MAIN INPUT SECTION
 # ═══════════════════════════════════════════════════════════
-st.markdown('<div class="content-card">', unsafe_allow_html=True)
-
-st.markdown('<h2 style="color: #667eea; text-align: center; margin-bottom: 1rem;">✨ Describe Your Scene</h2>', unsafe_allow_html=True)
-
-# Example prompts
-with st.expander("💡 Need inspiration? Try these examples"):
-    examples = [
-        "A cyberpunk samurai walking through neon Tokyo rain at midnight",
-        "An astronaut discovering ancient alien ruins on Mars at sunset",
-        "A magical forest with glowing mushrooms and fairy lights at dusk",
-        "A steampunk airship soaring above Victorian London in fog",
-        "A dragon perched on a mountain peak during a lightning storm"
-    ]
-    for ex in examples:
-        if st.button(ex, key=ex):
-            st.session_state.prompt = ex
-
-prompt = st.text_area(
-    "Your scene description",
-    height=120,
-    value=st.session_state.get('prompt', ''),
-    placeholder="Example: A mysterious lighthouse on a stormy cliff, waves crashing, lightning illuminating the dark sky...",
-    help="Be descriptive! Include details about setting, mood, lighting, and atmosphere."
-)
+EXAMPLES = [
+    "A cyberpunk samurai walking through neon Tokyo rain at midnight",
+    "An astronaut discovering ancient alien ruins on Mars at sunset",
+    "A magical forest with glowing mushrooms and fairy lights at dusk",
+    "A steampunk airship soaring above Victorian London in fog",
+    "A dragon perched on a mountain peak during a lightning storm"
+]
 
-st.markdown('</div>', unsafe_allow_html=True)
+@st.cache_resource
+def get_job_manager():
+    """Generation worker pool shared by every session in this process"""
+    return JobManager(store=get_artifact_store())
 
-# ═══════════════════════════════════════════════════════════
-# GENERATE BUTTON
-# ═══════════════════════════════════════════════════════════
-generate_col1, generate_col2, generate_col3 = st.columns([1, 2, 1])
-with generate_col2:
-    generate_button = st.button("🎬 Create My Video", type="primary", use_container_width=True)
+manager = get_job_manager()
+cache = get_result_cache()
+index = get_prompt_index()
+
+def show_job(job):
+    st.session_state.job_id = job.id
+    st.query_params["job"] = job.id
+
+def reuse_match(entry, past, settings):
+    """Switch to a close match's video: its job while kept, else a rerun of its prompt served by the result cache"""
+    if past is None:
+        past = manager.submit(entry["prompt"], settings, lambda job: run_generation(job, cache, index))
+    metrics.PROMPT_REUSE.inc(source="cache" if past.active else "job")
+    show_job(past)
+
+@st.fragment
+@profiler.fragment("input pane")
+def input_pane():
+    """Prompt, examples, settings and the Create button; using them reruns only this pane"""
+    st.markdown('<div class="content-card">', unsafe_allow_html=True)
+    
+    st.markdown('<h2 style="color: #667eea; text-align: center; margin-bottom: 1rem;">✨ Describe Your Scene</h2>', unsafe_allow_html=True)
+    
+    # Example prompts
+    with st.expander("💡 Need inspiration? Try these examples"):
+        for ex in EXAMPLES:
+            if st.button(ex, key=ex):
+                st.session_state.prompt = ex
+    
+    prompt = st.text_area(
+        "Your scene description",
+        height=120,
+        value=st.session_state.get('prompt', ''),
+        placeholder="Example: A mysterious lighthouse on a stormy cliff, waves crashing, lightning illuminating the dark sky...",
+        help="Be descriptive! Include details about setting, mood, lighting, and atmosphere."
+    )
+    
+    with st.expander("⚙️ Generation settings"):
+        settings = {
+            "stream_story": st.checkbox(
+                "⚡ Stream the story as it's written",
+                value=True,
+                help="Show Groq and Claude tokens as they arrive instead of waiting for the full text."
+            ),
+            "chunked_tts": st.checkbox(
+                "🔊 Chunked parallel narration",
+                value=True,
+                help="Synthesize the narration sentence by sentence in parallel and start playback as soon as the first chunk is ready. Untick for the single-request path."
+            ),
+            "master_audio": st.checkbox(
+                "🎚️ Normalize and compress the narration",
+                value=True,
+                help="Level the narration's loudness, trim leading/trailing silence and play a compact Opus encoding (MP3 for download). Needs ffmpeg."
+            ),
+            "use_cache": st.checkbox(
+                "♻️ Reuse cached results for repeated prompts",
+                value=True,
+                help="Identical prompts are served from the local cache instantly and use no API quota. Untick to force fresh generations."
+            ),
+            "story_budget": st.slider(
+                "⏱️ Story latency budget (seconds)",
+                min_value=0.0, max_value=20.0, value=0.0, step=0.5,
+                help="0 = off. Otherwise Claude's enhancement is run, time-boxed or skipped depending on how fast it has been answering, and slow requests are hedged with a duplicate."
+            ),
+            "scenes": st.slider(
+                "🎞️ Storyboard scenes",
+                min_value=1, max_value=MAX_SCENES, value=1,
+                help="Split the story into scenes, illustrate them in parallel and time the slideshow to the narration."
+            ),
+            "batch_images": st.checkbox(
+                "🗃️ Request all scene images in one Leonardo job",
+                value=False,
+                help="Faster and uses less quota, but the images are variations of the whole story rather than one per scene."
+            ),
+            "reuse_threshold": st.slider(
+                "🔁 Suggest a past video above this similarity",
+                min_value=0.5, max_value=1.0, value=DEFAULT_THRESHOLD, step=0.01,
+                help="When the prompt is this close to one already made, offer that video instead of a new generation. 1.0 = identical prompts only."
+            ),
+        }
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # ═══════════════════════════════════════════════════════════
+    # GENERATE BUTTON
+    # ═══════════════════════════════════════════════════════════
+    generate_col1, generate_col2, generate_col3 = st.columns([1, 2, 1])
+    with generate_col2:
+        generate_button = st.button("🎬 Create My Video", type="primary", use_container_width=True)
+    
+    # A prompt close to one already made offers that video: straight from its job while the job is
+    # kept, otherwise by regenerating the matched prompt, which the result cache then serves.
+    # Lookups take well under a millisecond, so the prompt is checked on every rerun
+    match = index.best(prompt, settings["reuse_threshold"]) if prompt.strip() and not generate_button else None
+    if match:
+        score, entry = match
+        past = manager.get(entry["meta"].get("job"))
+        past = past if past is not None and past.status == "done" else None
+        if past is None or past.id != st.session_state.get("job_id"):
+            st.info(f"🔁 **{score:.0%} similar** to a video made before: “{entry['prompt']}”"
+                    + ("" if past or not settings["use_cache"] else " — its results will come from the cache"))
+            reuse_col1, reuse_col2, reuse_col3 = st.columns([1, 2, 1])
+            with reuse_col2:
+                if st.button("🔁 Reuse that video", use_container_width=True):
+                    reuse_match(entry, past, settings)
+                    st.rerun()
+    
+    if generate_button and prompt:
+        # The job runs on the worker pool; the job pane below only watches it
+        show_job(manager.submit(prompt, settings, lambda job: run_generation(job, cache, index)))
+        st.rerun()
+    elif generate_button:
+        st.warning("⚠️ Please enter a scene description first!")
+
+input_pane()
 
 # ═══════════════════════════════════════════════════════════
 # GENERATION PROCESS
 # ═══════════════════════════════════════════════════════════
-if generate_button and prompt:
+ENHANCED_STYLE = "font-size: 1.1rem; line-height: 1.8; color: #333;"
+DRAFT_STYLE = "font-size: 1rem; line-height: 1.7; color: #666;"
+# A running job's pane is redrawn on this timer; each tick reruns only that pane
+JOB_POLL_INTERVAL = 0.25
+SPAN_COLORS = {"stage": "#667eea", "http": "#11998e", "wait": "#f5a623", "tts": "#764ba2", "hedge": "#4facfe", "cpu": "#43e97b", "route": "#f093fb"}
+
+def render_waterfall(rows):
+    """HTML waterfall of a run's spans: one bar per stage, HTTP call and wait"""
+    if not rows:
+        return "<p style='color: #666;'>No spans recorded.</p>"
+    total = max(r["offset"] + r["duration"] for r in rows) or 1
+    depth = {}
+    html = []
+    for r in rows:
+        depth[r["span"]] = depth.get(r["parent"], -1) + 1
+        left, width = 100 * r["offset"] / total, max(100 * r["duration"] / total, 0.5)
+        color = "#f5576c" if r.get("error") else SPAN_COLORS.get(r["kind"], "#999")
+        detail = " · ".join(f"{k} {r[k]}" for k in ("status", "retries", "bytes_in", "bytes_out") if r.get(k))
+        html.append(f"""
+        <div style="display: flex; align-items: center; font-size: 0.8rem; margin: 2px 0;">
+            <div style="width: 38%; padding-left: {depth[r['span']] * 12}px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;" title="{detail}">{r['name']}</div>
+            <div style="width: 50%; position: relative; height: 12px; background: #f0f0f0; border-radius: 6px;">
+                <div style="position: absolute; left: {left:.2f}%; width: {width:.2f}%; height: 100%; background: {color}; border-radius: 6px;"></div>
+            </div>
+            <div style="width: 12%; text-align: right; color: #666;">{r['duration'] * 1000:.0f} ms</div>
+        </div>""")
+    return "".join(html)
+
+# Circuit breaker state of each routed backend
+BREAKER_ICONS = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}
+
+JOB_BADGES = {
+    "done": ("#11998e", "✅ Complete!"),
+    "failed": ("#f5576c", "❌ Stopped — a step failed"),
+    "cancelled": ("#f5a623", "✖️ Cancelled"),
+    "interrupted": ("#f5576c", "⚠️ Interrupted — the app restarted before this video was finished"),
+}
+
+# Shown in place of media the artifact store has evicted since the job finished
+GONE = "no longer available — cleared from storage"
+
+def media(job, name, held, download=None):
+    """An artifact to show or download: its artifact-server URL when there is one, else its bytes from disk.
+
+    Nothing is kept between reruns; `held` tallies the bytes this render put in memory vs. left on disk.
+    None when the job has no such artifact or the store has since evicted it.
+    """
+    artifact, stored = job.artifacts.get(name), job.stored(name)
+    if artifact is None:
+        return None
+    if MEDIA_URL and stored:
+        if not job.store.exists(*stored):
+            return None
+        held["referenced"] += artifact["bytes"]
+        return f"{MEDIA_URL}/{stored[0]}.{stored[1]}" + (f"?download={download}" if download else "")
+    data = job.read(name)
+    held["inline"] += len(data or b"")
+    return data
+
+def download(job, name, label, filename, mime):
+    """A download of an artifact that costs the session nothing until clicked"""
+    path = job.path(name)
+    if path is None or not os.path.exists(path):
+        st.button(label, disabled=True, help=GONE, key=f"gone_{name}", use_container_width=True)
+    elif MEDIA_URL and job.stored(name):
+        st.link_button(label, media(job, name, {"referenced": 0}, download=filename), use_container_width=True)
+    else:
+        # Read from disk only when the user asks for it
+        st.download_button(label, lambda: job.read(name), filename, mime, use_container_width=True)
+
+def account(held):
+    """Record what this session's latest render holds, for the memory line in the stats"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        get_memory_ledger().record(ctx.session_id, held["inline"], held["referenced"])
+
+def render_job(manager, job, state):
+    """Draw a job from a snapshot of its state: the live panes while it runs, then the video, downloads and stats"""
+    info, artifacts = state["info"], state["artifacts"]
+    held = {"inline": 0, "referenced": 0}
     st.markdown('<div class="content-card">', unsafe_allow_html=True)
     
-    progress = st.progress(0)
-    status = st.empty()
+    st.progress(int(100 * state["progress"]))
+    if state["status"] == "queued":
+        position = manager.position(job)
+        badges = f'<div class="status-badge">🕒 Queued — #{position} in line for one of {manager.max_jobs} workers</div>'
+    elif state["status"] == "running":
+        badges = "".join(f'<div class="status-badge">{label}</div>' for label in state["running"])
+    else:
+        color, label = JOB_BADGES[state["status"]]
+        badges = f'<div class="status-badge" style="background: {color};">{label}</div>'
+    st.markdown(badges, unsafe_allow_html=True)
+    if state["waiting"]:
+        st.markdown("".join(f'<div class="status-badge" style="background: #f5a623;">{w}</div>' for w in state["waiting"].values()), unsafe_allow_html=True)
+    for kind, text in state["messages"]:
+        (st.error if kind == "error" else st.warning)(text)
+    if state["status"] in ACTIVE:
+        st.button("✖️ Cancel", key="cancel_job", on_click=manager.cancel, args=(job.id,))
     
-    # Step 1: Generate Story
-    status.markdown('<div class="status-badge">📝 Writing your story...</div>', unsafe_allow_html=True)
-    raw, final_text = create_story(prompt)
+    st.markdown('<div class="result-section">', unsafe_allow_html=True)
+    st.markdown('<div class="section-title">📖 Your Story</div>', unsafe_allow_html=True)
     
-    if raw and final_text:
-        progress.progress(20)
-        
+    tab1, tab2 = st.tabs(["✨ Enhanced Version", "📄 Original Draft"])
+    with tab1:
+        if state["story"]:
+            st.markdown(f"<div style='{ENHANCED_STYLE}'>{state['story']}</div>", unsafe_allow_html=True)
+        elif state["draft"]:
+            st.markdown(f"<div style='{DRAFT_STYLE}'>{state['draft']}</div>", unsafe_allow_html=True)
+    with tab2:
+        if state["draft"]:
+            st.markdown(f"<div style='{DRAFT_STYLE}'>{state['draft']}</div>", unsafe_allow_html=True)
+    if info.get("story_stats"):
+        st.caption(info["story_stats"])
+    if "fraction" in info.get("budget", {}):
+        st.progress(info["budget"]["fraction"], text=info["budget"]["text"])
+    elif info.get("budget"):
+        st.caption(info["budget"]["text"])
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    if info.get("image_caption"):
         st.markdown('<div class="result-section">', unsafe_allow_html=True)
-        st.markdown('<div class="section-title">📖 Your Story</div>', unsafe_allow_html=True)
+        if info.get("scenes"):
+            st.markdown('<div class="section-title">🖼️ Your Storyboard</div>', unsafe_allow_html=True)
+            cols = st.columns(min(len(info["scenes"]), 3))
+            for i, scene in enumerate(info["scenes"]):
+                with cols[i % len(cols)]:
+                    thumbnail = media(job, f"scene{i + 1:02d}.thumbnail", held)
+                    if thumbnail is None:
+                        st.caption(f"Scene {i + 1}: {GONE}")
+                    else:
+                        st.image(thumbnail, caption=f"Scene {i + 1}: {scene[:80]}", use_container_width=True)
+        else:
+            st.markdown('<div class="section-title">🖼️ Your Image</div>', unsafe_allow_html=True)
+            image = media(job, "image.display", held)
+            if image is None:
+                st.caption(GONE)
+            else:
+                st.image(image, use_container_width=True)
+        st.caption(info["image_caption"])
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Audio moves from the opening preview to the full narration to the mastered encoding
+    if "audio.playback" in artifacts:
+        audio, note, mime = media(job, "audio.playback", held), f"{info.get('voice_note', '')}  \n{info.get('audio_caption', '')}", artifacts["audio.playback"]["mime"]
+    elif "voice" in artifacts:
+        audio, note, mime = media(job, "voice", held), info.get("voice_note", ""), "audio/mp3"
+    elif state["preview"]:
+        audio, note, mime = state["preview"], "▶️ Preview of the opening — the full narration is still being synthesized...", "audio/mp3"
+        held["inline"] += len(audio)
+    else:
+        audio = None
+    if audio is None and ("audio.playback" in artifacts or "voice" in artifacts):
+        st.caption(f"🎵 {GONE}")
+    elif audio is not None:
+        st.markdown('<div class="result-section">', unsafe_allow_html=True)
+        st.markdown('<div class="section-title">🎵 Your Audio</div>', unsafe_allow_html=True)
+        st.audio(audio, format=mime)
+        st.caption(note)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    if state["status"] in ACTIVE:
+        account(held)
+        st.markdown('</div>', unsafe_allow_html=True)
+        return
+    
+    if "video" in artifacts or "video.card" in artifacts:
+        st.markdown('<div class="result-section">', unsafe_allow_html=True)
+        st.markdown('<div class="section-title">🎥 Your Final Video</div>', unsafe_allow_html=True)
+        if "video" in artifacts:
+            video = media(job, "video", held)
+            if video is None:
+                st.caption(GONE)
+            else:
+                st.video(video, format="video/mp4")
+                st.caption(info.get("video_caption", ""))
+        elif MEDIA_URL and job.stored("audio.playback"):
+            # The card's image and narration load from the artifact server instead of riding in the page as base64
+            image = "scene01.display" if info.get("scenes") else "image.display"
+            image, audio = media(job, image, held), media(job, "audio.playback", held)
+            if image is None or audio is None:
+                st.caption(GONE)
+            else:
+                st.markdown(video_card(image, audio, artifacts["audio.playback"]["mime"]), unsafe_allow_html=True)
+        else:
+            card = media(job, "video.card", held)
+            if card is None:
+                st.caption(GONE)
+            else:
+                st.markdown(card.decode("utf-8"), unsafe_allow_html=True)
+        if info.get("scene_rows"):
+            with st.expander("🎞️ Scene timings"):
+                st.table(info["scene_rows"])
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    if state["status"] == "done":
+        # Download Section
+        st.markdown('<div class="result-section">', unsafe_allow_html=True)
+        st.markdown('<div class="section-title">💾 Download Your Creation</div>', unsafe_allow_html=True)
         
-        tab1, tab2 = st.tabs(["✨ Enhanced Version", "📄 Original Draft"])
-        with tab1:
-            st.markdown(f"<div style='font-size: 1.1rem; line-height: 1.8; color: #333;'>{final_text}</div>", unsafe_allow_html=True)
-        with tab2:
-            st.markdown(f"<div style='font-size: 1rem; line-height: 1.7; color: #666;'>{raw}</div>", unsafe_allow_html=True)
+        has_mp4 = "video" in artifacts
+        cols = st.columns(4 if has_mp4 else 3)
+        with cols[0]:
+            if info.get("scenes"):
+                download(job, "scenes.zip", "📥 Scenes", "ai_storyboard.zip", "application/zip")
+            else:
+                image = artifacts["image"]
+                download(job, "image", "📥 Image", f"ai_scene.{image['file'].rsplit('.', 1)[-1]}", image["mime"])
+        with cols[1]:
+            narration = artifacts["audio.download"]
+            download(job, "audio.download", "📥 Audio", f"ai_voice.{narration['file'].rsplit('.', 1)[-1]}", narration["mime"])
+        with cols[2]:
+            st.download_button("📥 Story", state["story"], "ai_story.txt", "text/plain", use_container_width=True)
+        if has_mp4:
+            with cols[3]:
+                download(job, "video", "📥 Video", "ai_video.mp4", "video/mp4")
         
         st.markdown('</div>', unsafe_allow_html=True)
         
-        # Step 2: Generate Image
-        status.markdown('<div class="status-badge">🎨 Creating your image...</div>', unsafe_allow_html=True)
-        img_data = generate_image(final_text)
-        
-        if img_data:
-            progress.progress(50)
-            
-            st.markdown('<div class="result-section">', unsafe_allow_html=True)
-            st.markdown('<div class="section-title">🖼️ Your Image</div>', unsafe_allow_html=True)
-            st.image(img_data, use_container_width=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Step 3: Generate Voice
-            status.markdown('<div class="status-badge">🎙️ Generating voice narration...</div>', unsafe_allow_html=True)
-            audio_data = generate_voice(final_text)
-            
-            if audio_data:
-                progress.progress(75)
-                
-                st.markdown('<div class="result-section">', unsafe_allow_html=True)
-                st.markdown('<div class="section-title">🎵 Your Audio</div>', unsafe_allow_html=True)
-                st.audio(audio_data, format="audio/mp3")
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Step 4: Create Video
-                status.markdown('<div class="status-badge">🎬 Composing final video...</div>', unsafe_allow_html=True)
-                
-                img_b64 = base64.b64encode(img_data).decode()
-                audio_b64 = base64.b64encode(audio_data).decode()
-                
-                st.markdown('<div class="result-section">', unsafe_allow_html=True)
-                st.markdown('<div class="section-title">🎥 Your Final Video</div>', unsafe_allow_html=True)
-                
-                video_html = f"""
-                <div style="position: relative; width: 100%; border-radius: 20px; overflow: hidden; box-shadow: 0 20px 60px rgba(0,0,0,0.3);">
-                    <img src="data:image/png;base64,{img_b64}" style="width: 100%; display: block;">
-                    <audio controls autoplay style="width: 100%; position: absolute; bottom: 0; background: rgba(0,0,0,0.7);">
-                        <source src="data:audio/mp3;base64,{audio_b64}" type="audio/mp3">
-                    </audio>
-                </div>
-                """
-                st.markdown(video_html, unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                progress.progress(100)
-                status.markdown('<div class="status-badge" style="background: #11998e;">✅ Complete!</div>', unsafe_allow_html=True)
-                
-                # Download Section
-                st.markdown('<div class="result-section">', unsafe_allow_html=True)
-                st.markdown('<div class="section-title">💾 Download Your Creation</div>', unsafe_allow_html=True)
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.download_button("📥 Image", img_data, "ai_scene.png", "image/png", use_container_width=True)
-                with col2:
-                    st.download_button("📥 Audio", audio_data, "ai_voice.mp3", "audio/mp3", use_container_width=True)
-                with col3:
-                    st.download_button("📥 Story", final_text, "ai_story.txt", "text/plain", use_container_width=True)
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                st.balloons()
+        # Only for a session that watched it finish, not on every later rerun
+        if st.session_state.pop("watching", None) == job.id:
+            st.balloons()
     
+    with st.expander("🐞 Debug: run waterfall"):
+        st.markdown(render_waterfall(info.get("waterfall", [])), unsafe_allow_html=True)
+    
+    account(held)
+    stats = get_result_cache().stats()
+    st.caption(f"♻️ Cache: {stats['hits']} hits · {stats['misses']} misses · {stats['entries']} entries ({stats['bytes'] / 1e6:.1f} MB)")
+    with st.expander("📡 Connection & quota stats"):
+        workers = manager.stats()
+        st.caption(f"**jobs** — {workers['running']} running · {workers['queued']} queued · "
+                   f"{workers['finished']} finished · {workers['max_jobs']} workers")
+        memory, store = get_memory_ledger().stats(), get_artifact_store().stats()
+        st.caption(f"**memory** — this page holds {held['inline'] / 1e6:.1f} MB of media in the app "
+                   f"({held['referenced'] / 1e6:.1f} MB served by reference) · {memory['sessions']} sessions hold "
+                   f"{memory['inline'] / 1e6:.1f} MB (largest {memory['max_inline'] / 1e6:.1f} MB) · "
+                   f"process RSS {memory['rss'] / 1e6:.0f} MB")
+        st.caption(f"**artifacts** — {store['entries']} files · {store['bytes'] / 1e6:.1f} MB · "
+                   f"{store['deduplicated']} duplicate writes skipped · {store['evictions']} evicted")
+        for host, conn in http_client.connection_stats().items():
+            st.caption(f"**{host}** — {conn['requests']} requests · {conn['connections_reused']} reused "
+                       f"({conn['reuse_rate']:.0%}) · {conn['retries']} retries · {conn['failures']} failures")
+        for name, limiter in providers.LIMITS.items():
+            quota = limiter.stats()
+            st.caption(f"**{name}** — {quota['calls']} calls · {quota['wait_time']:.1f}s waiting for quota vs "
+                       f"{quota['api_time']:.1f}s in API · {quota['queued']} queued now")
+        for stage, router in providers.ROUTES.items():
+            routes = [f"{r['backend']} {BREAKER_ICONS[r['state']]} {r['calls']} calls, {r['error_rate']:.0%} errors"
+                      + (f", p90 {r['p90']:.1f}s" if r["p90"] is not None else "") + (" (lagging)" if r["lagging"] else "")
+                      for r in router.stats()]
+            st.caption(f"**{stage} route** — " + " · ".join(routes))
+        for key, live in TRACKER.stats().items():
+            st.caption(f"**{key}** live latency — p50 {live['p50']:.2f}s · p90 {live['p90']:.2f}s ({live['samples']} samples)")
     st.markdown('</div>', unsafe_allow_html=True)
 
-elif generate_button:
-    st.warning("⚠️ Please enter a scene description first!")
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+@profiler.fragment("job progress")
+def job_progress(job):
+    """A running job's pane, redrawn on a timer without rerunning the rest of the page"""
+    state = job.snapshot()
+    if state["status"] not in ACTIVE:
+        # Finished: one full rerun swaps this timer for the static results pane
+        st.rerun()
+    st.session_state.watching = job.id
+    render_job(manager, job, state)
+
+@st.fragment
+@profiler.fragment("job results")
+def job_results(job):
+    render_job(manager, job, job.snapshot())
+
+# A reconnecting session finds its job again through the ?job= link
+current_job = manager.get(st.session_state.get("job_id") or st.query_params.get("job"))
+if current_job is not None:
+    (job_progress if current_job.active else job_results)(current_job)
+
+@st.fragment
+def profiler_pane():
+    """Off by default, so the profiler's own tables are not part of what it measures"""
+    if not st.toggle("⏱️ Rerun profiler", key="show_profiler"):
+        return
+    st.caption("Script time and websocket bytes of this session's recent reruns. A full-page rerun is what every "
+               "click used to cost; the input and job panes are fragments, so using them reruns only that pane.")
+    st.button("🔄 Refresh", key="refresh_profile")
+    st.table(profiler.summary())
+    st.table([{"scope": run["scope"], "at": time.strftime("%H:%M:%S", time.localtime(run["at"])),
+               "ms": round(run["ms"], 1), "KB sent": round(run["bytes"] / 1024, 1) if run["bytes"] is not None else None, "messages": run["messages"]}
+              for run in reversed(list(profiler.runs)[-8:])])
+
+profiler_pane()
 
 # ═══════════════════════════════════════════════════════════
 # FOOTER
@@ -504,3 +1001,5 @@ st.markdown("""
     </p>
 </div>
 """, unsafe_allow_html=True)
+
+profiler.finish_page()
@@ -0,0 +1,187 @@
+# tts.py — Sentence-chunked, parallel ElevenLabs synthesis with progressive playback
+import contextlib
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import metrics
+import pipeline
+
+ELEVENLABS_TTS = os.environ.get("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io/v1") + "/text-to-speech"
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+")
+
+
+def split_sentences(text, min_chars=80, max_chars=400):
+    """Split narration at sentence boundaries, merging short sentences and breaking up long ones"""
+    sentences = [s.strip() for s in _SENTENCE_END.split(text.strip()) if s.strip()]
+    chunks, current = [], ""
+    for sentence in sentences:
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        current = f"{current} {sentence}".strip() if current else sentence
+        if len(current) >= min_chars:
+            chunks.append(current)
+            current = ""
+    if current:
+        if chunks and len(chunks[-1]) + len(current) < max_chars:
+            chunks[-1] = f"{chunks[-1]} {current}"
+        else:
+            chunks.append(current)
+    return chunks
+
+
+def strip_id3(data):
+    """Drop a leading ID3v2 tag so MP3 chunks concatenate into one continuous stream"""
+    if len(data) > 10 and data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return data[10 + size + footer:]
+    return data
+
+
+# MPEG audio frame header tables: kbit/s by bitrate index, Hz by sample-rate index
+_MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1 Layer III
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 Layer III
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mp3_duration(data):
+    """Seconds of audio in MP3 bytes, summed from the Layer III frame headers (0.0 if none are found)"""
+    data = strip_id3(data)
+    pos, seconds = 0, 0.0
+    while True:
+        pos = data.find(b"\xff", pos)
+        if pos < 0 or pos + 4 > len(data):
+            return seconds
+        b1, b2 = data[pos + 1], data[pos + 2]
+        version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index, padding = b2 >> 4, (b2 >> 2) & 3, (b2 >> 1) & 1
+        if b1 & 0xE0 != 0xE0 or version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+        samples = 1152 if version == 3 else 576
+        seconds += samples / sample_rate
+        pos += samples // 8 * bitrate // sample_rate + padding
+
+
+class TTSReport:
+    """Latency figures for one narration"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.reset()
+
+    def reset(self):
+        """Start over, e.g. when another provider takes the narration over from a failed one"""
+        self.started = time.perf_counter()
+        self.first_audio = None
+        self.total = None
+        self.chunks = 0
+        self.bytes = 0
+        # Per chunk: characters, synthesis seconds and audio bytes/duration, in narration order
+        self.segments = []
+
+    def summary(self):
+        first = f"{self.first_audio:.2f} s" if self.first_audio is not None else "—"
+        total = f"{self.total:.2f} s" if self.total is not None else "—"
+        return f"{self.mode}: first audio {first} · total {total} · {self.chunks} chunk(s) · {self.bytes / 1024:.0f} KB"
+
+
+class ElevenLabsTTS:
+    """Synthesizes sentence chunks concurrently and hands them back in narration order"""
+
+    def __init__(self, key, voice_id, model_id, voice_settings, max_concurrency=3,
+                 output_format="mp3_44100_128", streaming=True, slot=None):
+        self.key = key
+        self.voice_id = voice_id
+        self.model_id = model_id
+        self.voice_settings = voice_settings
+        self.max_concurrency = max_concurrency
+        self.output_format = output_format
+        self.streaming = streaming
+        # Context manager factory held around each request, e.g. the provider's rate-limit slot
+        self.slot = slot or contextlib.nullcontext
+
+    def _payload(self, text, previous_text=None, next_text=None):
+        payload = {"text": text, "model_id": self.model_id, "voice_settings": self.voice_settings}
+        # Neighbouring text keeps prosody continuous across chunk boundaries
+        if previous_text:
+            payload["previous_text"] = previous_text
+        if next_text:
+            payload["next_text"] = next_text
+        return payload
+
+    def synthesize_chunk(self, text, previous_text=None, next_text=None):
+        """One ElevenLabs request, using the streaming endpoint when enabled"""
+        url = f"{ELEVENLABS_TTS}/{self.voice_id}"
+        if self.streaming:
+            url += "/stream"
+        with self.slot():
+            response = http_client.post(url, stage="voice", stream=self.streaming,
+                                        params={"output_format": self.output_format},
+                                        headers={"xi-api-key": self.key},
+                                        json=self._payload(text, previous_text, next_text))
+            with response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"ElevenLabs returned HTTP {response.status_code}: {response.text[:300]}")
+                if not self.streaming:
+                    return response.content
+                return b"".join(response.iter_content(chunk_size=16384))
+
+    def synthesize(self, text, on_first_audio=None, report=None, segments=None):
+        """Narrate `text`; `on_first_audio(mp3_bytes)` fires as soon as the opening chunk is ready.
+
+        `segments` (e.g. storyboard scenes) replaces the sentence split, so the
+        report's per-segment durations line up with them.
+        """
+        report = report or TTSReport("chunked")
+        chunks = [c for c in segments if c.strip()] if segments else split_sentences(text)
+        if not chunks:
+            return None
+        report.chunks = len(chunks)
+        trace, parent = metrics.current_trace(), metrics.current_parent()
+
+        def work(i):
+            prev_text = chunks[i - 1] if i > 0 else None
+            next_text = chunks[i + 1] if i + 1 < len(chunks) else None
+            started = time.perf_counter()
+            with metrics.use_trace(trace, parent), metrics.span(f"tts chunk {i + 1}/{len(chunks)}", kind="tts"):
+                audio = self.synthesize_chunk(chunks[i], prev_text, next_text)
+            return (audio if i == 0 else strip_id3(audio)), time.perf_counter() - started
+
+        # Results are collected in order on the calling thread, so the callback and
+        # cancellation checks run where the pipeline's context lives
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="tts")
+        try:
+            futures = [executor.submit(work, i) for i in range(len(chunks))]
+            results = []
+            for i, future in enumerate(futures):
+                audio, elapsed = future.result()
+                results.append(audio)
+                report.segments.append({"chars": len(chunks[i]), "synthesis": elapsed, "bytes": len(audio),
+                                        "duration": mp3_duration(audio)})
+                if i == 0:
+                    report.first_audio = time.perf_counter() - report.started
+                    if on_first_audio:
+                        on_first_audio(results[0])
+                if pipeline.cancelled():
+                    return None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        audio = b"".join(results)
+        report.total = time.perf_counter() - report.started
+        report.bytes = len(audio)
+        return audio
@@ -0,0 +1,137 @@
+# video.py — H.264/AAC MP4 encoding of still image(s) + narration with a local ffmpeg
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pipeline
+
+RENDER_DIR = os.path.join(tempfile.gettempdir(), "ai-video-renders")
+
+
+class EncodeFailed(Exception):
+    """ffmpeg exited with an error or was cancelled"""
+
+
+class EncodeResult:
+    """A finished MP4 on disk, served by path rather than held in memory"""
+
+    def __init__(self, path, encode_time, cached=False):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.encode_time = encode_time
+        self.cached = cached
+
+    def summary(self):
+        source = "reused render" if self.cached else f"encoded in {self.encode_time:.1f} s"
+        return f"🎞️ H.264/AAC MP4 · {self.size / 1e6:.2f} MB · {source}"
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def cleanup(directory=RENDER_DIR, max_age=6 * 3600):
+    """Delete renders older than `max_age` seconds"""
+    now = time.time()
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def _run(cmd, timeout):
+    """Run ffmpeg, killing it on timeout or pipeline cancellation"""
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                _, stderr = proc.communicate(timeout=0.25)
+                break
+            except subprocess.TimeoutExpired:
+                if pipeline.cancelled() or time.monotonic() > deadline:
+                    proc.kill()
+                    proc.communicate()
+                    raise EncodeFailed("ffmpeg was cancelled or timed out")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    if proc.returncode != 0:
+        lines = stderr.decode("utf-8", "replace").strip().splitlines()
+        raise EncodeFailed(lines[-1] if lines else f"ffmpeg exited with code {proc.returncode}")
+
+
+def encode_slideshow(images, audio, durations=None, size=(768, 512), fps=24, audio_bitrate="128k",
+                     directory=RENDER_DIR, timeout=180):
+    """Mux one or more still images with the narration into an MP4 file.
+
+    With several images, `durations` gives the seconds each one stays on screen
+    (the last image holds until the audio ends). Identical inputs reuse the
+    previous render.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    for data in list(images) + [audio, repr((durations, size, fps, audio_bitrate)).encode()]:
+        digest.update(hashlib.sha256(data).digest())
+    out_path = os.path.join(directory, f"{digest.hexdigest()[:32]}.mp4")
+    if os.path.exists(out_path):
+        os.utime(out_path)
+        return EncodeResult(out_path, 0.0, cached=True)
+    cleanup(directory)
+
+    width, height = size
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        image_paths = []
+        for i, data in enumerate(images):
+            path = os.path.join(work, f"scene{i:03d}.img")
+            with open(path, "wb") as f:
+                f.write(data)
+            image_paths.append(path)
+        audio_path = os.path.join(work, "narration.audio")
+        with open(audio_path, "wb") as f:
+            f.write(audio)
+
+        if len(image_paths) == 1:
+            video_input = ["-loop", "1", "-framerate", str(fps), "-i", image_paths[0]]
+        else:
+            durations = list(durations or [])
+            lines = []
+            for i, path in enumerate(image_paths):
+                lines.append(f"file '{path}'")
+                # The last scene is held open and -shortest trims it to the narration
+                hold = durations[i] if i < len(durations) and i < len(image_paths) - 1 else 3600
+                lines.append(f"duration {hold:.3f}")
+            # The concat demuxer needs the last file repeated for its duration to apply
+            lines.append(f"file '{image_paths[-1]}'")
+            list_path = os.path.join(work, "scenes.txt")
+            with open(list_path, "w") as f:
+                f.write("\n".join(lines))
+            video_input = ["-f", "concat", "-safe", "0", "-i", list_path]
+
+        tmp_out = os.path.join(work, "out.mp4")
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            *video_input,
+            "-i", audio_path,
+            "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                   f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p,fps={fps}",
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage", "-crf", "23",
+            "-c:a", "aac", "-b:a", audio_bitrate,
+            "-shortest", "-movflags", "+faststart",
+            tmp_out,
+        ]
+        _run(cmd, timeout)
+        os.replace(tmp_out, out_path)
+    return EncodeResult(out_path, time.perf_counter() - start)
+
+
+def encode_video(image, audio, **kwargs):
+    """Single still image + narration"""
+    return encode_slideshow([image], audio, **kwargs)